@@ -2,8 +2,25 @@
 
 import yaml
 import os
-from snakemake import snakemake
-from pkg_resources import resource_filename
+
+from bioinformatics.instrumentation import RunInstrumentation
+from bioinformatics.resources import (detect_cores, detect_memory_mb, parse_memory_mb,
+                                      load_cluster_config)
+
+# default cap on concurrently submitted jobs per cluster environment
+CONTEXT_MAX_JOBS = {"broad": 200, "lisa": 50}
+# execution modes that submit jobs with per-rule resource requests
+CLUSTER_MODES = ("drmaa", "qsub", "array", "toil")
+
+
+def drop_none(config):
+    """
+    Copy of `config` without None values. Snakemake passes the config to
+    cluster jobs on their command line, which turns None into 'None'; the
+    config file still holds them as null.
+    """
+    return dict((key, drop_none(value) if isinstance(value, dict) else value)
+                for key, value in config.items() if value is not None)
 
 
 class Tool():
@@ -12,46 +29,149 @@ class Tool():
     """
 
     def __init__(self, snakefile, log_handler):
-        self.snakefile = snakefile
+        # (package, resource name) of the snakefile, resolved on first use
+        # so that building the command line stays cheap
+        self.snakefile_resource = snakefile
         self.log_handler = log_handler
 
+    @property
+    def snakefile(self):
+        from pkg_resources import resource_filename
+        return resource_filename(*self.snakefile_resource)
+
+    def prepare(self, config):
+        """
+        Fill in config values derived from the inputs before the run is
+        planned. Runs once, before submission.
+        """
+        pass
+
+    def plan_resources(self, config):
+        """
+        Per-rule cluster settings estimated from the run's inputs, in the
+        layout of cluster_config.yaml. Tools override this; rules without an
+        estimate keep the bundled settings. Only called for cluster modes,
+        where the estimates size job submissions.
+        """
+        return {}
+
+    def parallel_jobs(self, config):
+        """
+        Largest number of jobs of the workflow that can run at once.
+        """
+        return 1
+
+    def array_phases(self, config):
+        """
+        Rule instances submitted together as array jobs in array mode, as a
+        list of (rule, [targets of each instance]). Stages before the first
+        phase are packed into one job; tools without phases run as a single
+        job.
+        """
+        return []
+
+    def toil_root(self, config):
+        """
+        Root job of the tool's Toil workflow, returning {output path relative
+        to the output directory: file store ID}.
+        """
+        raise Exception("This tool cannot run in toil mode")
+
+    def max_jobs(self, context, config):
+        """
+        Concurrency cap: the workflow's widest stage, bounded by the
+        cluster environment's job limit or --max-jobs.
+        """
+        limit = config.get("max_jobs") or CONTEXT_MAX_JOBS.get(context, 1)
+        return max(1, min(self.parallel_jobs(config), limit))
+
+    def write_cluster_config(self, config, estimate=True):
+        """
+        Merge the tool's resource estimates, if `estimate` is set, into the
+        bundled cluster configuration and write it next to the run's config
+        file.
+        """
+        cluster_settings = load_cluster_config()
+        plan = self.plan_resources(config) if estimate else {}
+        for rule, settings in plan.items():
+            cluster_settings.setdefault(rule, {}).update(settings)
+        cluster_config = os.path.join(config["output_dir"], ".config/cluster_config.yaml")
+        with open(cluster_config, 'w') as cluster_conn:
+            yaml.dump(cluster_settings, cluster_conn, default_flow_style=False)
+        return cluster_config
+
     def execute(self, execution_mode, context, config):
         """
         Execute the tool workflow
+
+        Rules fingerprint their inputs and reuse outputs from the shared
+        result store (see bioinformatics.provenance) unless
+        `no_result_store` is set in the config.
         """
+        config.setdefault("no_result_store", False)
+
+        if execution_mode == "local":
+            # rules read the memory limit to cap their own requests
+            config["cores"] = config.get("cores") or detect_cores()
+            config["max_mem_mb"] = (parse_memory_mb(config["max_mem"])
+                                    if config.get("max_mem") else detect_memory_mb())
+        elif execution_mode == "toil":
+            # Toil jobs cap their requests at what the batch system can offer
+            from bioinformatics.toil_runner import memory_limit_mb
+            config["max_mem_mb"] = memory_limit_mb(context, config)
 
         if not os.path.exists(os.path.join(config["output_dir"], '.config')):
             os.makedirs(os.path.join(config["output_dir"], '.config'))
+        self.prepare(config)
+        config["cluster_config"] = self.write_cluster_config(
+            config, estimate=execution_mode in CLUSTER_MODES)
         config_file = os.path.join(config["output_dir"], ".config/config.yaml")
         with open(config_file, 'w') as config_conn:
             yaml.dump(config, config_conn, default_flow_style=True)
 
+        if execution_mode == "toil":
+            from bioinformatics.toil_runner import run_toil
+            print("Executing Ricopili bioinformatics with Toil")
+            if run_toil(self, context, config) is not None:
+                print("done")
+            return
+
+        # job timings and resources are reported to output_dir after the run
+        instrumentation = RunInstrumentation(config["output_dir"], forward=self.log_handler)
         base_api_call = {"snakefile": self.snakefile,
-                         "log_handler": self.log_handler,
-                         "config": config,
-                         "configfile": config_file,
+                         "log_handler": [instrumentation],
+                         "config": drop_none(config),
+                         "configfiles": [config_file],
                          "latency_wait": 60,
-                         "cluster_config": resource_filename(
-                             "bioinformatics.config",
-                             "cluster_config.yaml")}
+                         "cluster_config": config["cluster_config"]}
 
         if execution_mode == "local":
-            # API call is already appropriately set
-            pass
+            base_api_call["cores"] = config["cores"]
+            base_api_call["resources"] = {"mem_mb": config["max_mem_mb"]}
+            print("Running locally on {cores} cores with {mem} MB of memory".format(
+                cores=config["cores"], mem=config["max_mem_mb"]))
         elif execution_mode == "drmaa":
             base_api_call["drmaa"] = ""
         elif execution_mode == "qsub":
             base_api_call["cluster"] = "qsub"
+        elif execution_mode == "array":
+            # array jobs run up to the merges, which then run here
+            base_api_call["cores"] = config.get("cores") or 1
 
         if context == "broad" and execution_mode == "drmaa":
             os.system("eval `/broad/software/dotkit/init -b`; use UGER")
             base_api_call["drmaa"] += " -l h_vmem={cluster.h_vmem} "
-            base_api_call["nodes"] = 22
+            base_api_call["nodes"] = self.max_jobs(context, config)
         elif context == "lisa" and execution_mode == "drmaa":
             base_api_call["drmaa"] += " -l mem={cluster.h_vmem} "
             base_api_call["drmaa"] += " -l walltime={cluster.walltime}"
-            base_api_call["nodes"] = 1
+            base_api_call["nodes"] = self.max_jobs(context, config)
             # os.environ["DRMAA_LIBRARY_PATH"] = "/usr/lib/pbs-drmaa/lib/libdrmaa.so.1.0.10"
+        elif execution_mode == "array":
+            from bioinformatics.job_array import ArrayRunner
+            array_runner = ArrayRunner(self.snakefile, config, config_file, context,
+                                       self.array_phases(config),
+                                       latency_wait=base_api_call["latency_wait"])
         elif execution_mode == "local":
             pass
         else:
@@ -59,7 +179,14 @@ class Tool():
                             "mode combination is not currently supported")
 
         # execute workflow
+        from snakemake import snakemake
         print("Executing Ricopili bioinformatics")
+        if execution_mode == "array":
+            if not array_runner.run():
+                print("Array jobs failed, see {}".format(array_runner.log_dir))
+                return
+            print("Array report written to {}".format(array_runner.write_report()))
         returncode = snakemake(**base_api_call)
+        print("Run report written to {}".format(instrumentation.write_report()))
         if returncode == 1:
             print("done")
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+"""
+Benchmark the daner-to-results stages of the bioinformatics workflows.
+
+Synthetic daner files of the requested sizes (plain and gzipped) and a
+synthetic gene location file are generated once in the work directory.
+Every stage then runs in a fresh process in the same way its workflow rule
+runs it, and the wall time, CPU time, peak RSS and bytes read by that process
+are recorded. Results are written as JSON. Pass an earlier result file as
+`--baseline` to compare stage times between versions.
+
+    python -m bioinformatics.benchmark --snps 1000000 5000000 --output bench.json
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+from pkg_resources import resource_filename
+
+from bioinformatics.cache import ContentCache
+from bioinformatics.daner_cache import load_daner, opened_store, write_snp_loc
+from bioinformatics.tools.magma.annotate import GeneIndex, annotate
+from bioinformatics.tools.magma.batching import (batch_name, batch_annot_file, write_batches,
+                                                 DEFAULT_LD_BLOCK_SNPS)
+from bioinformatics.tools.magma.merge import merge_gene_results, write_gene_index
+from bioinformatics.tools.magma.shard import write_shards
+from bioinformatics.tools.region_annotator.engine import (load_reference_data, format_regions,
+                                                          annotate_regions, write_sheets)
+
+# hg19 lengths of the autosomes
+CHROMOSOME_LENGTHS = [249250621, 243199373, 198022430, 191154276, 180915260,
+                      171115067, 159138663, 146364022, 141213431, 135534747,
+                      135006516, 133851895, 115169878, 107349540, 102531392,
+                      90354753, 81195210, 78077248, 59128983, 63025520,
+                      48129895, 51304566]
+
+N_CASES = 35476
+N_CONTROLS = 46839
+DIRECTIONS = ["+++-+", "--+-?", "+-+-+", "?++--", "-----", "+++++"]
+DANER_LINE = ("{}\trs{}\t{}\t{}\t{}\t{:.4g}\t{:.4g}\t{:.3f}\t{:.5f}\t{:.4f}\t{:.4g}"
+              "\t0\t{}\t0.0\t1.000\t4\t0.5\n")
+CHUNK_SIZE = 200000
+# cold start of `bioinformatics --help`, in seconds
+CLI_STARTUP_TARGET = 0.15
+
+
+def _per_chromosome(total):
+    """
+    Split a count over the autosomes in proportion to their length.
+    """
+    lengths = np.asarray(CHROMOSOME_LENGTHS, dtype=np.float64)
+    counts = np.floor(total * lengths / lengths.sum()).astype(np.int64)
+    counts[0] += total - counts.sum()
+    return counts
+
+
+def write_synthetic_daner(path, n_snps, seed=0, compress=False):
+    """
+    Write a daner file with `n_snps` SNPs spread over the autosomes in
+    position order, with the columns of a Ricopili meta-analysis.
+    """
+    rng = np.random.RandomState(seed)
+    header = ["CHR", "SNP", "BP", "A1", "A2",
+              "FRQ_A_{}".format(N_CASES), "FRQ_U_{}".format(N_CONTROLS),
+              "INFO", "OR", "SE", "P", "ngt", "Direction",
+              "HetISqt", "HetChiSq", "HetDf", "HetPVa"]
+    alleles = np.array(list("ACGT"))
+    directions = np.array(DIRECTIONS)
+
+    tmp_path = path + ".tmp"
+    opener = gzip.open if compress else open
+    snp_id = 0
+    with opener(tmp_path, "wt") as daner_conn:
+        daner_conn.write('\t'.join(header) + '\n')
+        for chrom, count in enumerate(_per_chromosome(n_snps), start=1):
+            positions = np.sort(rng.randint(1, CHROMOSOME_LENGTHS[chrom - 1], size=count))
+            for start in range(0, count, CHUNK_SIZE):
+                bp = positions[start:start + CHUNK_SIZE]
+                size = len(bp)
+                frq_a = rng.uniform(0.001, 0.999, size)
+                frq_u = np.clip(frq_a + rng.normal(0, 0.005, size), 0.001, 0.999)
+                se = rng.uniform(0.01, 0.1, size)
+                odds = np.exp(rng.normal(0, 0.02, size))
+                rows = zip([chrom] * size, range(snp_id, snp_id + size), bp.tolist(),
+                           alleles[rng.randint(0, 4, size)].tolist(),
+                           alleles[rng.randint(0, 4, size)].tolist(),
+                           frq_a.tolist(), frq_u.tolist(),
+                           rng.uniform(0.3, 1.0, size).tolist(), odds.tolist(),
+                           se.tolist(), rng.uniform(0, 1, size).tolist(),
+                           directions[rng.randint(0, len(directions), size)].tolist())
+                daner_conn.write("".join(DANER_LINE.format(*row) for row in rows))
+                snp_id += size
+    os.rename(tmp_path, path)
+
+
+def write_synthetic_gene_loc(path, n_genes, seed=0):
+    """
+    Write a MAGMA gene location file with `n_genes` genes of log-normally
+    distributed length (median 20 kb).
+    """
+    rng = np.random.RandomState(seed)
+    gene_id = 1
+    with open(path, 'w') as gene_loc_conn:
+        for chrom, count in enumerate(_per_chromosome(n_genes), start=1):
+            starts = np.sort(rng.randint(1, CHROMOSOME_LENGTHS[chrom - 1], size=count))
+            lengths = np.clip(rng.lognormal(np.log(20000), 1.0, count), 500, 2000000)
+            strands = np.where(rng.uniform(0, 1, count) < 0.5, "+", "-")
+            for start, length, strand in zip(starts.tolist(), lengths.astype(int).tolist(),
+                                             strands.tolist()):
+                gene_loc_conn.write("{0}\t{1}\t{2}\t{3}\t{4}\tGENE{0}\n".format(
+                    gene_id, chrom, start, start + length, strand))
+                gene_id += 1
+
+
+def write_synthetic_gene_results(prefix, gene_loc_file, n_batches, seed=0):
+    """
+    Write per-batch MAGMA .genes.out/.genes.raw files for the genes of a gene
+    location file, as inputs for the merge stage.
+    """
+    rng = np.random.RandomState(seed)
+    with open(gene_loc_file) as gene_loc_conn:
+        genes = [line.split() for line in gene_loc_conn if line.strip()]
+    bounds = np.linspace(0, len(genes), n_batches + 1).astype(int)
+    for batch in range(1, n_batches + 1):
+        name = "{}.{}".format(prefix, batch_name(batch, n_batches))
+        with open(name + ".genes.out", 'w') as out_conn, \
+                open(name + ".genes.raw", 'w') as raw_conn:
+            out_conn.write("GENE CHR START STOP NSNPS NPARAM N ZSTAT P\n")
+            raw_conn.write("# VERSION = 108\n# COVAR = NSAMP MAC\n")
+            for gene in genes[bounds[batch - 1]:bounds[batch]]:
+                n_snps = rng.randint(1, 500)
+                zstat = rng.normal()
+                out_conn.write("{} {} {} {} {} {} 82315 {:.4f} {:.4g}\n".format(
+                    gene[0], gene[1], gene[2], gene[3], n_snps, min(n_snps, 20),
+                    zstat, rng.uniform()))
+                raw_conn.write("{} {} {} {} {} {} 82315 {} {:.4f}\n".format(
+                    gene[0], gene[1], gene[2], gene[3], n_snps, min(n_snps, 20),
+                    rng.randint(100, 100000), zstat))
+
+
+def stage_daner_store(run):
+    store = load_daner(run["daner"], ContentCache(run["cache"]))
+    with open(run["store_marker"], 'w') as marker_conn:
+        marker_conn.write(store.directory + '\n')
+
+
+def stage_snp_loc(run):
+    write_snp_loc(opened_store(run["store_marker"]), run["snp_loc"])
+
+
+def stage_annotation(run):
+    annotate(opened_store(run["store_marker"]), GeneIndex(run["gene_loc"]),
+             run["annot"], snp_loc_file=run["snp_loc"])
+
+
+def stage_batching(run):
+    write_batches(run["annot"], run["gene_loc"], run["batch_dir"], run["batches"],
+                  ld_block_snps=run["ld_block_snps"])
+
+
+def stage_shards(run):
+    n_batches = run["batches"]
+    annot_files = dict((batch_name(batch, n_batches),
+                        batch_annot_file(run["batch_dir"], batch, n_batches))
+                       for batch in range(1, n_batches + 1))
+    write_shards(opened_store(run["store_marker"]), run["shard_dir"], annot_files,
+                 threads=run["threads"])
+
+
+def stage_format_input(run):
+    format_regions(run["clump"], run["formatted"])
+
+
+def stage_region_annotation(run):
+    gene_file = resource_filename(
+        "bioinformatics.tools.region_annotator",
+        "resources/RegionAnnotator-1.6.1/inputGene/gencode.genes.txt")
+    reference_directory = resource_filename(
+        "bioinformatics.tools.region_annotator",
+        "resources/RegionAnnotator-1.6.1/inputReference/")
+    reference_data = load_reference_data(gene_file, reference_directory,
+                                         ContentCache(run["cache"]))
+    write_sheets(annotate_regions(run["formatted"], reference_data), run["regions_dir"])
+
+
+def stage_merge(run):
+    n_batches = run["batches"]
+    merge_gene_results(["{}.{}".format(run["gene_results"], batch_name(batch, n_batches))
+                        for batch in range(1, n_batches + 1)], run["merged"])
+    write_gene_index(run["merged"] + ".genes.out", run["merged"] + ".genes.sqlite",
+                     run["gene_loc"])
+
+
+# stage name -> (function, stages whose outputs it reads)
+STAGES = [("daner_store", stage_daner_store, []),
+          ("snp_loc", stage_snp_loc, ["daner_store"]),
+          ("annotation", stage_annotation, ["daner_store", "snp_loc"]),
+          ("batching", stage_batching, ["annotation"]),
+          ("shards", stage_shards, ["daner_store", "batching"]),
+          ("format_input", stage_format_input, []),
+          ("region_annotation", stage_region_annotation, ["format_input"]),
+          ("merge", stage_merge, [])]
+STAGE_NAMES = [name for name, _, _ in STAGES]
+
+
+def required_stages(selected):
+    """
+    The selected stages plus the stages they depend on, in run order.
+    """
+    requires = dict((name, depends) for name, _, depends in STAGES)
+    needed = set()
+    pending = list(selected)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(requires[name])
+    return [name for name in STAGE_NAMES if name in needed]
+
+
+def _read_io():
+    # bytes passed through read calls (rchar) and fetched from storage
+    # (read_bytes); memory-mapped store reads only count towards the latter.
+    # Only available on Linux
+    counters = {}
+    try:
+        with open("/proc/self/io") as io_conn:
+            for line in io_conn:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except (IOError, OSError):
+        pass
+    return counters
+
+
+def _measure(name, run, queue):
+    function = dict((stage, function) for stage, function, _ in STAGES)[name]
+    io_before = _read_io()
+    start = time.perf_counter()
+    function(run)
+    seconds = time.perf_counter() - start
+    io_after = _read_io()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    queue.put({"seconds": seconds,
+               "cpu_seconds": (usage.ru_utime + usage.ru_stime
+                               + children.ru_utime + children.ru_stime),
+               # ru_maxrss is in KB on Linux
+               "peak_rss_mb": max(usage.ru_maxrss, children.ru_maxrss) / 1024.0,
+               "bytes_read": io_after.get("rchar", 0) - io_before.get("rchar", 0),
+               "disk_bytes_read": (io_after.get("read_bytes", 0)
+                                   - io_before.get("read_bytes", 0))})
+
+
+def measure_stage(name, run):
+    """
+    Run one stage in a fresh process and return its measurements.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(name, run, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("Benchmark stage {} failed with exit code {}".format(
+            name, process.exitcode))
+    return queue.get()
+
+
+def prepare_fixtures(work_dir, n_snps, compression, n_genes, n_regions, seed):
+    """
+    Create (or reuse) the synthetic inputs for one daner size and compression.
+    """
+    fixture_dir = os.path.join(work_dir, "fixtures")
+    os.makedirs(fixture_dir, exist_ok=True)
+
+    daner = os.path.join(fixture_dir, "synthetic_{}_{}.daner".format(n_snps, seed))
+    if compression == "gzip":
+        daner += ".gz"
+    if not os.path.exists(daner):
+        print("Writing synthetic daner {}".format(daner))
+        write_synthetic_daner(daner, n_snps, seed=seed, compress=compression == "gzip")
+
+    gene_loc = os.path.join(fixture_dir, "synthetic_{}_{}.gene.loc".format(n_genes, seed))
+    if not os.path.exists(gene_loc):
+        write_synthetic_gene_loc(gene_loc, n_genes, seed=seed)
+
+    clump = os.path.join(fixture_dir, "synthetic_{}_{}.clump.daner".format(n_regions, seed))
+    if not os.path.exists(clump):
+        write_synthetic_daner(clump, n_regions, seed=seed + 1)
+    return daner, gene_loc, clump
+
+
+def run_benchmark(work_dir, snps, compressions, stages, n_genes, n_regions,
+                  batches, threads, seed=0, intermediate_format="bgzip"):
+    """
+    Benchmark the selected stages for every daner size and compression.
+    Returns a list of dicts, one per stage and run.
+    """
+    gz = ".gz" if intermediate_format == "bgzip" else ""
+    results = []
+    for n_snps in snps:
+        for compression in compressions:
+            daner, gene_loc, clump = prepare_fixtures(work_dir, n_snps, compression,
+                                                      n_genes, n_regions, seed)
+            run_dir = os.path.join(work_dir, "run_{}_{}".format(n_snps, compression))
+            shutil.rmtree(run_dir, ignore_errors=True)
+            os.makedirs(run_dir)
+            run = {"daner": daner,
+                   "gene_loc": gene_loc,
+                   "clump": clump,
+                   # a fresh cache per run, so the daner store is built cold
+                   "cache": os.path.join(run_dir, "cache"),
+                   "store_marker": os.path.join(run_dir, "daner.store"),
+                   "snp_loc": os.path.join(run_dir, "snp.loc" + gz),
+                   "annot": os.path.join(run_dir, "annotate_summary_stats.genes.annot" + gz),
+                   "batch_dir": os.path.join(run_dir, "batches/"),
+                   "shard_dir": os.path.join(run_dir, "shards/"),
+                   "batches": batches,
+                   "threads": threads,
+                   "ld_block_snps": DEFAULT_LD_BLOCK_SNPS,
+                   "formatted": os.path.join(run_dir, "formated_input.daner" + gz),
+                   "regions_dir": os.path.join(run_dir, "region_annotator_output/"),
+                   "gene_results": os.path.join(run_dir, "gene_results"),
+                   "merged": os.path.join(run_dir, "genomewide_test_results")}
+
+            for stage in stages:
+                if stage == "merge":
+                    write_synthetic_gene_results(run["gene_results"], gene_loc,
+                                                 batches, seed=seed)
+                measurement = measure_stage(stage, run)
+                measurement.update({"snps": n_snps, "compression": compression,
+                                    "stage": stage,
+                                    "input_bytes": os.path.getsize(daner)})
+                results.append(measurement)
+                print("{snps} SNPs ({compression}) {stage}: {seconds:.2f} s, "
+                      "peak RSS {peak_rss_mb:.0f} MB, read {mb_read:.0f} MB".format(
+                          mb_read=measurement["bytes_read"] / 1024.0 ** 2,
+                          **measurement))
+    return results
+
+
+def measure_cli_startup(repeats=5):
+    """
+    Median wall time of `bioinformatics --help` in a fresh interpreter, the
+    import cost paid by every command line call.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bioinformatics")
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+        + [path for path in [environment.get("PYTHONPATH")] if path])
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, script, "--help"],
+                              stdout=subprocess.DEVNULL, env=environment)
+        timings.append(time.perf_counter() - start)
+    seconds = sorted(timings)[len(timings) // 2]
+    print("CLI startup: {:.3f} s (target {:.2f} s){}".format(
+        seconds, CLI_STARTUP_TARGET, "  SLOWER" if seconds > CLI_STARTUP_TARGET else ""))
+    return {"snps": 0, "compression": "none", "stage": "cli_help", "seconds": seconds,
+            "repeats": repeats, "target_seconds": CLI_STARTUP_TARGET}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file, tolerance):
+    """
+    Print stage times against a baseline result file, flagging stages that
+    got slower by more than `tolerance` (a fraction).
+    """
+    with open(baseline_file) as baseline_conn:
+        baseline = json.load(baseline_conn)
+    previous = dict(((result["snps"], result["compression"], result["stage"]),
+                     result["seconds"]) for result in baseline["results"])
+
+    print("Compared to {} ({})".format(baseline_file, baseline.get("git_commit")))
+    regressions = 0
+    for result in results:
+        key = (result["snps"], result["compression"], result["stage"])
+        if key not in previous:
+            continue
+        ratio = result["seconds"] / max(previous[key], 1e-9)
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  SLOWER"
+            regressions += 1
+        print("{} {} {}: {:.2f} s -> {:.2f} s ({:.2f}x){}".format(
+            key[0], key[1], key[2], previous[key], result["seconds"], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stages of the bioinformatics workflows on synthetic data.")
+    parser.add_argument("--snps", nargs="+", type=int, default=[1000000],
+                        help="Daner sizes to benchmark, in SNPs.")
+    parser.add_argument("--compression", nargs="+", choices=["plain", "gzip"],
+                        default=["plain", "gzip"],
+                        help="Daner file formats to benchmark.")
+    parser.add_argument("--stages", nargs="+", choices=STAGE_NAMES, default=STAGE_NAMES,
+                        help="Stages to benchmark. Stages they depend on run as well.")
+    parser.add_argument("--genes", type=int, default=20000,
+                        help="Number of genes in the synthetic gene location file.")
+    parser.add_argument("--regions", type=int, default=500,
+                        help="Number of regions in the synthetic clumped daner.")
+    parser.add_argument("--batches", type=int, default=22,
+                        help="Number of gene batches.")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Threads used by the shard stage.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default="benchmark_work",
+                        help="Directory for fixtures and stage outputs. Fixtures are reused.")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="JSON file to write results to.")
+    parser.add_argument("--baseline",
+                        help="Earlier result file to compare stage times against.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Slowdown (fraction) above which a stage is flagged.")
+    parser.add_argument("--intermediate-format", choices=["bgzip", "plain"], default="bgzip",
+                        help="Format of the intermediate files written by the stages.")
+    parser.add_argument("--cli-startup", action="store_true",
+                        help="Also time `bioinformatics --help` cold starts.")
+    args = parser.parse_args()
+
+    stages = required_stages(args.stages)
+    results = run_benchmark(os.path.abspath(args.work_dir), args.snps,
+                            args.compression, stages, args.genes, args.regions,
+                            args.batches, args.threads, seed=args.seed,
+                            intermediate_format=args.intermediate_format)
+    if args.cli_startup:
+        results.append(measure_cli_startup())
+
+    report = {"git_commit": _git_commit(),
+              "timestamp": datetime.datetime.now().isoformat(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "settings": {"genes": args.genes, "regions": args.regions,
+                           "batches": args.batches, "threads": args.threads,
+                           "seed": args.seed,
+                           "intermediate_format": args.intermediate_format},
+              "results": results}
+    with open(args.output, 'w') as output_conn:
+        json.dump(report, output_conn, indent=2)
+    print("Results written to {}".format(args.output))
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
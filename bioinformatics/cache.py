@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Content-addressed cache shared between runs and users.
+
+Entries live in `<root>/<namespace>/<key>/`, where the key is a hash of the
+inputs the entry was built from. An entry is built once in a temporary
+directory and renamed into place under an exclusive lock, so concurrent jobs
+asking for the same entry wait for the first builder instead of duplicating
+work. Entries are treated as read-only once published: the time an entry
+was last used is stamped on `<key>.access` next to it. Least recently used
+entries are evicted when the cache exceeds its size or age limits, but never
+within `min_idle_days` of their last use, as later jobs of a run keep reading
+entries (e.g. memory-mapped daner stores) without holding a lock.
+"""
+
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+BLOCK_SIZE = 8 * 1024 * 1024
+ACCESS_SUFFIX = ".access"
+LOCK_SUFFIX = ".lock"
+# entries used more recently than this are not evicted; covers a whole run
+DEFAULT_MIN_IDLE_DAYS = 2
+
+
+def default_cache_dir():
+    """
+    Per-user cache directory, honouring XDG_CACHE_HOME.
+    """
+    base = os.environ.get("XDG_CACHE_HOME",
+                          os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "ricopili_bioinformatics")
+
+
+def content_hash(path, block_size=BLOCK_SIZE):
+    """
+    SHA-256 of a file's raw bytes, streamed in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as conn:
+        for block in iter(lambda: conn.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def inputs_hash(paths, extra=()):
+    """
+    Combined hash of files, directories (recursively, in sorted order) and
+    extra strings such as tool versions or settings.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirs, files in os.walk(path):
+                subdirs.sort()
+                for file_name in sorted(files):
+                    file_path = os.path.join(directory, file_name)
+                    digest.update(os.path.relpath(file_path, path).encode())
+                    digest.update(content_hash(file_path).encode())
+        else:
+            digest.update(content_hash(path).encode())
+    for value in extra:
+        digest.update(str(value).encode())
+    return digest.hexdigest()
+
+
+def directory_size(path):
+    """
+    Total size in bytes of the files below a directory.
+    """
+    size = 0
+    for directory, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                size += os.path.getsize(os.path.join(directory, file_name))
+            except OSError:
+                pass
+    return size
+
+
+def _shared_mode(mode):
+    # the mode new files and directories get under the current umask
+    umask = os.umask(0)
+    os.umask(umask)
+    return mode & ~umask
+
+
+def _open_shared(path):
+    """
+    Open a lock or stamp file, creating it writable for everyone the umask
+    allows. Files created by other users without write permission for this
+    one are opened read-only.
+    """
+    try:
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    except PermissionError:
+        return os.open(path, os.O_RDONLY)
+
+
+@contextmanager
+def file_lock(path, shared=False, blocking=True):
+    """
+    Hold an flock on `path` for the duration of the context. Yields False if
+    a non-blocking lock could not be acquired.
+    """
+    lock_fd = _open_shared(path)
+    try:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_fd, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    finally:
+        os.close(lock_fd)
+
+
+def touch_entry(entry):
+    """
+    Stamp a cache entry as used now, so that it is not evicted while a run
+    reads it. Stamps are best effort: one another user created without
+    write permission for this one is left alone.
+    """
+    try:
+        os.close(_open_shared(entry + ACCESS_SUFFIX))
+        os.utime(entry + ACCESS_SUFFIX)
+    except OSError:
+        pass
+
+
+def last_access(entry):
+    """
+    Time an entry was last used, or published if it was never stamped.
+    """
+    for path in (entry + ACCESS_SUFFIX, entry):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            pass
+    return 0
+
+
+class ContentCache():
+    """
+    A content-addressed cache directory.
+
+    `max_bytes` and `max_age_days` bound the cache; None disables the
+    respective limit. Entries used within `min_idle_days` are kept even
+    when the cache is over its limits.
+    """
+
+    def __init__(self, root=None, max_bytes=None, max_age_days=None,
+                 min_idle_days=DEFAULT_MIN_IDLE_DAYS):
+        self.root = root or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.min_idle_days = min_idle_days
+
+    def path(self, namespace, key):
+        return os.path.join(self.root, namespace, key)
+
+    def get(self, namespace, key):
+        """
+        Path of a published entry, or None if it does not exist.
+        """
+        entry = self.path(namespace, key)
+        if not os.path.isdir(entry):
+            return None
+        with file_lock(entry + LOCK_SUFFIX, shared=True):
+            if not os.path.isdir(entry):
+                return None
+            touch_entry(entry)
+        return entry
+
+    def get_or_build(self, namespace, key, builder):
+        """
+        Return the entry directory for `key`, calling `builder(directory)`
+        to fill a fresh directory if the entry does not exist yet.
+        """
+        entry = self.get(namespace, key)
+        if entry is not None:
+            return entry
+
+        entry = self.path(namespace, key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with file_lock(entry + LOCK_SUFFIX):
+            if not os.path.isdir(entry):
+                build_dir = tempfile.mkdtemp(prefix=".build-" + key[:12] + "-",
+                                             dir=os.path.dirname(entry))
+                try:
+                    builder(build_dir)
+                    # mkdtemp creates the directory private to this user
+                    os.chmod(build_dir, _shared_mode(0o777))
+                    os.rename(build_dir, entry)
+                except BaseException:
+                    shutil.rmtree(build_dir, ignore_errors=True)
+                    raise
+            touch_entry(entry)
+        self.evict(keep=entry)
+        return entry
+
+    def entries(self):
+        """
+        List (last access time, size, path) for all published entries.
+        """
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for namespace in os.listdir(self.root):
+            namespace_dir = os.path.join(self.root, namespace)
+            if not os.path.isdir(namespace_dir):
+                continue
+            for directory, subdirs, _ in os.walk(namespace_dir):
+                # entries are the directories published next to their lock file
+                if os.path.exists(directory + LOCK_SUFFIX):
+                    subdirs[:] = []
+                    entries.append((last_access(directory), directory_size(directory),
+                                    directory))
+                else:
+                    subdirs[:] = [subdir for subdir in subdirs
+                                  if not subdir.startswith(".build-")]
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove entries older than `max_age_days`, then least recently used
+        entries until the cache fits in `max_bytes`. Entries used within
+        `min_idle_days`, entries currently locked by another process and
+        `keep` are skipped. Returns removed paths.
+        """
+        if self.max_bytes is None and self.max_age_days is None:
+            return []
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        min_idle = (self.min_idle_days or 0) * 86400
+
+        removed = []
+        for accessed, size, entry in entries:
+            expired = (self.max_age_days is not None
+                       and now - accessed > self.max_age_days * 86400)
+            oversized = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or oversized) or now - accessed <= min_idle or entry == keep:
+                continue
+            with file_lock(entry + LOCK_SUFFIX, blocking=False) as locked:
+                # a run may have started using the entry since it was listed
+                if not locked or now - last_access(entry) <= min_idle:
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                if os.path.exists(entry + ACCESS_SUFFIX):
+                    os.remove(entry + ACCESS_SUFFIX)
+            total -= size
+            removed.append(entry)
+        return removed
+
+
+def cache_from_config(config):
+    """
+    Build the ContentCache described by the generic bioinformatics options.
+    """
+    max_size = config.get("cache_max_size")
+    return ContentCache(root=config.get("cache_dir"),
+                        max_bytes=int(float(max_size) * 1024 ** 3) if max_size else None,
+                        max_age_days=config.get("cache_max_age"))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Streaming reader for daner-formatted GWAS summary statistics.
+
+Ricopili writes daner files either as plain text or compressed with gzip/bgzip.
+Every pipeline stage reads them through `DanerReader`, which streams the file
+in large blocks, resolves columns by header name once and yields chunks of
+column-addressable records so memory stays bounded regardless of file size.
+"""
+
+import gzip
+
+GZIP_MAGIC = b"\x1f\x8b"
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 200000
+
+
+def open_daner(path, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Open a plain, gzip or bgzip compressed file for binary reading.
+
+    Compression is detected from the magic bytes rather than the file
+    extension. bgzip files are multi-member gzip streams, which `gzip` reads
+    transparently.
+    """
+    conn = open(path, "rb", buffering=block_size)
+    if conn.peek(2)[:2] == GZIP_MAGIC:
+        conn.close()
+        return gzip.open(path, "rb")
+    return conn
+
+
+class DanerChunk():
+    """
+    A block of daner records stored column-wise.
+
+    Columns are addressed by the name they were requested with, e.g.
+    `chunk["SNP"]` returns a list of SNP identifiers for every record in the
+    chunk.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def rows(self, *names):
+        """
+        Iterate over records as tuples of the named columns.
+        """
+        return zip(*[self.columns[name] for name in names])
+
+
+class DanerReader():
+    """
+    Single-pass reader over a daner file.
+
+    The header is parsed on construction. Column names may be given exactly
+    (e.g. "SNP") or as a prefix for the study-specific frequency columns
+    (e.g. "FRQ_A" resolves to "FRQ_A_35476").
+    """
+
+    def __init__(self, path, block_size=DEFAULT_BLOCK_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.chunk_size = chunk_size
+
+        with open_daner(self.path, self.block_size) as daner_conn:
+            header_line = daner_conn.readline()
+        self.header = header_line.decode("ascii").split()
+        self.header_index = {field: index for index, field in enumerate(self.header)}
+
+    def resolve(self, name):
+        """
+        Return the full header field name for a column name or prefix.
+        """
+        if name in self.header_index:
+            return name
+        matches = [field for field in self.header if field.startswith(name + "_")]
+        if len(matches) != 1:
+            raise KeyError("Could not resolve daner column '{name}' in {path}. "
+                           "Header: {header}".format(name=name, path=self.path,
+                                                     header=' '.join(self.header)))
+        return matches[0]
+
+    def has_column(self, name):
+        """
+        Check whether a column name or prefix can be resolved.
+        """
+        try:
+            self.resolve(name)
+        except KeyError:
+            return False
+        return True
+
+    def lines(self):
+        """
+        Stream the records of the file as lists of fields, skipping the
+        header. Data is read and decoded in blocks of `block_size` bytes.
+        """
+        with open_daner(self.path, self.block_size) as daner_conn:
+            daner_conn.readline()
+            remainder = b""
+            while True:
+                block = daner_conn.read(self.block_size)
+                if not block:
+                    break
+                block = remainder + block
+                last_newline = block.rfind(b"\n")
+                if last_newline == -1:
+                    remainder = block
+                    continue
+                remainder = block[last_newline + 1:]
+                for line in block[:last_newline].decode("ascii").split("\n"):
+                    fields = line.split()
+                    if fields:
+                        yield fields
+            if remainder.strip():
+                yield remainder.decode("ascii").split()
+
+    def chunks(self, columns=None):
+        """
+        Yield `DanerChunk` objects holding at most `chunk_size` records.
+
+        If `columns` is None every header column is included, keyed by its
+        header name. Otherwise each requested name (or prefix) is resolved
+        once and the chunk is keyed by the requested name.
+        """
+        if columns is None:
+            columns = list(self.header)
+        indices = [self.header_index[self.resolve(name)] for name in columns]
+
+        rows = []
+        for fields in self.lines():
+            rows.append(fields)
+            if len(rows) == self.chunk_size:
+                yield self._columnize(rows, columns, indices)
+                rows = []
+        if rows:
+            yield self._columnize(rows, columns, indices)
+
+    @staticmethod
+    def _columnize(rows, columns, indices):
+        return DanerChunk({name: [fields[index] for fields in rows]
+                           for name, index in zip(columns, indices)})
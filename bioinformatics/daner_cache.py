@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+Columnar binary cache of parsed daner files.
+
+A daner file is parsed once into a directory of raw column files, stored in
+the shared content-addressed cache under the SHA-256 of the input file's
+content. Later stages open the directory as a
+`DanerStore`, whose columns are read-only NumPy memory maps, and produce
+their text inputs by slicing arrays instead of re-tokenizing the daner.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from bioinformatics.bgzf import TextWriter
+from bioinformatics.cache import ContentCache, content_hash, touch_entry
+from bioinformatics.daner import DanerReader, DEFAULT_BLOCK_SIZE
+
+STORE_VERSION = 1
+
+# numeric columns cached when present in the daner header
+NUMERIC_COLUMNS = [("CHR", np.int8),
+                   ("BP", np.int64),
+                   ("P", np.float64),
+                   ("N", np.float32),
+                   ("FRQ_A", np.float32),
+                   ("FRQ_U", np.float32),
+                   ("INFO", np.float32)]
+
+# PLINK numeric coding of the non-autosomal chromosomes
+CHROMOSOME_CODES = {"X": 23, "Y": 24, "XY": 25, "MT": 26, "M": 26}
+
+
+def _to_numeric(values, dtype):
+    try:
+        return np.asarray(values, dtype=dtype)
+    except ValueError:
+        parsed = []
+        for value in values:
+            try:
+                parsed.append(float(value))
+            except ValueError:
+                parsed.append(np.nan)
+        return np.asarray(parsed, dtype=dtype)
+
+
+def chromosome_code(chrom):
+    """
+    Numeric code of a chromosome label such as "22", "chr22" or "X".
+    Returns None for labels without a code.
+    """
+    chrom = chrom.upper().replace("CHR", "")
+    if chrom.isdigit():
+        return int(chrom)
+    return CHROMOSOME_CODES.get(chrom)
+
+
+def _to_chromosome(values):
+    try:
+        return np.asarray(values, dtype=np.int8)
+    except ValueError:
+        return np.asarray([chromosome_code(value) or 0 for value in values], dtype=np.int8)
+
+
+class DanerStore():
+    """
+    Read-only, memory-mapped view of a cached daner file.
+
+    Columns are addressed by name, e.g. `store["P"]`. SNP identifiers are
+    stored as fixed-width bytes. Records keep the order of the input file;
+    `chromosome_index(chrom)` returns the record indices of one chromosome.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta_conn:
+            self.meta = json.load(meta_conn)
+        self.size = self.meta["records"]
+        self._columns = {}
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, name):
+        return name in self.meta["columns"]
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            dtype = self.meta["columns"][name]
+            path = os.path.join(self.directory, name + ".bin")
+            if self.size == 0:
+                self._columns[name] = np.empty(0, dtype=dtype)
+            else:
+                self._columns[name] = np.memmap(path, dtype=dtype, mode="r",
+                                                shape=(self.size,))
+        return self._columns[name]
+
+    @property
+    def columns(self):
+        return list(self.meta["columns"])
+
+    def chromosomes(self):
+        """
+        Chromosome codes present in the store, in ascending order.
+        """
+        return sorted(int(chrom) for chrom in self.meta["chromosomes"])
+
+    def chromosome_index(self, chrom):
+        """
+        Record indices for a chromosome, in file order.
+        """
+        start, stop = self.meta["chromosomes"][str(chrom)]
+        return self["ORDER"][start:stop]
+
+
+def build_store(daner_file, directory, chunk_size=None):
+    """
+    Parse a daner file into a columnar store in the existing, empty
+    `directory`.
+    """
+    reader = DanerReader(daner_file)
+    if chunk_size is not None:
+        reader.chunk_size = chunk_size
+
+    numeric = [(name, dtype) for name, dtype in NUMERIC_COLUMNS
+               if reader.has_column(name)]
+    requested = ["SNP"] + [name for name, _ in numeric]
+    # meta-analysis daners carry case and control counts instead of N
+    sum_n = (not reader.has_column("N")
+             and reader.has_column("Nca") and reader.has_column("Nco"))
+    if sum_n:
+        numeric.append(("N", np.float32))
+        requested += ["Nca", "Nco"]
+
+    column_conns = {name: open(os.path.join(directory, name + ".bin"), "wb")
+                    for name, _ in numeric}
+    snp_text = os.path.join(directory, "SNP.txt")
+    snp_width = 1
+    records = 0
+    with open(snp_text, "w") as snp_conn:
+        for chunk in reader.chunks(columns=requested):
+            for name, dtype in numeric:
+                if name == "CHR":
+                    values = _to_chromosome(chunk["CHR"])
+                elif name == "N" and sum_n:
+                    values = (_to_numeric(chunk["Nca"], dtype)
+                              + _to_numeric(chunk["Nco"], dtype))
+                else:
+                    values = _to_numeric(chunk[name], dtype)
+                column_conns[name].write(values.tobytes())
+            snp_width = max(snp_width, max(len(snp) for snp in chunk["SNP"]))
+            snp_conn.write('\n'.join(chunk["SNP"]) + '\n')
+            records += len(chunk)
+    for conn in column_conns.values():
+        conn.close()
+
+    # fixed-width SNP identifiers allow vectorized slicing downstream
+    snp_dtype = "S{}".format(snp_width)
+    with open(snp_text, "rb") as snp_conn, \
+            open(os.path.join(directory, "SNP.bin"), "wb") as snp_out:
+        while True:
+            lines = snp_conn.readlines(DEFAULT_BLOCK_SIZE)
+            if not lines:
+                break
+            snp_out.write(np.asarray([line.rstrip(b"\n") for line in lines],
+                                     dtype=snp_dtype).tobytes())
+    os.remove(snp_text)
+
+    # stable chromosome ordering of record indices for per-chromosome slices
+    chromosomes = {}
+    order = np.empty(0, dtype=np.int64)
+    if records:
+        chrom = np.memmap(os.path.join(directory, "CHR.bin"), dtype=np.int8,
+                          mode="r", shape=(records,))
+        order = np.argsort(chrom, kind="stable").astype(np.int64)
+        sorted_chrom = chrom[order]
+        codes, starts = np.unique(sorted_chrom, return_index=True)
+        stops = list(starts[1:]) + [records]
+        chromosomes = {str(code): [int(start), int(stop)]
+                       for code, start, stop in zip(codes, starts, stops)}
+        del chrom
+    with open(os.path.join(directory, "ORDER.bin"), "wb") as order_conn:
+        order_conn.write(order.tobytes())
+
+    meta = {"version": STORE_VERSION,
+            "source": os.path.abspath(daner_file),
+            "records": records,
+            "header": reader.header,
+            "columns": dict([("SNP", snp_dtype), ("ORDER", "int64")]
+                            + [(name, np.dtype(dtype).name) for name, dtype in numeric]),
+            "chromosomes": chromosomes}
+    with open(os.path.join(directory, "meta.json"), 'w') as meta_conn:
+        json.dump(meta, meta_conn, indent=2)
+    return directory
+
+
+def load_daner(daner_file, cache=None):
+    """
+    Return the `DanerStore` for a daner file from a `ContentCache`, parsing
+    the file only if no store with the same content hash exists yet.
+    """
+    cache = cache or ContentCache()
+    directory = cache.get_or_build("daner/v{}".format(STORE_VERSION),
+                                   content_hash(daner_file),
+                                   lambda directory: build_store(daner_file, directory))
+    return DanerStore(directory)
+
+
+def snp_set_hash(store, chunk_size=1000000):
+    """
+    SHA-256 of the SNP, CHR and BP columns of a store. Daners with the same
+    SNPs in the same order share it, whatever their statistics.
+    """
+    digest = hashlib.sha256()
+    for name in ("SNP", "CHR", "BP"):
+        column = store[name]
+        digest.update(name.encode())
+        for start in range(0, len(column), chunk_size):
+            digest.update(np.ascontiguousarray(column[start:start + chunk_size]).tobytes())
+    return digest.hexdigest()
+
+
+def write_text(path, columns, sep=' ', header=None, chunk_size=1000000, positions=None):
+    """
+    Write equally long arrays as delimited text columns.
+
+    Byte-string arrays (e.g. SNP identifiers) are decoded; numeric arrays are
+    written with NumPy's shortest round-trip representation. Paths ending in
+    ".gz" are written as BGZF, indexed by `positions` when it is given as the
+    numbers of the (chromosome, start, stop) columns.
+    """
+    size = len(columns[0]) if columns else 0
+    with TextWriter(path, columns=positions) as output_conn:
+        if header is not None:
+            output_conn.write(sep.join(header) + '\n')
+        for start in range(0, size, chunk_size):
+            fields = [column[start:start + chunk_size].astype(str) for column in columns]
+            text = '\n'.join(map(sep.join, zip(*fields))) + '\n'
+            if positions is None:
+                output_conn.write(text)
+            else:
+                output_conn.write_records(text, *[columns[column][start:start + chunk_size]
+                                                  for column in positions])
+
+
+def write_snp_loc(store, path, keep=None):
+    """
+    Write a MAGMA SNP location file (SNP, CHR, BP) for every SNP in the
+    store, or for those selected by the boolean mask `keep`. Rows are grouped
+    by chromosome so that a compressed file can be indexed.
+    """
+    index = store["ORDER"][:]
+    if keep is not None:
+        index = index[keep[index]]
+    write_text(path, [store["SNP"][index], store["CHR"][index], store["BP"][index]],
+               positions=(1, 2, 2))
+
+
+def opened_store(marker_file):
+    """
+    Open the store referenced by a marker file written by the caching stage,
+    stamping its cache entry as in use.
+    """
+    with open(marker_file) as marker_conn:
+        directory = marker_conn.read().strip()
+    touch_entry(directory)
+    return DanerStore(directory)
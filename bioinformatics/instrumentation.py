@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Per-job timing and resource instrumentation of workflow runs.
+
+`RunInstrumentation` is passed to snakemake as the log handler. It records
+when every job is submitted, when it finishes or fails and which files it
+reads and writes. Rules declare a `benchmark:` file, in which snakemake
+records the job's own run time, CPU time and peak RSS wherever it runs.
+The difference between the two clocks is the time the job spent queued,
+including snakemake's polling and file system latency.
+
+After the run, `write_report` writes `run_report.json` with every job and
+per-rule totals, and `run_report.txt` with the critical path through the
+DAG, to the output directory.
+"""
+
+import csv
+import json
+import os
+import time
+
+from bioinformatics.cache import directory_size
+
+REPORT_JSON = "run_report.json"
+REPORT_TEXT = "run_report.txt"
+
+
+def read_benchmark(path):
+    """
+    Last row of a snakemake benchmark file as a dict of floats, or {} if
+    the file is missing.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as benchmark_conn:
+        rows = list(csv.DictReader(benchmark_conn, delimiter='\t'))
+    if not rows:
+        return {}
+    values = {}
+    for key, value in rows[-1].items():
+        try:
+            values[key] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return values
+
+
+def output_size(paths):
+    """
+    Total size in bytes of the existing files and directories in `paths`.
+    """
+    size = 0
+    for path in paths:
+        if os.path.isdir(path):
+            size += directory_size(path)
+        elif os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+
+def job_label(job):
+    """
+    Rule name plus wildcards, e.g. test_gene_sets[batch=batch3_22].
+    """
+    if not job["wildcards"]:
+        return job["rule"]
+    return "{}[{}]".format(job["rule"], ",".join(
+        "{}={}".format(key, value) for key, value in sorted(job["wildcards"].items())))
+
+
+def critical_path(jobs):
+    """
+    The chain of jobs ending with the last job to finish, following at each
+    step the input-producing job that finished last.
+    """
+    finished = [job for job in jobs if job["end"] is not None]
+    if not finished:
+        return []
+    producers = {}
+    for job in finished:
+        for path in job["output"]:
+            producers[os.path.normpath(path)] = job
+
+    path = [max(finished, key=lambda job: job["end"])]
+    while True:
+        dependencies = [producers[os.path.normpath(input_file)]
+                        for input_file in path[-1]["input"]
+                        if os.path.normpath(input_file) in producers]
+        dependencies = [job for job in dependencies if job is not path[-1]]
+        if not dependencies:
+            break
+        path.append(max(dependencies, key=lambda job: job["end"]))
+    return list(reversed(path))
+
+
+class RunInstrumentation():
+    """
+    Snakemake log handler recording per-job timing and resources.
+
+    Messages are forwarded to `forward`, e.g. a tool's own progress logger.
+    """
+
+    def __init__(self, output_dir, forward=None):
+        self.output_dir = output_dir
+        self.forward = forward
+        self.jobs = {}
+        self.started = time.time()
+
+    def __call__(self, msg):
+        now = time.time()
+        level = msg.get("level")
+        if level == "job_info":
+            self.jobs[msg["jobid"]] = {
+                "jobid": msg["jobid"],
+                "rule": msg["name"],
+                "wildcards": dict(msg.get("wildcards") or {}),
+                "input": list(msg.get("input") or []),
+                "output": list(msg.get("output") or []),
+                "benchmark": msg.get("benchmark"),
+                "local": msg.get("local", False),
+                "submit": now,
+                "end": None,
+                "status": "running"}
+        elif level == "job_finished" and msg.get("jobid") in self.jobs:
+            self.jobs[msg["jobid"]].update(end=now, status="finished")
+        elif level == "job_error":
+            job = self.jobs.get(msg.get("jobid"))
+            if job is None:
+                # older snakemake versions report failures by rule and output only
+                job = next((job for job in self.jobs.values()
+                            if job["rule"] == msg.get("name")
+                            and job["output"] == list(msg.get("output") or [])), None)
+            if job is not None:
+                job.update(end=now, status="failed")
+
+        if self.forward is not None:
+            self.forward(msg)
+
+    def job_records(self):
+        """
+        Per-job records with queue wait and run time split using the
+        job's benchmark file.
+        """
+        records = []
+        for job in sorted(self.jobs.values(), key=lambda job: job["submit"]):
+            record = dict(job)
+            record["label"] = job_label(job)
+            record["output_bytes"] = output_size(job["output"])
+            benchmark = read_benchmark(job["benchmark"])
+            elapsed = (job["end"] - job["submit"]) if job["end"] is not None else None
+            run_seconds = benchmark.get("s", elapsed)
+            record["elapsed_seconds"] = elapsed
+            record["run_seconds"] = run_seconds
+            record["queue_seconds"] = (max(0.0, elapsed - run_seconds)
+                                       if elapsed is not None and run_seconds is not None
+                                       else None)
+            record["cpu_seconds"] = benchmark.get("cpu_time")
+            record["max_rss_mb"] = benchmark.get("max_rss")
+            record["io_in_mb"] = benchmark.get("io_in")
+            record["io_out_mb"] = benchmark.get("io_out")
+            records.append(record)
+        return records
+
+    def write_report(self):
+        """
+        Write the JSON run report and the critical path summary to the
+        output directory. Returns the path of the JSON report.
+        """
+        records = self.job_records()
+        finished = time.time()
+
+        rules = {}
+        for record in records:
+            rule = rules.setdefault(record["rule"], {"jobs": 0, "failed": 0,
+                                                     "run_seconds": 0.0,
+                                                     "queue_seconds": 0.0,
+                                                     "max_run_seconds": 0.0,
+                                                     "max_rss_mb": 0.0,
+                                                     "output_bytes": 0})
+            rule["jobs"] += 1
+            rule["failed"] += record["status"] == "failed"
+            rule["run_seconds"] += record["run_seconds"] or 0.0
+            rule["queue_seconds"] += record["queue_seconds"] or 0.0
+            rule["max_run_seconds"] = max(rule["max_run_seconds"], record["run_seconds"] or 0.0)
+            rule["max_rss_mb"] = max(rule["max_rss_mb"], record["max_rss_mb"] or 0.0)
+            rule["output_bytes"] += record["output_bytes"]
+
+        path = critical_path(records)
+        report = {"started": self.started,
+                  "finished": finished,
+                  "wall_seconds": finished - self.started,
+                  "jobs": records,
+                  "rules": rules,
+                  "critical_path": [record["label"] for record in path],
+                  "critical_path_run_seconds": sum(record["run_seconds"] or 0.0
+                                                   for record in path),
+                  "critical_path_queue_seconds": sum(record["queue_seconds"] or 0.0
+                                                     for record in path)}
+
+        report_file = os.path.join(self.output_dir, REPORT_JSON)
+        with open(report_file, 'w') as report_conn:
+            json.dump(report, report_conn, indent=2)
+
+        with open(os.path.join(self.output_dir, REPORT_TEXT), 'w') as summary_conn:
+            summary_conn.write("Wall time: {:.1f} s over {} jobs ({} failed)\n".format(
+                report["wall_seconds"], len(records),
+                sum(record["status"] == "failed" for record in records)))
+            summary_conn.write("\nCritical path ({:.1f} s running, {:.1f} s queued):\n".format(
+                report["critical_path_run_seconds"], report["critical_path_queue_seconds"]))
+            for record in path:
+                summary_conn.write("  {:<40} run {:>9.1f} s  queued {:>9.1f} s\n".format(
+                    record["label"], record["run_seconds"] or 0.0,
+                    record["queue_seconds"] or 0.0))
+            summary_conn.write("\nRules by total run time:\n")
+            for name, rule in sorted(rules.items(), key=lambda item: -item[1]["run_seconds"]):
+                summary_conn.write(
+                    "  {:<25} {:>4} jobs  run {:>9.1f} s (max {:.1f} s)  "
+                    "queued {:>9.1f} s  max RSS {:.0f} MB\n".format(
+                        name, rule["jobs"], rule["run_seconds"], rule["max_run_seconds"],
+                        rule["queue_seconds"], rule["max_rss_mb"]))
+            slowest = [record for record in records if record["run_seconds"] is not None]
+            if slowest:
+                slowest = max(slowest, key=lambda record: record["run_seconds"])
+                summary_conn.write("\nSlowest job: {} ({:.1f} s)\n".format(
+                    slowest["label"], slowest["run_seconds"]))
+        return report_file
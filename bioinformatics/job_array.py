@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+"""
+Job-array submission (`--mode array`).
+
+In drmaa and qsub mode every rule instance is its own cluster job, and each
+one waits in the queue, plus up to snakemake's `latency_wait` for its outputs
+to show up on the shared filesystem. For short stages the waiting dominates.
+In array mode a tool's workflow is submitted as a few jobs instead:
+
+1. The stages before the tool's array phases (parsing, annotation, batching,
+   sharding) are packed into one job, which runs snakemake on its node.
+2. Each array phase, e.g. all `test_gene_sets` batches, is submitted as one
+   array job (`qsub -t 1-N`) held until the previous submission ends. Task
+   i runs snakemake for the targets of rule instance i.
+3. The remaining stages, the merges, run on the submit host.
+
+Tasks write their start and finish times to status files in
+`<output-dir>/.config/array/`. The submit host polls the status files of
+all submissions together, and `qstat` for jobs that ended without writing
+one, so no single job is waited on. `array_report.json` in the output
+directory lists every submission's queue wait and an estimate of the wait
+saved: the k rule jobs packed into one job would have queued k times in
+sequence, so each extra job saves one observed queue wait.
+"""
+
+import argparse
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from bioinformatics.resources import (load_cluster_config, parse_memory_mb,
+                                      parse_walltime_seconds)
+
+# scheduler flavour of each cluster environment
+SCHEDULERS = {"broad": "sge", "lisa": "pbs"}
+# environment variables holding the array task index, by scheduler
+TASK_ID_VARIABLES = ("SGE_TASK_ID", "PBS_ARRAYID", "PBS_ARRAY_INDEX")
+# PBS job states of jobs that are queued, held, running or exiting
+PBS_ACTIVE_STATES = set("QHWTRSE")
+POLL_INTERVAL = 30
+REPORT_JSON = "array_report.json"
+
+TASK_SCRIPT = """#!/bin/bash
+cd {workdir}
+exec {python} -m bioinformatics.job_array {spec}
+"""
+
+
+def task_index():
+    """
+    Index of the running array task, 1 outside an array job.
+    """
+    for variable in TASK_ID_VARIABLES:
+        value = os.environ.get(variable, "")
+        if value.isdigit():
+            return int(value)
+    return 1
+
+
+def format_walltime_seconds(seconds):
+    """
+    Walltime request as HH:MM:SS.
+    """
+    return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def submit_command(scheduler, name, script, n_tasks, log_dir, memory, walltime, hold=None):
+    """
+    qsub command submitting `script` as an array of `n_tasks` tasks, held
+    until job `hold` has ended.
+    """
+    command = ["qsub", "-V", "-N", name, "-o", log_dir, "-e", log_dir]
+    if scheduler == "sge":
+        command += ["-terse", "-cwd", "-l", "h_vmem=" + memory, "-l", "h_rt=" + walltime]
+        if hold:
+            command += ["-hold_jid", hold]
+    else:
+        command += ["-l", "mem=" + memory, "-l", "walltime=" + walltime]
+        if hold:
+            command += ["-W", "depend=afterany:" + hold]
+    if n_tasks > 1:
+        command += ["-t", "1-{}".format(n_tasks)]
+    return command + [script]
+
+
+def parse_job_id(scheduler, output):
+    """
+    Job ID from qsub's output: "123.1-22:1" with SGE's -terse, "123[].server"
+    or "123.server" with PBS.
+    """
+    job_id = output.strip().splitlines()[-1].strip()
+    if scheduler == "sge":
+        return job_id.split(".")[0]
+    return job_id
+
+
+def job_active(scheduler, job_id):
+    """
+    Whether the scheduler still lists any task of a job as queued or running.
+    """
+    if scheduler == "sge":
+        return subprocess.call(["qstat", "-j", job_id], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL) == 0
+    # Torque keeps finished jobs listed for a while in state C
+    qstat = subprocess.run(["qstat", "-t", job_id], stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL, universal_newlines=True)
+    if qstat.returncode != 0:
+        return False
+    states = [line.split()[4] for line in qstat.stdout.splitlines()
+              if len(line.split()) >= 6 and line.split()[0][0].isdigit()]
+    return any(state in PBS_ACTIVE_STATES for state in states)
+
+
+def count_benchmarks(directory, start, finish):
+    """
+    Number of rule jobs that ended between `start` and `finish`: every rule
+    writes a benchmark file when it finishes.
+    """
+    count = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if start <= os.path.getmtime(os.path.join(root, name)) <= finish + 1:
+                count += 1
+    return count
+
+
+def planned_jobs(snakefile, config_file, targets=None, omit_from=()):
+    """
+    Number of jobs of each rule a snakemake run on `targets` would execute,
+    read from the job counts a dry run reports.
+    """
+    from snakemake import snakemake
+
+    counts = {}
+
+    def read_job_counts(message):
+        if message.get("level") != "run_info":
+            return
+        for line in message["msg"].splitlines():
+            fields = line.split()
+            if len(fields) != 2 or not any(field.isdigit() for field in fields):
+                continue
+            count, rule = fields if fields[0].isdigit() else fields[::-1]
+            if rule != "total":
+                counts[rule] = int(count)
+
+    snakemake(snakefile, configfiles=[config_file], targets=targets,
+              omit_from=list(omit_from), dryrun=True, quiet=True,
+              log_handler=[read_job_counts])
+    return counts
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", 'w') as json_conn:
+        json.dump(data, json_conn, indent=2)
+    os.rename(path + ".tmp", path)
+
+
+class ArraySubmission():
+    """
+    One cluster job running a list of tasks, each snakemake run on its own
+    targets (None for the workflow's default targets).
+    """
+
+    def __init__(self, name, tasks, rules, omit_from=()):
+        self.name = name
+        self.tasks = tasks
+        self.rules = rules
+        self.omit_from = list(omit_from)
+        self.job_id = None
+        self.submit_time = None
+        self.ready_time = None
+        self.gone_since = None
+        self.status = {}
+
+    def status_file(self, status_dir, index):
+        return os.path.join(status_dir, "{}.{}.json".format(self.name, index))
+
+    def read_status(self, status_dir):
+        for index in range(1, len(self.tasks) + 1):
+            path = self.status_file(status_dir, index)
+            if os.path.exists(path):
+                with open(path) as status_conn:
+                    self.status[index] = json.load(status_conn)
+
+    def finished(self):
+        return sum(1 for status in self.status.values() if "finish" in status)
+
+    def running(self):
+        return sum(1 for status in self.status.values() if "finish" not in status)
+
+    def failed(self):
+        return [index for index, status in self.status.items()
+                if "finish" in status and not status["success"]]
+
+    def done(self):
+        return self.finished() == len(self.tasks)
+
+
+class ArrayRunner():
+    """
+    Run the stages of a workflow up to and including its array phases as
+    cluster jobs. `phases` is a list of (rule, [targets of each task]).
+    """
+
+    def __init__(self, snakefile, config, config_file, context, phases,
+                 latency_wait=60, poll_interval=POLL_INTERVAL):
+        if context not in SCHEDULERS:
+            raise Exception("Array mode needs a qsub compatible cluster environment "
+                            "({})".format(", ".join(sorted(SCHEDULERS))))
+        self.scheduler = SCHEDULERS[context]
+        self.snakefile = snakefile
+        self.config_file = config_file
+        self.output_dir = config["output_dir"]
+        self.latency_wait = latency_wait
+        self.poll_interval = poll_interval
+        self.array_dir = os.path.join(self.output_dir, ".config", "array")
+        self.log_dir = os.path.join(self.output_dir, "logs", "array")
+        self.cluster_settings = load_cluster_config(config.get("cluster_config"))
+
+        array_rules = [rule for rule, _ in phases]
+        self.submissions = [ArraySubmission("prepare", [None], rules=None,
+                                            omit_from=array_rules[:1])]
+        for rule, tasks in phases:
+            self.submissions.append(ArraySubmission(rule, tasks, rules=[rule]))
+
+    def resources(self, submission):
+        """
+        Memory and walltime of a submission: the largest request among its
+        rules. A packed job runs its rule jobs one after another, so it gets
+        the sum of their walltimes, over the jobs a dry run of its targets
+        lists.
+        """
+        default = self.cluster_settings.get("__default__", {})
+        if submission.rules:
+            jobs = dict((rule, 1) for rule in submission.rules)
+        else:
+            jobs = planned_jobs(self.snakefile, self.config_file, submission.tasks[0],
+                                submission.omit_from) or {"__default__": 1}
+        settings = [(count, dict(default, **self.cluster_settings.get(rule, {})))
+                    for rule, count in jobs.items()]
+        memory_mb = max(parse_memory_mb(rule_settings["h_vmem"])
+                        for _, rule_settings in settings)
+        walltimes = [count * parse_walltime_seconds(rule_settings["walltime"])
+                     for count, rule_settings in settings]
+        walltime = max(walltimes) if submission.rules else sum(walltimes)
+        return "{}m".format(memory_mb), format_walltime_seconds(walltime)
+
+    def write_spec(self, submission):
+        """
+        Write the task spec and script of a submission, returning the
+        script's path.
+        """
+        for path in glob.glob(os.path.join(self.array_dir, submission.name + ".*.json")):
+            os.remove(path)
+        spec_file = os.path.join(self.array_dir, submission.name + ".json")
+        _write_json(spec_file, {"snakefile": self.snakefile,
+                                "config_file": self.config_file,
+                                "status_dir": self.array_dir,
+                                "name": submission.name,
+                                "tasks": submission.tasks,
+                                "rules": submission.rules,
+                                "omit_from": submission.omit_from,
+                                "latency_wait": self.latency_wait})
+        script = os.path.join(self.array_dir, submission.name + ".sh")
+        with open(script, 'w') as script_conn:
+            script_conn.write(TASK_SCRIPT.format(workdir=os.getcwd(), python=sys.executable,
+                                                 spec=spec_file))
+        os.chmod(script, 0o755)
+        return script
+
+    def submit(self, submission, hold=None):
+        """
+        Write the submission's task spec and script and queue it.
+        """
+        script = self.write_spec(submission)
+        memory, walltime = self.resources(submission)
+        command = submit_command(self.scheduler, submission.name, script,
+                                 len(submission.tasks), self.log_dir, memory, walltime, hold)
+        output = subprocess.check_output(command, universal_newlines=True)
+        submission.job_id = parse_job_id(self.scheduler, output)
+        submission.submit_time = time.time()
+        print("\tSubmitted {} as job {} ({} task{})".format(
+            submission.name, submission.job_id, len(submission.tasks),
+            "s" if len(submission.tasks) > 1 else ""))
+
+    def poll(self):
+        """
+        Poll all submissions until every task has finished. Returns False
+        once a task fails or a job leaves the queue with tasks unfinished.
+        """
+        pending = list(self.submissions)
+        last_progress = None
+        while pending:
+            for submission in list(pending):
+                active = job_active(self.scheduler, submission.job_id)
+                submission.read_status(self.array_dir)
+                if submission.failed():
+                    print("\t{} task(s) {} failed".format(
+                        submission.name, ", ".join(map(str, submission.failed()))))
+                    return False
+                if submission.done():
+                    pending.remove(submission)
+                    # the next submission was held until this one ended
+                    following = self.submissions.index(submission) + 1
+                    if following < len(self.submissions):
+                        self.submissions[following].ready_time = max(
+                            status["finish"] for status in submission.status.values())
+                    continue
+                if active:
+                    submission.gone_since = None
+                    continue
+                # status files may reach this host after the job has left the queue
+                submission.gone_since = submission.gone_since or time.time()
+                if time.time() - submission.gone_since > self.latency_wait:
+                    print("\tJob {} ({}) ended with {} of {} tasks finished".format(
+                        submission.job_id, submission.name, submission.finished(),
+                        len(submission.tasks)))
+                    return False
+
+            progress = ", ".join("{}: {}/{} done, {} running".format(
+                submission.name, submission.finished(), len(submission.tasks),
+                submission.running()) for submission in pending)
+            if progress and progress != last_progress:
+                print("\t" + progress)
+                last_progress = progress
+            if pending:
+                time.sleep(self.poll_interval)
+        return True
+
+    def cancel(self):
+        for submission in self.submissions:
+            if submission.job_id and not submission.done():
+                subprocess.call(["qdel", submission.job_id], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+
+    def run(self):
+        """
+        Submit every stage, chained by scheduler holds, and wait for them.
+        Returns whether all tasks succeeded.
+        """
+        for directory in (self.array_dir, self.log_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        hold = None
+        for submission in self.submissions:
+            self.submit(submission, hold)
+            hold = submission.job_id
+        self.submissions[0].ready_time = self.submissions[0].submit_time
+        try:
+            succeeded = self.poll()
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        if not succeeded:
+            self.cancel()
+        return succeeded
+
+    def report(self):
+        """
+        Queue wait of every submission and the scheduler wait saved by
+        packing and array submission.
+        """
+        benchmark_dir = os.path.join(self.output_dir, "benchmarks")
+        records = []
+        for submission in self.submissions:
+            starts = [status["start"] for status in submission.status.values()]
+            finishes = [status["finish"] for status in submission.status.values()]
+            ready = max(submission.submit_time, submission.ready_time or 0)
+            waits = [max(0, start - ready) for start in starts]
+            records.append({
+                "name": submission.name,
+                "job_id": submission.job_id,
+                "tasks": len(submission.tasks),
+                "rule_jobs": count_benchmarks(benchmark_dir, min(starts), max(finishes)),
+                "queue_wait_mean": sum(waits) / len(waits),
+                "queue_wait_max": max(waits),
+                "run_time_max": max(finish - start
+                                    for start, finish in zip(starts, finishes)),
+                "hosts": sorted(set(status["host"] for status in submission.status.values()))})
+
+        rule_jobs = sum(record["rule_jobs"] for record in records)
+        # packed jobs run one after another, each would have queued in turn;
+        # array tasks queue side by side either way and save submissions only
+        wait_saved = sum(max(0, record["rule_jobs"] - 1) * record["queue_wait_max"]
+                         for record, submission in zip(records, self.submissions)
+                         if not submission.rules)
+        return {"scheduler": self.scheduler,
+                "submissions": records,
+                "rule_jobs": rule_jobs,
+                "submissions_saved": max(0, rule_jobs - len(records)),
+                "queue_wait_saved": wait_saved}
+
+    def write_report(self):
+        report = self.report()
+        print("\t{} rule jobs in {} submissions, about {:.0f} s of queue wait saved".format(
+            report["rule_jobs"], len(report["submissions"]), report["queue_wait_saved"]))
+        path = os.path.join(self.output_dir, REPORT_JSON)
+        _write_json(path, report)
+        return path
+
+
+def task_arguments(spec, index):
+    """
+    Snakemake arguments of task `index` of a submission's spec.
+    """
+    # tasks of one array have disjoint targets, so they skip snakemake's
+    # working directory lock and run side by side; they may only run their
+    # own rules, never the shared upstream stages
+    return {"snakefile": spec["snakefile"],
+            "configfiles": [spec["config_file"]],
+            "targets": spec["tasks"][index - 1],
+            "allowed_rules": spec["rules"],
+            "omit_from": spec["omit_from"],
+            "cores": 1,
+            "lock": False,
+            "latency_wait": spec["latency_wait"]}
+
+
+def run_task(spec_file, index):
+    """
+    Run task `index` of a submission on this node and record its status.
+    """
+    with open(spec_file) as spec_conn:
+        spec = json.load(spec_conn)
+    status_file = os.path.join(spec["status_dir"], "{}.{}.json".format(spec["name"], index))
+    status = {"task": index, "host": socket.gethostname(), "start": time.time()}
+    _write_json(status_file, status)
+
+    from snakemake import snakemake
+    try:
+        success = snakemake(**task_arguments(spec, index))
+    except Exception as error:
+        print(error, file=sys.stderr)
+        success = False
+    status.update(finish=time.time(), success=bool(success))
+    _write_json(status_file, status)
+    return 0 if success else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one task of an array submission.")
+    parser.add_argument("spec", help="Task spec written by ArrayRunner.")
+    parser.add_argument("--task", type=int, default=None,
+                        help="Task index (default: from the scheduler's environment).")
+    args = parser.parse_args()
+    sys.exit(run_task(args.spec, args.task or task_index()))
+
+
+if __name__ == "__main__":
+    main()
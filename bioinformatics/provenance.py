@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Content-hash based reuse of rule outputs across runs.
+
+Snakemake decides what to rerun from file modification times, so touching a
+daner or writing to a new output directory recomputes every stage. Expensive
+rules instead fingerprint their actual inputs (file contents, the config
+values the rule depends on, the binaries it calls and the source of the
+modules that compute it natively) and restore the outputs of an earlier run
+with the same fingerprint from the shared cache with `ResultStore.restore`,
+or store fresh outputs with `ResultStore.save`.
+"""
+
+import importlib.util
+import os
+import shutil
+
+from bioinformatics.cache import ContentCache, cache_from_config, inputs_hash
+
+RESULTS_NAMESPACE = "results"
+
+
+def _copy(source, destination):
+    # plain copies get a fresh mtime, so snakemake sees restored outputs as new
+    if os.path.isdir(source):
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+        shutil.copytree(source, destination, copy_function=shutil.copyfile)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+        shutil.copyfile(source, destination)
+
+
+class ResultStore():
+    """
+    Store of rule outputs keyed by input fingerprint.
+
+    If `enabled` is False every call simply runs the rule.
+    """
+
+    def __init__(self, cache=None, enabled=True):
+        self.cache = cache or ContentCache()
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(cache_from_config(config),
+                   enabled=not config.get("no_result_store", False))
+
+    @staticmethod
+    def fingerprint(rule, inputs, params=None, binaries=(), modules=()):
+        """
+        Hash of a rule name, its input files, the config values it depends on,
+        the binaries it executes and the source files of the Python modules
+        (dotted names) that produce its outputs, so that changing the code
+        of a native stage invalidates its stored results.
+        """
+        params = params or {}
+        extra = [rule] + ["{}={}".format(key, params[key]) for key in sorted(params)]
+        return inputs_hash(list(inputs) + [binary for binary in binaries
+                                           if os.path.exists(binary)]
+                           + [module_source(module) for module in modules],
+                           extra=extra)
+
+    def restore(self, key, outputs):
+        """
+        Copy the stored outputs for `key` into place. Returns False if no
+        run with this fingerprint has been stored.
+        """
+        if not self.enabled:
+            return False
+        entry = self.cache.get(RESULTS_NAMESPACE, key)
+        if entry is None:
+            return False
+        for index, output in enumerate(outputs):
+            _copy(os.path.join(entry, str(index)), output)
+        return True
+
+    def save(self, key, outputs):
+        """
+        Store freshly created outputs under `key`.
+        """
+        if not self.enabled:
+            return
+
+        def store(directory):
+            for index, output in enumerate(outputs):
+                _copy(output, os.path.join(directory, str(index)))
+
+        self.cache.get_or_build(RESULTS_NAMESPACE, key, store)
+
+
+def module_source(module):
+    """
+    Path of the source file of a module given by its dotted name.
+    """
+    return importlib.util.find_spec(module).origin
+
+
+def file_signature(path):
+    """
+    Cheap identity of a large file (path, size and modification time) for
+    inputs such as reference panels that are too big to hash on every run.
+    """
+    if not os.path.exists(path):
+        return path
+    stat = os.stat(path)
+    return "{}:{}:{}".format(os.path.abspath(path), stat.st_size, int(stat.st_mtime))
+
+
+def bfile_signature(prefix):
+    """
+    `file_signature` of the .bed/.bim/.fam files of a PLINK file set.
+    """
+    return ";".join(file_signature(prefix + suffix) for suffix in (".bed", ".bim", ".fam"))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Registry of the tool sub-pipelines offered by the `bioinformatics` command.
+
+Tools are `Tool` subclasses advertised under the "bioinformatics.tools" entry
+point group, so other packages can add sub-pipelines without changes here.
+The bundled tools are also listed below for source checkouts that are not
+installed. Tool modules keep heavy imports (snakemake, numpy,
+pkg_resources) inside the methods that run the workflow, so building the
+command line only imports the tool classes themselves.
+"""
+
+import importlib
+
+ENTRY_POINT_GROUP = "bioinformatics.tools"
+
+BUNDLED_TOOLS = [("magma", "bioinformatics.tools.magma.magma:Magma"),
+                 ("region_annotator",
+                  "bioinformatics.tools.region_annotator.region_annotator:RegionAnnotator"),
+                 ("batch", "bioinformatics.tools.batch.batch:Batch")]
+
+
+def tool_entry_points():
+    """
+    (name, "module:Class") of every registered tool, bundled tools first.
+    Installed entry points with the same name replace bundled ones.
+    """
+    tools = dict(BUNDLED_TOOLS)
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return list(tools.items())
+
+    found = entry_points()
+    if hasattr(found, "select"):
+        found = found.select(group=ENTRY_POINT_GROUP)
+    else:
+        found = found.get(ENTRY_POINT_GROUP, [])
+    for entry_point in found:
+        tools[entry_point.name] = entry_point.value
+    return list(tools.items())
+
+
+def load_tool(spec):
+    """
+    Import the class named by a "module:Class" specification.
+    """
+    module_name, class_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def load_tools(subparsers):
+    """
+    Instantiate every registered tool, adding its subcommand to `subparsers`.
+    Returns a dict of subcommand name -> tool.
+    """
+    return dict((name, load_tool(spec)(subparsers)) for name, spec in tool_entry_points())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Compute resources of the local machine and per-rule requirements.
+
+Per-rule memory comes from the run's cluster configuration (the bundled
+`cluster_config.yaml` merged with the tool's input-size estimates), the same
+`h_vmem` values used for cluster submission, so local runs schedule jobs
+against the same limits.
+"""
+
+import os
+
+import yaml
+
+MEMORY_UNITS = {"k": 1.0 / 1024, "m": 1, "g": 1024, "t": 1024 * 1024}
+
+
+def parse_memory_mb(value):
+    """
+    Convert a memory string such as "5g", "512M" or "2048" (MB) to MB.
+    """
+    value = str(value).strip().lower().rstrip("b")
+    if value and value[-1] in MEMORY_UNITS:
+        return int(float(value[:-1]) * MEMORY_UNITS[value[-1]])
+    return int(float(value))
+
+
+def parse_walltime_seconds(value):
+    """
+    Convert a walltime such as "10:00" or "01:30:00" ([[HH:]MM:]SS) to
+    seconds.
+    """
+    seconds = 0
+    for part in str(value).split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def load_cluster_config(path=None):
+    """
+    Read the cluster configuration, defaulting to the bundled file.
+    """
+    if path is None:
+        from pkg_resources import resource_filename
+        path = resource_filename("bioinformatics.config", "cluster_config.yaml")
+    with open(path) as config_conn:
+        return yaml.safe_load(config_conn)
+
+
+def rule_memory_mb(rule, limit_mb=None, cluster_config=None):
+    """
+    Memory in MB requested for a rule by the cluster configuration, capped
+    at `limit_mb` so a single job never exceeds what the machine offers.
+    """
+    cluster_config = cluster_config or load_cluster_config()
+    settings = dict(cluster_config.get("__default__", {}))
+    settings.update(cluster_config.get(rule, {}))
+    memory_mb = parse_memory_mb(settings["h_vmem"])
+    if limit_mb:
+        memory_mb = min(memory_mb, int(limit_mb))
+    return memory_mb
+
+
+def detect_cores():
+    """
+    Cores available to this process.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def detect_memory_mb():
+    """
+    Physical memory of the machine in MB.
+    """
+    return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 2)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Running a tool's workflow with Toil (`--mode toil`).
+
+The tool builds the root job (`Tool.toil_root`); jobs add their children and
+follow-ons as they learn the work, and the root's return value maps output
+paths, relative to the output directory, to file store IDs that are exported
+when the workflow finishes.
+
+Toil keeps the state of every job in the job store, `<output-dir>/toil_jobstore`
+unless `--job-store` is given. The job store is removed after a successful
+run; if it is still there, the run was interrupted (or a worker was
+preempted beyond Toil's retries) and the next invocation restarts it,
+rerunning only the jobs that had not finished. A restart runs the jobs as
+they were pickled with the first invocation's config, so a fingerprint of
+that config is kept next to the job store and a restart with different
+options or input files is refused.
+"""
+
+import hashlib
+import json
+import os
+
+from bioinformatics.resources import detect_memory_mb, parse_memory_mb
+
+# Toil batch system of each cluster environment, single machine elsewhere
+BATCH_SYSTEMS = {"broad": "grid_engine", "lisa": "torque"}
+JOB_STORE = "toil_jobstore"
+# retries per failed job, so jobs on preempted or lost workers are rerun
+RETRY_COUNT = 3
+FINGERPRINT_SUFFIX = ".config_fingerprint"
+# settings that only size or place the run, free to change on a restart
+RESTART_OPTIONS = ("cores", "max_mem", "max_mem_mb", "max_jobs", "job_store",
+                   "cluster_config", "scratch_dir", "cache_max_size", "cache_max_age")
+
+
+def job_store_path(config):
+    """
+    Directory of the run's file job store.
+    """
+    return os.path.abspath(config.get("job_store")
+                           or os.path.join(config["output_dir"], JOB_STORE))
+
+
+def memory_limit_mb(context, config):
+    """
+    Most memory in MB a Toil job may request: `--max-mem`, or the machine's
+    memory when running single-machine. None on a cluster without
+    `--max-mem`.
+    """
+    if config.get("max_mem"):
+        return parse_memory_mb(config["max_mem"])
+    if context not in BATCH_SYSTEMS:
+        return detect_memory_mb()
+    return None
+
+
+def toil_options(context, config):
+    """
+    Toil options for a run: file-store caching on, restarting the job store
+    if it exists.
+    """
+    from toil.job import Job
+
+    job_store = job_store_path(config)
+    options = Job.Runner.getDefaultOptions(job_store)
+    options.batchSystem = BATCH_SYSTEMS.get(context, "single_machine")
+    options.caching = True
+    options.restart = os.path.exists(job_store)
+    options.retryCount = RETRY_COUNT
+    options.clean = "onSuccess"
+    options.logLevel = "INFO"
+    if config.get("scratch_dir"):
+        # workers keep their file cache on node-local disk
+        if not os.path.exists(config["scratch_dir"]):
+            os.makedirs(config["scratch_dir"])
+        options.workDir = config["scratch_dir"]
+    if options.batchSystem == "single_machine":
+        if config.get("cores"):
+            options.maxCores = config["cores"]
+        if config.get("max_mem_mb"):
+            options.maxMemory = int(config["max_mem_mb"]) * 1024 ** 2
+    return options
+
+
+def config_fingerprint(config):
+    """
+    Hash of the config values that shape the workflow, with the size and
+    modification time of the files they name.
+    """
+    from bioinformatics.provenance import file_signature
+
+    values = {}
+    for key, value in config.items():
+        if key in RESTART_OPTIONS:
+            continue
+        if isinstance(value, str) and os.path.isfile(value):
+            value = file_signature(value)
+        values[key] = value
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def check_restart(fingerprint_file, fingerprint):
+    """
+    Refuse to restart a job store started with another config, whose
+    fingerprint was recorded in `fingerprint_file`.
+    """
+    recorded = None
+    if os.path.exists(fingerprint_file):
+        with open(fingerprint_file) as fingerprint_conn:
+            recorded = fingerprint_conn.read().strip()
+    if recorded != fingerprint:
+        raise Exception("The Toil job store {} was started with other options or input "
+                        "files. Rerun with the original ones to restart it, or remove it "
+                        "to start over.".format(fingerprint_file[:-len(FINGERPRINT_SUFFIX)]))
+
+
+def run_toil(tool, context, config):
+    """
+    Run, or restart, a tool's Toil workflow and export its outputs to the
+    output directory. Returns the exported outputs, or None if jobs failed.
+    """
+    from toil.batchSystems.abstractBatchSystem import InsufficientSystemResources
+    from toil.common import Toil
+    try:
+        from toil.exceptions import FailedJobsException
+    except ImportError:
+        from toil.leader import FailedJobsException
+
+    options = toil_options(context, config)
+    fingerprint_file = job_store_path(config) + FINGERPRINT_SUFFIX
+    fingerprint = config_fingerprint(config)
+    if options.restart:
+        check_restart(fingerprint_file, fingerprint)
+    # leaving the Toil context without an exception removes the job store,
+    # so failures are caught outside it
+    try:
+        with Toil(options) as workflow:
+            if options.restart:
+                print("Restarting the Toil workflow in {}".format(options.jobStore))
+                outputs = workflow.restart()
+            else:
+                with open(fingerprint_file, 'w') as fingerprint_conn:
+                    fingerprint_conn.write(fingerprint + '\n')
+                outputs = workflow.start(tool.toil_root(config))
+
+            for name, file_id in sorted(outputs.items()):
+                path = os.path.abspath(os.path.join(config["output_dir"], name))
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                workflow.export_file(file_id, "file://" + path)
+    except FailedJobsException as error:
+        print(error)
+        print("Run the same command again to restart the failed jobs from {}".format(
+            options.jobStore))
+        return None
+    except InsufficientSystemResources as error:
+        # restarts keep the requests the jobs were created with
+        print(error)
+        print("Remove {} and rerun with a --max-mem or --cores this machine can "
+              "offer".format(job_store_path(config)))
+        return None
+    # the job store is removed after a successful run
+    os.remove(fingerprint_file)
+    return outputs
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+
+from bioinformatics.Tool import Tool
+from bioinformatics.resources import parse_memory_mb, parse_walltime_seconds
+from bioinformatics.tools.batch.manifest import read_manifest
+from bioinformatics.tools.magma.batching import DEFAULT_LD_BLOCK_SNPS
+from bioinformatics.tools.magma.magma import Magma, REF_GENE_LOC
+
+
+class Batch(Tool):
+    """
+    MAGMA (and optionally RegionAnnotator) for every GWAS in a manifest, run
+    as one workflow. Daners with identical SNP sets share their annotation
+    and gene batches.
+    """
+
+    def __init__(self, subparser):
+
+        batch_parser = subparser.add_parser(
+            "batch",
+            help="Run MAGMA and RegionAnnotator for every GWAS in a manifest.")
+        batch_parser.add_argument("--manifest", action="store", dest="manifest",
+                                  help="Tab-separated file with name, daner and sample_size "
+                                       "columns, and optionally daner_clump.")
+        batch_parser.add_argument("--ref-1000g", action="store",
+                                  dest="ref_1000g")
+        batch_parser.add_argument("--gene-window-up", action="store", dest="gene_window_up",
+                                  type=float, default=0,
+                                  help="Upstream gene window in kb.")
+        batch_parser.add_argument("--gene-window-down", action="store", dest="gene_window_down",
+                                  type=float, default=0,
+                                  help="Downstream gene window in kb.")
+        batch_parser.add_argument("--no-reference-staging", action="store_true",
+                                  dest="no_reference_staging",
+                                  help="Read the genome-wide reference panel directly instead of "
+                                       "per-chromosome copies staged to node-local scratch.")
+        batch_parser.add_argument("--batches", action="store", dest="batches",
+                                  type=int, default=22,
+                                  help="Number of cost-balanced gene batches per analysis.")
+        batch_parser.add_argument("--ld-block-snps", action="store", dest="ld_block_snps",
+                                  type=int, default=DEFAULT_LD_BLOCK_SNPS,
+                                  help="LD block size (in SNPs) used to estimate per-gene cost.")
+        batch_parser.add_argument("--ref-gene-loc", action="store",
+                                  dest="ref_gene_loc",
+                                  help="MAGMA gene location file (default: the bundled "
+                                       "NCBI37.3 gene locations).")
+
+        Tool.__init__(
+            self,
+            snakefile=("bioinformatics.tools.batch", "batch.snakefile"),
+            log_handler=Magma.magma_simple_logger)
+
+    def prepare(self, config):
+        """
+        Read the manifest and parse every daner into the cache, grouping
+        analyses by SNP set so each set is annotated once.
+        """
+        from pkg_resources import resource_filename
+        from bioinformatics.cache import cache_from_config
+        from bioinformatics.daner_cache import load_daner, snp_set_hash
+
+        if not config.get("ref_gene_loc"):
+            config["ref_gene_loc"] = resource_filename(*REF_GENE_LOC)
+        cache = cache_from_config(config)
+        analyses = read_manifest(config["manifest"])
+        for name, analysis in analyses.items():
+            store = load_daner(analysis["daner"], cache)
+            analysis["store"] = store.directory
+            analysis["snp_set"] = snp_set_hash(store)[:16]
+        config["analyses"] = analyses
+        print("{} analyses over {} distinct SNP sets".format(
+            len(analyses), len(set(analysis["snp_set"] for analysis in analyses.values()))))
+
+    def plan_resources(self, config):
+        """
+        Size jobs for the largest analysis: every rule gets the maximum of the
+        per-daner MAGMA estimates.
+        """
+        from bioinformatics.daner_cache import DanerStore
+        from bioinformatics.tools.magma.resource_model import estimate_resources
+
+        plan = {}
+        for store_dir in sorted(set(analysis["store"]
+                                    for analysis in config["analyses"].values())):
+            estimate = estimate_resources(DanerStore(store_dir), config["ref_gene_loc"],
+                                          config["ref_1000g"], config["batches"],
+                                          config["ld_block_snps"],
+                                          config["gene_window_up"],
+                                          config["gene_window_down"])
+            for rule, settings in estimate.items():
+                if rule not in plan:
+                    plan[rule] = dict(settings)
+                    continue
+                if parse_memory_mb(settings["h_vmem"]) > parse_memory_mb(plan[rule]["h_vmem"]):
+                    plan[rule]["h_vmem"] = settings["h_vmem"]
+                if (parse_walltime_seconds(settings["walltime"])
+                        > parse_walltime_seconds(plan[rule]["walltime"])):
+                    plan[rule]["walltime"] = settings["walltime"]
+        return plan
+
+    def parallel_jobs(self, config):
+        return len(config["analyses"]) * config["batches"]
+
+    def array_phases(self, config):
+        """
+        The gene batches of every analysis in one array job.
+        """
+        from bioinformatics.tools.magma.batching import batch_name
+
+        gz = ".gz" if config.get("intermediate_format", "bgzip") == "bgzip" else ""
+        return [("test_gene_sets",
+                 [[os.path.join(config["output_dir"], name, "intermediate_results",
+                                "gene_results.{}.genes.out{}".format(
+                                    batch_name(batch, config["batches"]), gz))]
+                  for name in sorted(config["analyses"])
+                  for batch in range(1, config["batches"] + 1)])]
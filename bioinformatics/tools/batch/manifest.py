@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Manifest of the GWAS results analysed together in batch mode.
+
+A manifest is a tab-separated file with a header line and one analysis per
+line. `name`, `daner` and `sample_size` are required; an optional
+`daner_clump` column adds RegionAnnotator annotation of the clumped results.
+Lines starting with "#" are ignored and relative paths are taken relative to
+the manifest. Analysis names become directories of the output directory, next
+to the workflow's own `shared`, `logs` and `benchmarks`.
+"""
+
+import os
+import re
+
+REQUIRED_COLUMNS = ["name", "daner", "sample_size"]
+OPTIONAL_COLUMNS = ["daner_clump"]
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+# directories of the batch workflow's own output layout
+RESERVED_NAMES = ("shared", "logs", "benchmarks")
+
+
+def read_manifest(manifest_file):
+    """
+    Read a manifest into a dict of analysis name -> {"daner", "sample_size",
+    "daner_clump"}, in manifest order.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    analyses = {}
+    header = None
+    with open(manifest_file) as manifest_conn:
+        for line_number, line in enumerate(manifest_conn, start=1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.rstrip("\n").split("\t")]
+            if header is None:
+                header = fields
+                missing = [column for column in REQUIRED_COLUMNS if column not in header]
+                if missing:
+                    raise ValueError("Manifest {} lacks the columns: {}".format(
+                        manifest_file, ", ".join(missing)))
+                continue
+
+            row = dict(zip(header, fields))
+            name = row["name"]
+            if not NAME_PATTERN.match(name):
+                raise ValueError("Line {} of {}: analysis names may only contain letters, "
+                                 "digits, '.', '_' and '-', and start with a letter or "
+                                 "digit".format(line_number, manifest_file))
+            if name in RESERVED_NAMES:
+                raise ValueError("Line {} of {}: {} is reserved for the workflow's own "
+                                 "outputs".format(line_number, manifest_file, name))
+            if name in analyses:
+                raise ValueError("Line {} of {}: duplicate analysis name {}".format(
+                    line_number, manifest_file, name))
+
+            analysis = {"sample_size": row["sample_size"]}
+            for column in ["daner"] + OPTIONAL_COLUMNS:
+                path = row.get(column)
+                if not path or path == "NA":
+                    analysis[column] = None
+                    continue
+                path = os.path.join(base_dir, path)
+                if not os.path.exists(path):
+                    raise ValueError("Line {} of {}: {} does not exist".format(
+                        line_number, manifest_file, path))
+                analysis[column] = path
+            if analysis["daner"] is None:
+                raise ValueError("Line {} of {}: no daner given".format(line_number,
+                                                                        manifest_file))
+            analyses[name] = analysis
+    if not analyses:
+        raise ValueError("Manifest {} lists no analyses".format(manifest_file))
+    return analyses
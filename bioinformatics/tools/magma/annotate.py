@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Native replacement for `magma --annotate`.
+
+Genes from a MAGMA gene location file are indexed per chromosome. SNP
+positions from the daner store are sorted once per chromosome, after which the
+SNPs inside each gene window are found with two vectorized `searchsorted`
+calls. The result is written in MAGMA's `.genes.annot` format, as indexed
+BGZF when the output path ends in ".gz".
+"""
+
+import numpy as np
+
+from bioinformatics.bgzf import TextWriter
+from bioinformatics.daner_cache import chromosome_code
+
+
+class GeneIndex():
+    """
+    Per-chromosome index of gene windows.
+
+    Windows are given in kilobases, as for MAGMA's `window=up,down` modifier.
+    Upstream and downstream are taken relative to the strand in the fifth
+    column of the gene location file when it is present.
+    """
+
+    def __init__(self, gene_loc_file, window_up=0, window_down=0):
+        self.gene_loc_file = gene_loc_file
+        self.window_up = window_up
+        self.window_down = window_down
+
+        up = int(window_up * 1000)
+        down = int(window_down * 1000)
+        # chromosome code -> lists of gene ids, locations, window starts/stops
+        self.chromosomes = {}
+        self.chromosome_order = []
+        with open(gene_loc_file) as gene_loc_conn:
+            for line in gene_loc_conn:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                gene, chrom, start, stop = fields[:4]
+                code = chromosome_code(chrom)
+                if code is None:
+                    continue
+                start, stop = int(start), int(stop)
+                if len(fields) > 4 and fields[4] == "-":
+                    window_start, window_stop = start - down, stop + up
+                else:
+                    window_start, window_stop = start - up, stop + down
+                if code not in self.chromosomes:
+                    self.chromosomes[code] = ([], [], [], [])
+                    self.chromosome_order.append(code)
+                genes = self.chromosomes[code]
+                genes[0].append(gene)
+                genes[1].append("{}:{}:{}".format(chrom, start, stop))
+                genes[2].append(max(window_start, 0))
+                genes[3].append(window_stop)
+
+        self.chromosomes = {code: (genes, locations,
+                                   np.asarray(starts, dtype=np.int64),
+                                   np.asarray(stops, dtype=np.int64))
+                            for code, (genes, locations, starts, stops)
+                            in self.chromosomes.items()}
+
+    def annotate_chromosome(self, code, snps, positions):
+        """
+        Yield (gene, location, snps) for every gene on a chromosome that
+        contains at least one of the given SNPs. SNPs are listed by position.
+        """
+        genes, locations, starts, stops = self.chromosomes[code]
+        order = np.argsort(positions, kind="stable")
+        positions = positions[order]
+        snps = snps[order]
+
+        lower = np.searchsorted(positions, starts, side="left")
+        upper = np.searchsorted(positions, stops, side="right")
+        for gene, location, first, last in zip(genes, locations, lower, upper):
+            if last > first:
+                yield gene, location, snps[first:last]
+
+
+def annotate(store, gene_index, output_file, snp_loc_file="NA", keep=None):
+    """
+    Write a MAGMA `.genes.annot` file for every SNP in a daner store, or for
+    the rows selected by the boolean mask `keep`.
+
+    `snp_loc_file` only fills the header line naming the SNP input. Returns
+    the number of genes written.
+    """
+    valid = store["BP"] > 0
+    if keep is not None:
+        valid &= keep
+    n_genes = 0
+    with TextWriter(output_file, columns=1) as output_conn:
+        output_conn.write("# window_up = {:g}\n".format(gene_index.window_up))
+        output_conn.write("# window_down = {:g}\n".format(gene_index.window_down))
+        output_conn.write("# input_snp_loc = {}\n".format(snp_loc_file))
+        output_conn.write("# input_gene_loc = {}\n".format(gene_index.gene_loc_file))
+        output_conn.write("# total_SNPs = {}\n".format(int(valid.sum())))
+
+        for code in gene_index.chromosome_order:
+            if str(code) not in store.meta["chromosomes"]:
+                continue
+            index = store.chromosome_index(code)
+            index = index[valid[index]]
+            snps = store["SNP"][index].astype(str)
+            positions = store["BP"][index]
+            lines, starts, stops = [], [], []
+            for gene, location, gene_snps in gene_index.annotate_chromosome(code, snps, positions):
+                lines.append('\t'.join([gene, location] + gene_snps.tolist()) + '\n')
+                _, start, stop = location.split(":")
+                starts.append(int(start))
+                stops.append(int(stop))
+            output_conn.write_records(''.join(lines), [code] * len(lines), starts, stops)
+            n_genes += len(lines)
+    return n_genes
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Cost-balanced partitioning of genes into MAGMA batch jobs.
+
+One job per autosome leaves the merge waiting on chromosome 1. Instead, the
+annotated genes are walked in genomic order and cut into `n_batches`
+contiguous blocks of roughly equal estimated cost. Each block gets its own
+`.genes.annot` file and is tested as one job, with outputs named after
+MAGMA's numeric `--batch k N` convention.
+"""
+
+import os
+
+# genes whose SNPs span more than this many markers are assumed to be
+# evaluated in LD blocks of this size by MAGMA's SNP-wise model
+DEFAULT_LD_BLOCK_SNPS = 1000
+
+BATCH_SUMMARY_HEADER = ["BATCH", "GENES", "SNPS", "COST", "CHROMOSOMES"]
+
+
+def batch_name(batch, n_batches):
+    """
+    MAGMA's name for batch `batch` of `n_batches`, e.g. "batch3_200".
+    """
+    return "batch{}_{}".format(batch, n_batches)
+
+
+def read_gene_locations(gene_loc_file):
+    """
+    Map gene IDs of a MAGMA gene location file to (chromosome code, start,
+    stop), with code 0 for chromosomes without one.
+    """
+    from bioinformatics.daner_cache import chromosome_code
+
+    locations = {}
+    with open(gene_loc_file) as gene_loc_conn:
+        for line in gene_loc_conn:
+            fields = line.split()
+            if not fields:
+                continue
+            locations[fields[0]] = (chromosome_code(fields[1]) or 0, int(fields[2]),
+                                    int(fields[3]))
+    return locations
+
+
+def read_gene_order(gene_loc_file):
+    """
+    Map gene IDs of a MAGMA gene location file to their genomic rank, in
+    the order the merge sorts gene results by.
+    """
+    locations = read_gene_locations(gene_loc_file)
+    genes = sorted(location + (gene,) for gene, location in locations.items())
+    return {gene: rank for rank, (_, _, _, gene) in enumerate(genes)}
+
+
+def read_annotation_sizes(annot_file):
+    """
+    Gene ID, chromosome and SNP count for every gene in a `.genes.annot` file.
+    """
+    # imported here: the command line reads this module's defaults, and
+    # bgzf pulls in numpy
+    from bioinformatics.bgzf import open_text
+
+    sizes = []
+    with open_text(annot_file) as annot_conn:
+        for line in annot_conn:
+            if line.startswith("#"):
+                continue
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            sizes.append((fields[0], fields[1].split(":")[0], len(fields) - 2))
+    return sizes
+
+
+def gene_cost(n_snps, ld_block_snps=DEFAULT_LD_BLOCK_SNPS):
+    """
+    Estimated cost of testing a gene: SNP count times the size of the LD
+    block its correlation matrix is built over.
+    """
+    return n_snps * max(1, min(n_snps, ld_block_snps))
+
+
+def partition(costs, n_batches):
+    """
+    Split a sequence of costs into at most `n_batches` contiguous blocks of
+    roughly equal total cost. Returns the batch number (1-based) of each item.
+
+    Each block closes once it reaches the average cost of the blocks still to
+    be filled, so a single expensive gene cannot starve later batches.
+    """
+    assignment = []
+    remaining_cost = float(sum(costs))
+    remaining_items = len(costs)
+    batch = 1
+    batch_cost = 0
+    for cost in costs:
+        remaining_batches = n_batches - batch + 1
+        target = remaining_cost / remaining_batches if remaining_batches else remaining_cost
+        if (batch_cost > 0 and batch < n_batches
+                and (batch_cost + cost / 2.0 > target
+                     or remaining_items < remaining_batches)):
+            remaining_cost -= batch_cost
+            batch += 1
+            batch_cost = 0
+        assignment.append(batch)
+        batch_cost += cost
+        remaining_items -= 1
+    return assignment
+
+
+def write_batches(annot_file, gene_loc_file, batch_dir, n_batches,
+                  ld_block_snps=DEFAULT_LD_BLOCK_SNPS):
+    """
+    Write one `.genes.annot` file per batch plus a `batches.tsv` summary.
+
+    Batches without genes still get an annotation file containing only the
+    header comments so the workflow's outputs are known up front. With a
+    position index next to `annot_file`, each batch reads only its own
+    slice of it.
+    """
+    from bioinformatics.bgzf import INDEX_SUFFIX
+
+    os.makedirs(batch_dir, exist_ok=True)
+    locations = read_gene_locations(gene_loc_file)
+    gene_rank = read_gene_order(gene_loc_file)
+    sizes = read_annotation_sizes(annot_file)
+    sizes.sort(key=lambda size: gene_rank.get(size[0], len(gene_rank)))
+
+    costs = [gene_cost(n_snps, ld_block_snps) for _, _, n_snps in sizes]
+    assignment = partition(costs, n_batches)
+    gene_batch = {gene: batch for (gene, _, _), batch in zip(sizes, assignment)}
+
+    summary = {batch: [0, 0, 0, []] for batch in range(1, n_batches + 1)}
+    for (_, chrom, n_snps), cost, batch in zip(sizes, costs, assignment):
+        batch_summary = summary[batch]
+        batch_summary[0] += 1
+        batch_summary[1] += n_snps
+        batch_summary[2] += cost
+        if chrom not in batch_summary[3]:
+            batch_summary[3].append(chrom)
+
+    if (os.path.exists(annot_file + INDEX_SUFFIX)
+            and all(gene in locations for gene in gene_batch)):
+        write_batch_slices(annot_file, batch_dir, n_batches, gene_batch, locations)
+    else:
+        write_batch_lines(annot_file, batch_dir, n_batches, gene_batch)
+
+    with open(os.path.join(batch_dir, "batches.tsv"), 'w') as summary_conn:
+        summary_conn.write('\t'.join(BATCH_SUMMARY_HEADER) + '\n')
+        for batch, (genes, snps, cost, chroms) in sorted(summary.items()):
+            summary_conn.write('\t'.join([batch_name(batch, n_batches), str(genes),
+                                          str(snps), str(cost),
+                                          ','.join(chroms) or '-']) + '\n')
+    return summary
+
+
+def write_batch_lines(annot_file, batch_dir, n_batches, gene_batch):
+    """
+    Write the batch annotation files in one pass over the annotation,
+    holding every batch file open.
+    """
+    from bioinformatics.bgzf import open_text
+
+    batch_files = {batch: open(batch_annot_file(batch_dir, batch, n_batches), 'w')
+                   for batch in range(1, n_batches + 1)}
+    try:
+        with open_text(annot_file) as annot_conn:
+            for line in annot_conn:
+                if line.startswith("#"):
+                    for batch_conn in batch_files.values():
+                        batch_conn.write(line)
+                    continue
+                gene = line.split(None, 1)[0] if line.strip() else None
+                if gene in gene_batch:
+                    batch_files[gene_batch[gene]].write(line)
+    finally:
+        for batch_conn in batch_files.values():
+            batch_conn.close()
+
+
+def write_batch_slices(annot_file, batch_dir, n_batches, gene_batch, locations):
+    """
+    Write the batch annotation files one at a time from a position-indexed
+    annotation: each batch reads only the region its genes span on each of
+    its chromosomes.
+    """
+    from bioinformatics.bgzf import IndexedReader
+
+    regions = {}
+    for gene, batch in gene_batch.items():
+        code, start, stop = locations[gene]
+        region = regions.setdefault(batch, {}).setdefault(code, [start, stop])
+        region[0] = min(region[0], start)
+        region[1] = max(region[1], stop)
+
+    with IndexedReader(annot_file) as reader:
+        header = reader.header()
+        file_order = {int(chrom): rank for rank, chrom in enumerate(reader.chromosomes())}
+        for batch in range(1, n_batches + 1):
+            batch_regions = regions.get(batch, {})
+            with open(batch_annot_file(batch_dir, batch, n_batches), 'w') as batch_conn:
+                batch_conn.writelines(header)
+                for code in sorted(batch_regions, key=lambda code: file_order.get(code, -1)):
+                    start, stop = batch_regions[code]
+                    for line in reader.fetch(code, start, stop):
+                        if gene_batch.get(line.split(None, 1)[0]) == batch:
+                            batch_conn.write(line)
+
+
+def read_batch_chromosomes(summary_file):
+    """
+    Map batch names to the chromosomes listed for them in `batches.tsv`.
+    """
+    chromosomes = {}
+    with open(summary_file) as summary_conn:
+        header = summary_conn.readline().rstrip("\n").split("\t")
+        for line in summary_conn:
+            row = dict(zip(header, line.rstrip("\n").split("\t")))
+            chromosomes[row["BATCH"]] = [chrom for chrom in row["CHROMOSOMES"].split(",")
+                                         if chrom and chrom != "-"]
+    return chromosomes
+
+
+def batch_annot_file(batch_dir, batch, n_batches):
+    """
+    Path of the annotation file of one batch.
+    """
+    return os.path.join(batch_dir, "{}.genes.annot".format(batch_name(batch, n_batches)))
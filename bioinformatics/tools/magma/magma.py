@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 
+import os
+
 from bioinformatics.Tool import Tool
-from pkg_resources import resource_filename
+from bioinformatics.tools.magma.batching import DEFAULT_LD_BLOCK_SNPS
+
+REF_GENE_LOC = ("bioinformatics.tools.magma",
+                "resources/magma_linux/reference_data/NCBI37.3.gene.loc")
 
 
 class Magma(Tool):
@@ -14,10 +19,12 @@ class Magma(Tool):
         if log_dict["level"] == "job_info":
             if log_dict["name"] == "make_snp_location_file":
                 print("\tCreating SNP location file")
+            elif log_dict["name"] == "prefilter_snps":
+                print("\tFiltering SNPs before annotation")
             elif log_dict["name"] == "annotate_summary_stats":
                 print("\tAnnotating summary statistics with gene-membership")
             elif log_dict["name"] == "test_gene_sets":
-                print("\tTesting genes on chr{chrom}".format(chrom=log_dict["wildcards"]["chrom"]))
+                print("\tTesting genes in {batch}".format(batch=log_dict["wildcards"]["batch"]))
             elif log_dict["name"] == "merge_test_sets":
                 print("\tMerging test results")
             else:
@@ -33,15 +40,96 @@ class Magma(Tool):
                                   dest="ref_1000g")
         magma_parser.add_argument("--sample-size", action="store",
                                   dest="study_sample_size")
+        magma_parser.add_argument("--annotator", action="store", dest="annotator",
+                                  choices=["native", "magma"], default="native",
+                                  help="Annotate SNPs to genes natively or with the MAGMA binary.")
+        magma_parser.add_argument("--gene-window-up", action="store", dest="gene_window_up",
+                                  type=float, default=0,
+                                  help="Upstream gene window in kb.")
+        magma_parser.add_argument("--gene-window-down", action="store", dest="gene_window_down",
+                                  type=float, default=0,
+                                  help="Downstream gene window in kb.")
+        magma_parser.add_argument("--merger", action="store", dest="merger",
+                                  choices=["native", "magma"], default="native",
+                                  help="Merge batch results with a streaming merge (which also "
+                                       "writes a SQLite gene index) or with magma --merge.")
+        magma_parser.add_argument("--no-reference-staging", action="store_true",
+                                  dest="no_reference_staging",
+                                  help="Read the genome-wide reference panel directly instead of "
+                                       "per-chromosome copies staged to node-local scratch.")
+        magma_parser.add_argument("--batches", action="store", dest="batches",
+                                  type=int, default=22,
+                                  help="Number of cost-balanced gene batches to test in parallel.")
+        magma_parser.add_argument("--ld-block-snps", action="store", dest="ld_block_snps",
+                                  type=int, default=DEFAULT_LD_BLOCK_SNPS,
+                                  help="LD block size (in SNPs) used to estimate per-gene cost.")
+        magma_parser.add_argument("--min-info", action="store", dest="min_info",
+                                  type=float, default=None,
+                                  help="Drop SNPs with imputation INFO below this before annotation.")
+        magma_parser.add_argument("--min-maf", action="store", dest="min_maf",
+                                  type=float, default=None,
+                                  help="Drop SNPs with minor allele frequency below this "
+                                       "before annotation.")
+        magma_parser.add_argument("--gene-overlap-filter", action="store_true",
+                                  dest="gene_overlap_filter",
+                                  help="Drop SNPs outside every gene window before annotation.")
         magma_parser.add_argument("--ref-gene-loc", action="store",
                                   dest="ref_gene_loc",
-                                  default=resource_filename(
-                                      "bioinformatics.tools.magma",
-                                      "resources/magma_linux/reference_data/NCBI37.3.gene.loc"))
+                                  help="MAGMA gene location file (default: the bundled "
+                                       "NCBI37.3 gene locations).")
 
         Tool.__init__(
             self,
-            snakefile=resource_filename(
-                "bioinformatics.tools.magma",
-                "magma.snakefile"),
-            log_handler=None)
+            snakefile=("bioinformatics.tools.magma", "magma.snakefile"),
+            log_handler=self.magma_simple_logger)
+
+    def prepare(self, config):
+        """
+        Default to the bundled gene locations.
+        """
+        if not config.get("ref_gene_loc"):
+            from pkg_resources import resource_filename
+            config["ref_gene_loc"] = resource_filename(*REF_GENE_LOC)
+
+    def plan_resources(self, config):
+        """
+        Size MAGMA jobs from the daner, reference panel and gene locations.
+        Parsing the daner here fills the cache the submitted jobs read from.
+        """
+        from bioinformatics.cache import cache_from_config
+        from bioinformatics.daner_cache import load_daner
+        from bioinformatics.tools.magma.resource_model import estimate_resources
+
+        store = load_daner(config["daner"], cache_from_config(config))
+        return estimate_resources(store, config["ref_gene_loc"], config["ref_1000g"],
+                                  config["batches"], config["ld_block_snps"],
+                                  config["gene_window_up"], config["gene_window_down"],
+                                  config.get("merger") or "native")
+
+    def parallel_jobs(self, config):
+        return config["batches"]
+
+    def array_phases(self, config):
+        """
+        All gene batches in one array job, a task per batch.
+        """
+        from bioinformatics.tools.magma.batching import batch_name
+
+        gz = ".gz" if config.get("intermediate_format", "bgzip") == "bgzip" else ""
+        suffix = gz if config.get("merger", "native") != "magma" else ""
+        result_file = os.path.join(config["output_dir"], "intermediate_results",
+                                   "gene_results.{}.genes.out" + suffix)
+        return [("test_gene_sets",
+                 [[result_file.format(batch_name(batch, config["batches"]))]
+                  for batch in range(1, config["batches"] + 1)])]
+
+    def toil_root(self, config):
+        """
+        Annotation and batching, which add the gene tests and the merge.
+        """
+        from bioinformatics.tools.magma.toil_jobs import MakeGeneBatches
+
+        if config.get("annotator") == "magma" or config.get("merger") == "magma":
+            raise Exception("Toil mode annotates and merges natively; "
+                            "drop --annotator/--merger magma")
+        return MakeGeneBatches(config)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Streaming replacement for `magma --merge`.
+
+Every batch writes its `.genes.out` and `.genes.raw` in genomic order, so the
+genome-wide files are a k-way merge of the batch files on (chromosome,
+start, stop, gene) with `heapq.merge`, holding one line per input in memory.
+Batches are merged in groups as soon as each group has finished, and the
+group files are merged into the final result. Inputs may be plain text or
+BGZF, and outputs ending in ".gz" are written as position-indexed BGZF. The
+merged `.genes.out` is also loaded into a SQLite index keyed by gene ID,
+symbol and position.
+"""
+
+import heapq
+import os
+import sqlite3
+
+from bioinformatics.bgzf import TextWriter, open_text
+from bioinformatics.daner_cache import chromosome_code
+
+# batches merged together before the final merge
+DEFAULT_MERGE_FAN_IN = 8
+
+INDEX_COLUMNS = [("gene", "TEXT PRIMARY KEY"),
+                 ("symbol", "TEXT"),
+                 ("chr", "INTEGER"),
+                 ("start", "INTEGER"),
+                 ("stop", "INTEGER"),
+                 ("nsnps", "INTEGER"),
+                 ("nparam", "INTEGER"),
+                 ("n", "REAL"),
+                 ("zstat", "REAL"),
+                 ("p", "REAL")]
+
+
+# what MAGMA writes at the top of gene result files; batches without genes get
+# only these, so that `magma --merge` and the streaming merge can read them
+EMPTY_RESULTS = {".genes.out": "GENE       CHR      START       STOP  NSNPS  NPARAM"
+                               "       N        ZSTAT            P\n",
+                 ".genes.raw": "# VERSION = 105\n# COVAR = NSAMP MAC\n"}
+
+
+def group_name(group, n_groups):
+    """
+    Name of merge group `group` of `n_groups`, e.g. "group2_3".
+    """
+    return "group{}_{}".format(group, n_groups)
+
+
+def merge_groups(batches, fan_in=DEFAULT_MERGE_FAN_IN):
+    """
+    Split consecutive batch names into named groups of at most `fan_in`.
+    """
+    fan_in = max(1, int(fan_in))
+    chunks = [batches[start:start + fan_in] for start in range(0, len(batches), fan_in)]
+    return dict((group_name(group, len(chunks)), chunk)
+                for group, chunk in enumerate(chunks, start=1))
+
+
+def _result_key(line):
+    fields = line.split(None, 4)
+    return (chromosome_code(fields[1]) or 0, int(fields[2]), int(fields[3]), fields[0])
+
+
+def read_results(path):
+    """
+    Split a MAGMA gene result file into its header lines ("#" comments and
+    the column header) and an iterator over (key, line) for the genes.
+    """
+    result_conn = open_text(path)
+    header = []
+    for line in result_conn:
+        if line.startswith("#") or line.startswith("GENE"):
+            header.append(line)
+        elif line.strip():
+            first = line
+            break
+    else:
+        result_conn.close()
+        return header, iter(())
+
+    def rows():
+        with result_conn:
+            yield _result_key(first), first
+            for line in result_conn:
+                if line.strip():
+                    yield _result_key(line), line
+
+    return header, rows()
+
+
+def merge_results(input_files, output_file, chunk_size=10000):
+    """
+    Merge gene result files that are each in genomic order. The header is
+    taken from the first input that has one. Returns the number of genes.
+
+    A single input is simply copied, which compresses and indexes a MAGMA
+    result file when `output_file` ends in ".gz".
+    """
+    header = []
+    streams = []
+    for input_file in input_files:
+        file_header, rows = read_results(input_file)
+        header = header or file_header
+        streams.append(rows)
+
+    n_genes = 0
+    with TextWriter(output_file, columns=(1, 2, 3)) as output_conn:
+        output_conn.write(''.join(header))
+        chunk = []
+        for row in heapq.merge(*streams, key=lambda row: row[0]):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                _write_rows(output_conn, chunk)
+                n_genes += len(chunk)
+                chunk = []
+        _write_rows(output_conn, chunk)
+        n_genes += len(chunk)
+    return n_genes
+
+
+def _write_rows(output_conn, rows):
+    if rows:
+        output_conn.write_records(''.join(line for _, line in rows),
+                                  [key[0] for key, _ in rows],
+                                  [key[1] for key, _ in rows],
+                                  [key[2] for key, _ in rows])
+
+
+def merge_gene_results(input_prefixes, output_prefix, input_suffix="", output_suffix=""):
+    """
+    Merge the `.genes.out` and `.genes.raw` files of several batches (or
+    merge groups) into `<output_prefix>.genes.out/.genes.raw`. The suffixes
+    (e.g. ".gz") are appended to the input and output file names.
+    """
+    for suffix in (".genes.out", ".genes.raw"):
+        merge_results([prefix + suffix + input_suffix for prefix in input_prefixes],
+                      output_prefix + suffix + output_suffix)
+
+
+def write_empty_results(output_prefix):
+    """
+    Write header-only `<output_prefix>.genes.out/.genes.raw` files for a
+    batch without genes.
+    """
+    for suffix, header in EMPTY_RESULTS.items():
+        with open(output_prefix + suffix, 'w') as output_conn:
+            output_conn.write(header)
+
+
+def read_gene_symbols(gene_loc_file):
+    """
+    Map gene IDs to the symbols in the sixth column of a gene location file.
+    """
+    symbols = {}
+    with open(gene_loc_file) as gene_loc_conn:
+        for line in gene_loc_conn:
+            fields = line.split()
+            if len(fields) > 5:
+                symbols[fields[0]] = fields[5]
+    return symbols
+
+
+def write_gene_index(genes_out_file, index_file, gene_loc_file=None, chunk_size=10000):
+    """
+    Load a merged `.genes.out` into a SQLite database with indexes on gene
+    symbol and position. Returns the number of genes indexed.
+    """
+    symbols = read_gene_symbols(gene_loc_file) if gene_loc_file else {}
+    tmp_file = index_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    connection = sqlite3.connect(tmp_file)
+    connection.execute("CREATE TABLE genes ({})".format(
+        ", ".join("{} {}".format(name, kind) for name, kind in INDEX_COLUMNS)))
+    insert = "INSERT INTO genes VALUES ({})".format(", ".join("?" * len(INDEX_COLUMNS)))
+
+    n_genes = 0
+    header, rows = read_results(genes_out_file)
+    columns = header[-1].split() if header else []
+    chunk = []
+    for _, line in rows:
+        row = dict(zip(columns, line.split()))
+        chunk.append((row["GENE"], symbols.get(row["GENE"]),
+                      chromosome_code(row["CHR"]), int(row["START"]), int(row["STOP"]),
+                      int(row["NSNPS"]), int(row["NPARAM"]), float(row["N"]),
+                      float(row["ZSTAT"]), float(row["P"])))
+        if len(chunk) >= chunk_size:
+            connection.executemany(insert, chunk)
+            n_genes += len(chunk)
+            chunk = []
+    connection.executemany(insert, chunk)
+    n_genes += len(chunk)
+
+    connection.execute("CREATE INDEX genes_symbol ON genes (symbol)")
+    connection.execute("CREATE INDEX genes_position ON genes (chr, start, stop)")
+    connection.commit()
+    connection.close()
+    os.rename(tmp_file, index_file)
+    return n_genes
+
+
+class GeneResultIndex():
+    """
+    Read-only lookups in a gene result index written by `write_gene_index`.
+    Rows are returned as dicts keyed by the index column names.
+    """
+
+    def __init__(self, index_file):
+        self.connection = sqlite3.connect("file:{}?mode=ro".format(index_file), uri=True)
+        self.connection.row_factory = sqlite3.Row
+
+    def _query(self, where, arguments):
+        cursor = self.connection.execute(
+            "SELECT * FROM genes WHERE {} ORDER BY chr, start".format(where), arguments)
+        return [dict(row) for row in cursor]
+
+    def gene(self, gene_id):
+        rows = self._query("gene = ?", (str(gene_id),))
+        return rows[0] if rows else None
+
+    def symbol(self, symbol):
+        return self._query("symbol = ?", (symbol,))
+
+    def region(self, chrom, start, stop):
+        """
+        Genes overlapping [start, stop] on a chromosome.
+        """
+        return self._query("chr = ? AND start <= ? AND stop >= ?",
+                           (chromosome_code(str(chrom)), int(stop), int(start)))
+
+    def close(self):
+        self.connection.close()
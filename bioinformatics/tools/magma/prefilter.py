@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Drop SNPs MAGMA cannot use before they reach annotation.
+
+SNPs with low imputation INFO, rare SNPs (minor allele frequency from the
+FRQ_A_<cases>/FRQ_U_<controls> columns, weighted by the case and control
+counts in their names) and SNPs outside every gene window are removed from
+the daner store in vectorized passes. The stage writes the reduced SNP
+location file, a boolean mask of kept store rows for the native annotator,
+and a per-chromosome report of how many SNPs each filter removed. Removed
+SNPs are left out of the annotation, and with it out of the p-value shards.
+"""
+
+import numpy as np
+
+from bioinformatics.daner_cache import write_snp_loc
+
+REPORT_HEADER = ["CHR", "SNPS", "REMOVED_INFO", "REMOVED_MAF", "REMOVED_WINDOW", "KEPT"]
+
+
+def case_control_counts(header):
+    """
+    (cases, controls) from the FRQ_A_<n>/FRQ_U_<n> column names of a daner
+    header. Counts that cannot be read are None.
+    """
+    counts = {"FRQ_A_": None, "FRQ_U_": None}
+    for name in header:
+        for prefix in counts:
+            if name.startswith(prefix):
+                try:
+                    counts[prefix] = int(name[len(prefix):])
+                except ValueError:
+                    pass
+    return counts["FRQ_A_"], counts["FRQ_U_"]
+
+
+def minor_allele_frequency(store):
+    """
+    Minor allele frequency of every SNP in a daner store, averaging case and
+    control frequencies by sample count (equally if the counts are unknown).
+    """
+    n_cases, n_controls = case_control_counts(store.meta["header"])
+    if "FRQ_A" in store and "FRQ_U" in store:
+        case_weight = float(n_cases or 1)
+        control_weight = float(n_controls or 1)
+        frequency = ((store["FRQ_A"] * case_weight + store["FRQ_U"] * control_weight)
+                     / (case_weight + control_weight))
+    elif "FRQ_A" in store:
+        frequency = np.asarray(store["FRQ_A"])
+    elif "FRQ_U" in store:
+        frequency = np.asarray(store["FRQ_U"])
+    else:
+        raise KeyError("The daner has no FRQ_A/FRQ_U columns to filter on MAF")
+    return np.minimum(frequency, 1 - frequency)
+
+
+def check_columns(store, min_info=None, min_maf=None):
+    """
+    Raise a ValueError naming the daner columns the requested filters need
+    but the store lacks.
+    """
+    if min_info and "INFO" not in store:
+        raise ValueError("--min-info needs an INFO column, which the daner lacks")
+    if min_maf and "FRQ_A" not in store and "FRQ_U" not in store:
+        raise ValueError("--min-maf needs FRQ_A_<cases> or FRQ_U_<controls> columns, "
+                         "which the daner lacks")
+
+
+def in_gene_window(store, gene_index):
+    """
+    Boolean mask of the store rows inside at least one gene window.
+
+    Windows on a chromosome are sorted by start; a SNP is covered if the
+    furthest stop among windows starting at or before it reaches it.
+    """
+    covered = np.zeros(len(store), dtype=bool)
+    for code in store.chromosomes():
+        if code not in gene_index.chromosomes:
+            continue
+        _, _, starts, stops = gene_index.chromosomes[code]
+        order = np.argsort(starts, kind="stable")
+        starts = starts[order]
+        reach = np.maximum.accumulate(stops[order])
+
+        index = store.chromosome_index(code)
+        positions = store["BP"][index]
+        window = np.searchsorted(starts, positions, side="right") - 1
+        covered[index] = (window >= 0) & (reach[np.maximum(window, 0)] >= positions)
+    return covered
+
+
+def prefilter(store, snp_loc_file, keep_file, report_file,
+              min_info=None, min_maf=None, gene_index=None):
+    """
+    Filter a daner store on INFO, MAF and gene window overlap, each step
+    applied only when its threshold (or `gene_index`) is given.
+
+    Returns the boolean mask of kept rows, which is also saved to `keep_file`.
+    """
+    check_columns(store, min_info, min_maf)
+    keep = np.ones(len(store), dtype=bool)
+    removed = {}
+
+    # filters run in turn, so every SNP is counted against the first it fails;
+    # missing values never fail a filter
+    if min_info:
+        failed = keep & (store["INFO"] < min_info)
+        keep &= ~failed
+        removed["REMOVED_INFO"] = failed
+    if min_maf:
+        failed = keep & (minor_allele_frequency(store) < min_maf)
+        keep &= ~failed
+        removed["REMOVED_MAF"] = failed
+    if gene_index is not None:
+        failed = keep & ~in_gene_window(store, gene_index)
+        keep &= ~failed
+        removed["REMOVED_WINDOW"] = failed
+
+    np.save(keep_file, keep)
+    write_snp_loc(store, snp_loc_file, keep)
+
+    with open(report_file, 'w') as report_conn:
+        report_conn.write('\t'.join(REPORT_HEADER) + '\n')
+        totals = [0] * (len(REPORT_HEADER) - 1)
+        for code in sorted(store.chromosomes()):
+            chromosome = store.chromosome_index(code)
+            counts = [len(chromosome)]
+            counts += [int(removed[column][chromosome].sum()) if column in removed else 0
+                       for column in REPORT_HEADER[2:5]]
+            counts.append(int(keep[chromosome].sum()))
+            totals = [total + count for total, count in zip(totals, counts)]
+            report_conn.write('\t'.join([str(code)] + [str(count) for count in counts]) + '\n')
+        report_conn.write('\t'.join(["ALL"] + [str(total) for total in totals]) + '\n')
+    return keep
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Per-chromosome copies of the PLINK reference panel, staged to node-local
+scratch.
+
+`magma --bfile` reads the genome-wide panel from the shared filesystem,
+although a gene batch only covers a few chromosomes. The panel is split once
+into one bfile per chromosome (SNP-major .bed rows are copied as byte
+ranges), stored in the shared cache under the content hash of the panel.
+Batch jobs then copy the chromosomes they need into a cache on the node's
+local disk, where jobs on the same node reuse them under the cache's locks,
+and run MAGMA on a bfile of just those chromosomes. The scratch cache is
+bounded in size, as every combination of chromosomes a batch spans gets its
+own concatenated bfile.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+from bioinformatics.cache import ContentCache, inputs_hash, touch_entry
+from bioinformatics.daner_cache import chromosome_code
+from bioinformatics.provenance import file_signature
+from bioinformatics.tools.magma.resource_model import count_lines
+
+PANEL_NAMESPACE = "reference_panel"
+HASH_NAMESPACE = "reference_panel_hashes"
+BED_MAGIC = b"\x6c\x1b\x01"
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+# staged copies unused for this long are removed from scratch
+SCRATCH_MAX_AGE_DAYS = 2
+# default size bound of the scratch cache in GB
+SCRATCH_MAX_SIZE = 10
+# MAGMA opens the staged files right after staging, and files it holds open
+# survive eviction, so scratch copies only need protecting briefly
+SCRATCH_MIN_IDLE_DAYS = 1 / 24.0
+
+
+def default_scratch_dir():
+    """
+    Per-user directory on the node's local disk.
+    """
+    return os.path.join("/tmp", "ricopili_bioinformatics_{}".format(os.getuid()))
+
+
+def panel_files(prefix):
+    """
+    The .bed/.bim/.fam files of a PLINK file set, plus MAGMA's .synonyms
+    file when present.
+    """
+    files = [prefix + suffix for suffix in (".bed", ".bim", ".fam")]
+    missing = [path for path in files if not os.path.exists(path)]
+    if missing:
+        raise ValueError("Reference panel {} lacks {}".format(prefix, ", ".join(missing)))
+    if os.path.exists(prefix + ".synonyms"):
+        files.append(prefix + ".synonyms")
+    return files
+
+
+def panel_hash(prefix, cache):
+    """
+    Content hash of a reference panel. Hashing gigabytes of genotypes takes
+    a while, so the hash is kept in the cache under the files' size and
+    modification time and computed again only when they change.
+    """
+    files = panel_files(prefix)
+    signature = ";".join(file_signature(path) for path in files)
+
+    def build(directory):
+        with open(os.path.join(directory, "sha256"), 'w') as hash_conn:
+            hash_conn.write(inputs_hash(files))
+
+    entry = cache.get_or_build(HASH_NAMESPACE,
+                               hashlib.sha256(signature.encode()).hexdigest(), build)
+    with open(os.path.join(entry, "sha256")) as hash_conn:
+        return hash_conn.read().strip()
+
+
+def _copy_range(source_conn, output_conn, start, size):
+    source_conn.seek(start)
+    while size > 0:
+        block = source_conn.read(min(size, COPY_BLOCK_SIZE))
+        if not block:
+            raise ValueError("{} is truncated".format(source_conn.name))
+        output_conn.write(block)
+        size -= len(block)
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def split_panel(prefix, directory):
+    """
+    Split a SNP-major PLINK file set into `chr<code>.bed/.bim` per
+    chromosome, sharing `panel.fam` (and `panel.synonyms`). Variants on
+    chromosomes without a PLINK code are dropped. Writes `chromosomes.json`
+    with the variant count per chromosome.
+    """
+    files = panel_files(prefix)
+    bytes_per_snp = (count_lines(prefix + ".fam") + 3) // 4
+
+    # runs of consecutive variants on one chromosome, in .bim order
+    runs = []
+    bim_conns = {}
+    counts = {}
+    try:
+        with open(prefix + ".bim") as bim_conn:
+            for index, line in enumerate(bim_conn):
+                code = chromosome_code(line.split(None, 1)[0])
+                if code is None:
+                    continue
+                code = str(code)
+                if code not in bim_conns:
+                    bim_conns[code] = open(os.path.join(directory, "chr{}.bim".format(code)), 'w')
+                    counts[code] = 0
+                bim_conns[code].write(line)
+                counts[code] += 1
+                if runs and runs[-1][0] == code and runs[-1][2] == index:
+                    runs[-1][2] = index + 1
+                else:
+                    runs.append([code, index, index + 1])
+    finally:
+        for conn in bim_conns.values():
+            conn.close()
+
+    with open(prefix + ".bed", "rb") as bed_conn:
+        if bed_conn.read(len(BED_MAGIC)) != BED_MAGIC:
+            raise ValueError("{}.bed is not a SNP-major PLINK .bed file".format(prefix))
+        bed_outputs = {}
+        try:
+            for code, first, stop in runs:
+                if code not in bed_outputs:
+                    bed_outputs[code] = open(os.path.join(directory, "chr{}.bed".format(code)), "wb")
+                    bed_outputs[code].write(BED_MAGIC)
+                _copy_range(bed_conn, bed_outputs[code], len(BED_MAGIC) + first * bytes_per_snp,
+                            (stop - first) * bytes_per_snp)
+        finally:
+            for conn in bed_outputs.values():
+                conn.close()
+
+    shutil.copyfile(prefix + ".fam", os.path.join(directory, "panel.fam"))
+    if prefix + ".synonyms" in files:
+        shutil.copyfile(prefix + ".synonyms", os.path.join(directory, "panel.synonyms"))
+    with open(os.path.join(directory, "chromosomes.json"), 'w') as chromosomes_conn:
+        json.dump(counts, chromosomes_conn, indent=2)
+
+
+def split_reference_panel(prefix, cache):
+    """
+    Cache entry holding the per-chromosome split of a reference panel,
+    built on first use.
+    """
+    return cache.get_or_build(PANEL_NAMESPACE, panel_hash(prefix, cache),
+                              lambda directory: split_panel(prefix, directory))
+
+
+def _shared_files(source_dir, directory, name):
+    # the sample list and synonyms are the same for every chromosome
+    _link_or_copy(os.path.join(source_dir, "panel.fam"),
+                  os.path.join(directory, name + ".fam"))
+    if os.path.exists(os.path.join(source_dir, "panel.synonyms")):
+        _link_or_copy(os.path.join(source_dir, "panel.synonyms"),
+                      os.path.join(directory, name + ".synonyms"))
+
+
+def panel_chromosomes(panel_dir, chromosomes):
+    """
+    PLINK codes of the given chromosomes that a split panel holds, in
+    panel order.
+    """
+    with open(os.path.join(panel_dir, "chromosomes.json")) as chromosomes_conn:
+        available = json.load(chromosomes_conn)
+    return sorted(set(str(chromosome_code(str(chrom))) for chrom in chromosomes)
+                  & set(available), key=int)
+
+
+def concatenate_chromosomes(prefixes, output_prefix):
+    """
+    Write the .bed/.bim of several single-chromosome bfiles with the same
+    samples, one after another, to `output_prefix`.
+    """
+    with open(output_prefix + ".bed", "wb") as bed_conn, \
+            open(output_prefix + ".bim", "wb") as bim_conn:
+        bed_conn.write(BED_MAGIC)
+        for prefix in prefixes:
+            with open(prefix + ".bed", "rb") as source_conn:
+                source_conn.seek(len(BED_MAGIC))
+                shutil.copyfileobj(source_conn, bed_conn, COPY_BLOCK_SIZE)
+            with open(prefix + ".bim", "rb") as source_conn:
+                shutil.copyfileobj(source_conn, bim_conn, COPY_BLOCK_SIZE)
+
+
+def stage_panel(panel_dir, chromosomes, scratch_dir=None, max_size=None):
+    """
+    Stage the chromosomes of a split panel into node-local scratch and
+    return the prefix of a bfile holding exactly those chromosomes, or None
+    if the panel has none of them.
+
+    Each chromosome is copied from the shared cache once per node; a
+    multi-chromosome bfile is then assembled from the local copies. Least
+    recently used copies are evicted beyond `max_size` GB (default
+    SCRATCH_MAX_SIZE).
+    """
+    codes = panel_chromosomes(panel_dir, chromosomes)
+    if not codes:
+        return None
+
+    scratch = ContentCache(scratch_dir or default_scratch_dir(),
+                           max_bytes=int(float(max_size or SCRATCH_MAX_SIZE) * 1024 ** 3),
+                           max_age_days=SCRATCH_MAX_AGE_DAYS,
+                           min_idle_days=SCRATCH_MIN_IDLE_DAYS)
+    panel_key = os.path.basename(panel_dir)
+
+    common = scratch.get_or_build(
+        PANEL_NAMESPACE, "{}-common".format(panel_key),
+        lambda directory: _shared_files(panel_dir, directory, "panel"))
+
+    def stage_chromosome(code):
+        def build(directory):
+            name = "chr{}".format(code)
+            for suffix in (".bed", ".bim"):
+                shutil.copyfile(os.path.join(panel_dir, name + suffix),
+                                os.path.join(directory, name + suffix))
+            _shared_files(common, directory, name)
+        return scratch.get_or_build(PANEL_NAMESPACE, "{}-chr{}".format(panel_key, code), build)
+
+    staged = [stage_chromosome(code) for code in codes]
+    if len(codes) == 1:
+        return os.path.join(staged[0], "chr{}".format(codes[0]))
+
+    name = "chr" + "_".join(codes)
+
+    def assemble(directory):
+        concatenate_chromosomes([os.path.join(entry, "chr{}".format(code))
+                                 for code, entry in zip(codes, staged)],
+                                os.path.join(directory, name))
+        _shared_files(common, directory, name)
+
+    entry = scratch.get_or_build(PANEL_NAMESPACE, "{}-{}".format(panel_key, name), assemble)
+    return os.path.join(entry, name)
+
+
+def staged_reference(marker_file, chromosomes, scratch_dir=None, max_size=None):
+    """
+    `stage_panel` for the split panel referenced by a marker file written by
+    the splitting stage, stamping its cache entry as in use.
+    """
+    with open(marker_file) as marker_conn:
+        panel_dir = marker_conn.read().strip()
+    touch_entry(panel_dir)
+    return stage_panel(panel_dir, chromosomes, scratch_dir, max_size)
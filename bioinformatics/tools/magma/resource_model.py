@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Input-size-aware memory and walltime estimates for the MAGMA workflow.
+
+Before submission the daner store gives the SNP count and span of every
+chromosome, the reference panel's .fam/.bim files give its sample and variant
+counts, and the gene location file gives gene counts and lengths. Because
+genes are split into cost-balanced batches, every batch job is sized for the
+average batch plus the most expensive single gene it could contain.
+"""
+
+import math
+import os
+
+from bioinformatics.daner_cache import chromosome_code
+from bioinformatics.tools.magma.batching import gene_cost, DEFAULT_LD_BLOCK_SNPS
+
+# fixed overhead of a MAGMA process
+BASE_MEMORY_MB = 256
+# reference genotypes are held as doubles for the SNPs of one gene
+GENOTYPE_BYTES = 8
+# per-SNP cost of the p-value shard and annotation held in memory
+SNP_BYTES = 128
+# per-gene cost of a .genes.raw line held by magma --merge
+GENE_BYTES = 4096
+# read buffer of each batch file open in the streaming merge
+MERGE_BUFFER_BYTES = 64 * 1024
+HEADROOM = 1.5
+MIN_MEMORY_MB = 1024
+
+# seconds per unit of gene cost for a 500-sample reference panel
+SECONDS_PER_COST = 2e-6
+REFERENCE_SAMPLES_SCALE = 500.0
+MIN_WALLTIME_MINUTES = 10
+
+
+def count_lines(path, block_size=8 * 1024 * 1024):
+    """
+    Number of lines in a file, counted on raw blocks.
+    """
+    lines = 0
+    with open(path, "rb") as conn:
+        for block in iter(lambda: conn.read(block_size), b""):
+            lines += block.count(b"\n")
+    return lines
+
+
+def reference_panel_size(prefix):
+    """
+    (samples, variants) of a PLINK file set, or (0, 0) if it is unavailable.
+    """
+    if not (os.path.exists(prefix + ".fam") and os.path.exists(prefix + ".bim")):
+        return 0, 0
+    return count_lines(prefix + ".fam"), count_lines(prefix + ".bim")
+
+
+def gene_lengths(gene_loc_file, window_up=0, window_down=0):
+    """
+    Gene count, summed window length and longest window (bp) per chromosome
+    code of a gene location file.
+    """
+    lengths = {}
+    window = int((window_up + window_down) * 1000)
+    with open(gene_loc_file) as gene_loc_conn:
+        for line in gene_loc_conn:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            code = chromosome_code(fields[1])
+            length = int(fields[3]) - int(fields[2]) + 1 + window
+            count, total, longest = lengths.get(code, (0, 0, 0))
+            lengths[code] = (count + 1, total + length, max(longest, length))
+    return lengths
+
+
+def snp_density(store):
+    """
+    SNPs per base pair for each chromosome code in a daner store.
+    """
+    density = {}
+    for chrom in store.chromosomes():
+        index = store.chromosome_index(chrom)
+        positions = store["BP"][index]
+        span = int(positions.max()) - int(positions.min()) + 1 if len(positions) else 1
+        density[chrom] = len(index) / float(max(span, 1))
+    return density
+
+
+def format_memory(memory_mb):
+    """
+    Memory request in the cluster configuration's "<n>g"/"<n>m" style.
+    """
+    if memory_mb % 1024 == 0:
+        return "{}g".format(memory_mb // 1024)
+    return "{}m".format(memory_mb)
+
+
+def format_walltime(minutes):
+    """
+    Walltime request as HH:MM:SS.
+    """
+    minutes = int(math.ceil(minutes))
+    return "{:02d}:{:02d}:00".format(minutes // 60, minutes % 60)
+
+
+def _round_memory(memory_mb):
+    memory_mb = max(MIN_MEMORY_MB, memory_mb * HEADROOM)
+    return int(math.ceil(memory_mb / 256.0) * 256)
+
+
+def estimate_resources(store, gene_loc_file, ref_prefix, n_batches,
+                       ld_block_snps=DEFAULT_LD_BLOCK_SNPS,
+                       window_up=0, window_down=0, merger="native"):
+    """
+    Per-rule cluster settings for a MAGMA run.
+
+    Settings are per rule, not per job: every `test_gene_sets` job gets the
+    same size, the average batch plus the largest gene. Batches are only
+    made once the workflow runs, after submission settings are fixed, and
+    the cost-balanced partition keeps them close to the average.
+
+    Returns a dict in the layout of cluster_config.yaml, e.g.
+    {"test_gene_sets": {"h_vmem": "3g", "walltime": "00:40:00"}, ...}.
+    """
+    samples, _ = reference_panel_size(ref_prefix)
+    samples = samples or int(REFERENCE_SAMPLES_SCALE)
+    lengths = gene_lengths(gene_loc_file, window_up, window_down)
+    density = snp_density(store)
+
+    # average gene cost per chromosome, and the largest gene anywhere, which
+    # bounds the memory of whichever batch holds it
+    n_genes = 0
+    total_cost = 0.0
+    max_gene_snps = 1
+    for code, (count, total, longest) in lengths.items():
+        mean_snps = int(density.get(code, 0) * total / count)
+        n_genes += count
+        total_cost += count * gene_cost(mean_snps, ld_block_snps)
+        max_gene_snps = max(max_gene_snps, int(density.get(code, 0) * longest) + 1)
+
+    batch_snps = len(store) / float(max(n_batches, 1))
+    block = min(max_gene_snps, ld_block_snps)
+    test_memory = (BASE_MEMORY_MB
+                   + (samples * max_gene_snps * GENOTYPE_BYTES
+                      + block * block * GENOTYPE_BYTES
+                      + batch_snps * SNP_BYTES) / 1024.0 ** 2)
+    batch_cost = total_cost / max(n_batches, 1) + gene_cost(max_gene_snps, ld_block_snps)
+    test_minutes = max(MIN_WALLTIME_MINUTES,
+                       HEADROOM * batch_cost * SECONDS_PER_COST
+                       * samples / REFERENCE_SAMPLES_SCALE / 60.0)
+
+    if merger == "magma":
+        merge_memory = BASE_MEMORY_MB + n_genes * GENE_BYTES / 1024.0 ** 2
+    else:
+        merge_memory = BASE_MEMORY_MB + n_batches * MERGE_BUFFER_BYTES / 1024.0 ** 2
+    store_memory = BASE_MEMORY_MB + len(store) * SNP_BYTES / 1024.0 ** 2
+
+    return {"test_gene_sets": {"h_vmem": format_memory(_round_memory(test_memory)),
+                               "walltime": format_walltime(test_minutes)},
+            "merge_test_sets": {"h_vmem": format_memory(_round_memory(merge_memory)),
+                                "walltime": format_walltime(MIN_WALLTIME_MINUTES)},
+            "shard_pvalues": {"h_vmem": format_memory(_round_memory(store_memory)),
+                              "walltime": format_walltime(MIN_WALLTIME_MINUTES)},
+            "annotate_summary_stats": {"h_vmem": format_memory(_round_memory(store_memory)),
+                                       "walltime": format_walltime(MIN_WALLTIME_MINUTES)}}
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Split the cached daner into per-batch MAGMA inputs.
+
+Each MAGMA batch job only needs the p-values of the SNPs annotated to its own
+genes. The shards are produced from the memory-mapped daner store. Batches
+that share a chromosome are written by the same worker, which reads each of
+its chromosomes from the store once for all of them, so the shards together
+read the store about once and groups can be written by independent workers.
+"""
+
+import os
+import multiprocessing
+
+import numpy as np
+
+from bioinformatics.daner_cache import DanerStore, chromosome_code, write_text
+
+
+def location_chromosome(location):
+    """
+    Store key of the chromosome in a `.genes.annot` location field
+    ("X:100:200" gives "23"), or the label as written if it has no code.
+    """
+    label = location.split(b":")[0].decode()
+    code = chromosome_code(label)
+    return label if code is None else str(code)
+
+
+def read_annotation(annot_file):
+    """
+    Chromosome codes and SNPs assigned to genes in a MAGMA `.genes.annot`
+    file.
+    """
+    chromosomes = set()
+    snps = []
+    with open(annot_file, "rb") as annot_conn:
+        for line in annot_conn:
+            if line.startswith(b"#"):
+                continue
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            chromosomes.add(location_chromosome(fields[1]))
+            snps.extend(fields[2:])
+    if not snps:
+        return chromosomes, np.empty(0, dtype="S1")
+    return chromosomes, np.unique(np.asarray(snps, dtype=bytes))
+
+
+def shard_paths(shard_dir, name):
+    """
+    Paths of the p-value and SNP location shard of a batch.
+    """
+    return (os.path.join(shard_dir, "{}.pval".format(name)),
+            os.path.join(shard_dir, "{}.snp.loc".format(name)))
+
+
+def annotation_chromosomes(annot_file):
+    """
+    Chromosome codes of the genes in a MAGMA `.genes.annot` file.
+    """
+    chromosomes = set()
+    with open(annot_file, "rb") as annot_conn:
+        for line in annot_conn:
+            fields = line.split(None, 2)
+            if not line.startswith(b"#") and len(fields) > 1:
+                chromosomes.add(location_chromosome(fields[1]))
+    return chromosomes
+
+
+def shard_groups(chromosomes):
+    """
+    Group shard names so that no chromosome is shared between groups.
+    `chromosomes` maps shard names to their sets of chromosomes.
+    """
+    groups = []
+    for name, shard_chromosomes in chromosomes.items():
+        group = ([name], set(shard_chromosomes))
+        for other in [other for other in groups if other[1] & group[1]]:
+            groups.remove(other)
+            group = (other[0] + group[0], other[1] | group[1])
+        groups.append(group)
+    return [names for names, _ in groups]
+
+
+def write_shard_group(store_dir, tasks):
+    """
+    Write the p-value and SNP location shards of annotation files whose
+    genes share chromosomes, keeping only SNPs inside their gene windows.
+    `tasks` holds (annot_file, pval_file, snp_loc_file) tuples.
+
+    Returns the number of SNPs written per shard.
+    """
+    store = DanerStore(store_dir)
+    annotations = [read_annotation(task[0]) for task in tasks]
+    selected = [[] for _ in tasks]
+    for chrom in set().union(*[shard_chromosomes for shard_chromosomes, _ in annotations]):
+        if chrom not in store.meta["chromosomes"]:
+            continue
+        index = store.chromosome_index(chrom)
+        snp = store["SNP"][index]
+        for parts, (shard_chromosomes, annotated_snps) in zip(selected, annotations):
+            if chrom in shard_chromosomes:
+                parts.append(index[np.isin(snp, annotated_snps)])
+
+    counts = []
+    for (_, pval_file, snp_loc_file), parts in zip(tasks, selected):
+        index = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        snp = store["SNP"][index]
+        write_text(pval_file, [snp, store["P"][index]], header=["SNP", "P"])
+        write_text(snp_loc_file, [snp, store["CHR"][index], store["BP"][index]])
+        counts.append(len(index))
+    return counts
+
+
+def _write_shard_group(args):
+    return write_shard_group(*args)
+
+
+def write_shards(store, shard_dir, annot_files, threads=1):
+    """
+    Write a shard for each batch annotation file using up to `threads`
+    worker processes. `annot_files` maps shard names to annotation files.
+    Returns a dict of SNP counts per shard.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    groups = shard_groups({name: annotation_chromosomes(annot_file)
+                           for name, annot_file in annot_files.items()})
+    tasks = [(store.directory, [(annot_files[name],) + shard_paths(shard_dir, name)
+                                for name in group])
+             for group in groups]
+
+    if threads > 1 and len(tasks) > 1:
+        # spawn rather than fork: snakemake runs this from a threaded process
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(threads, len(tasks))) as pool:
+            counts = pool.map(_write_shard_group, tasks)
+    else:
+        counts = [_write_shard_group(task) for task in tasks]
+    return dict(zip([name for group in groups for name in group],
+                    [count for group_counts in counts for count in group_counts]))
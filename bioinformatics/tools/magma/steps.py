@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Bodies of the MAGMA workflow rules, shared by the magma and batch
+snakefiles. The two workflows lay their files out differently (batch mode
+adds an analysis directory and shares annotations between analyses), so each
+snakefile declares its own inputs and outputs and calls these with them.
+"""
+
+import os
+
+from pkg_resources import resource_filename
+
+from bioinformatics.cache import cache_from_config
+from bioinformatics.daner_cache import load_daner, opened_store
+from bioinformatics.provenance import bfile_signature
+from bioinformatics.tools.magma.annotate import GeneIndex, annotate
+from bioinformatics.tools.magma.batching import read_batch_chromosomes
+from bioinformatics.tools.magma.merge import (merge_gene_results, merge_results,
+                                              write_empty_results, write_gene_index)
+from bioinformatics.tools.magma.reference_panel import split_reference_panel, staged_reference
+from bioinformatics.tools.magma.shard import annotation_chromosomes
+
+MAGMA_BIN = resource_filename("bioinformatics.tools.magma", "resources/magma_linux/magma")
+
+# modules whose code produces stored results, part of their fingerprints
+ANNOTATE_MODULES = [__name__, "bioinformatics.tools.magma.annotate", "bioinformatics.bgzf"]
+TEST_MODULES = [__name__, "bioinformatics.tools.magma.merge", "bioinformatics.bgzf"]
+
+
+def write_marker(marker_file, directory):
+    with open(marker_file, 'w') as marker_conn:
+        marker_conn.write(directory + '\n')
+
+
+def cache_daner(daner_file, marker_file, config):
+    """
+    Parse a daner into the cache and point `marker_file` at its store.
+    """
+    write_marker(marker_file, load_daner(daner_file, cache_from_config(config)).directory)
+
+
+def split_panel(marker_file, config):
+    """
+    Split the reference panel into the cache and point `marker_file` at it.
+    """
+    write_marker(marker_file, split_reference_panel(config["ref_1000g"],
+                                                    cache_from_config(config)))
+
+
+def annotate_summary_stats(results, store_marker, output, config, suffix,
+                           snp_loc_file=None, keep_file=None):
+    """
+    Annotate the store's SNPs to genes with the native annotator, or restore
+    the annotation from the result store.
+    """
+    import numpy as np
+
+    window_up = float(config.get("gene_window_up") or 0)
+    window_down = float(config.get("gene_window_down") or 0)
+    key = results.fingerprint("annotate_summary_stats:native",
+                              [store_marker, config["ref_gene_loc"]]
+                              + ([keep_file] if keep_file else []),
+                              params={"window_up": window_up,
+                                      "window_down": window_down,
+                                      "format": suffix},
+                              modules=ANNOTATE_MODULES)
+    if not results.restore(key, output):
+        gene_index = GeneIndex(config["ref_gene_loc"], window_up, window_down)
+        annotate(opened_store(store_marker), gene_index, output[0], snp_loc_file=snp_loc_file,
+                 keep=np.load(keep_file) if keep_file else None)
+        results.save(key, output)
+
+
+def test_gene_sets(results, annot_file, pval_file, output, log_file, output_prefix,
+                   sample_size, config, suffix, batch, panel_marker=None, batch_summary=None):
+    """
+    Run MAGMA's gene test on one batch, on the batch's chromosomes of the
+    reference panel staged to scratch when `panel_marker` is given, or
+    restore its results from the result store. Batches without genes get
+    header-only results.
+    """
+    from snakemake.shell import shell
+
+    outputs = list(output) + [log_file]
+    key = results.fingerprint("test_gene_sets", [annot_file, pval_file],
+                              params={"N": sample_size,
+                                      "ref_1000g": bfile_signature(config["ref_1000g"]),
+                                      "format": suffix},
+                              binaries=[MAGMA_BIN], modules=TEST_MODULES)
+    if results.restore(key, outputs):
+        return
+    bfile = config["ref_1000g"]
+    if panel_marker:
+        chromosomes = read_batch_chromosomes(batch_summary)[batch]
+        bfile = (staged_reference(panel_marker, chromosomes, config.get("scratch_dir"),
+                                  config.get("scratch_max_size"))
+                 or bfile)
+    if annotation_chromosomes(annot_file):
+        shell("{MAGMA_BIN} --bfile {bfile} "
+              " --pval {pval_file} "
+              " N={sample_size} "
+              " --gene-annot {annot_file} "
+              " --out {output_prefix}; "
+              "mv {output_prefix}.log {log_file}")
+    else:
+        write_empty_results(output_prefix)
+        open(log_file, 'w').close()
+    if suffix:
+        for result in (".genes.out", ".genes.raw"):
+            merge_results([output_prefix + result], output_prefix + result + suffix)
+            os.remove(output_prefix + result)
+    results.save(key, outputs)
+
+
+def merge_test_sets(group_prefixes, output_prefix, output, config, suffix):
+    """
+    Merge the merge groups into the genome-wide results and index them.
+    """
+    merge_gene_results(group_prefixes, output_prefix, input_suffix=suffix)
+    write_gene_index(output[0], output[2], config["ref_gene_loc"])
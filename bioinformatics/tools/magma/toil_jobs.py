@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+MAGMA as a Toil workflow (`--mode toil`).
+
+`MakeGeneBatches` parses the daner into the shared cache, annotates the SNPs
+natively, splits the genes into cost-balanced batches and writes a p-value
+shard per batch. It then adds a `TestGeneSets` child for every batch that has
+genes, and `MergeTestSets` as a follow-on that runs once they all finished.
+
+A batch's annotation and shard are written to the file store for that batch
+alone. The per-chromosome slices of the reference panel and its sample file
+are shared by many batches, so they are imported once and read through the
+file store's cache: each worker fetches a slice once, however many batches
+it runs.
+"""
+
+import os
+import subprocess
+
+import numpy as np
+from toil.job import Job
+
+from bioinformatics.cache import cache_from_config
+from bioinformatics.daner_cache import chromosome_code, load_daner
+from bioinformatics.resources import load_cluster_config, rule_memory_mb
+from bioinformatics.tools.magma.annotate import GeneIndex, annotate
+from bioinformatics.tools.magma.batching import (batch_annot_file, batch_name, write_batches,
+                                                 read_batch_chromosomes, DEFAULT_LD_BLOCK_SNPS)
+from bioinformatics.tools.magma.merge import merge_gene_results, write_gene_index
+from bioinformatics.tools.magma.prefilter import prefilter
+from bioinformatics.tools.magma.reference_panel import (concatenate_chromosomes,
+                                                        panel_chromosomes, split_reference_panel)
+from bioinformatics.tools.magma.shard import shard_paths, write_shards
+
+
+def job_memory(config, rule):
+    """
+    Toil memory requirement of a job from the run's cluster configuration.
+    """
+    cluster_settings = load_cluster_config(config.get("cluster_config"))
+    return "{}M".format(rule_memory_mb(rule, config.get("max_mem_mb"), cluster_settings))
+
+
+def _file_uri(path):
+    return "file://" + os.path.abspath(path)
+
+
+def batch_panel(panel, chromosomes):
+    """
+    The part of an imported panel a batch on `chromosomes` reads, or None
+    if it should read the genome-wide panel.
+    """
+    codes = set(str(chromosome_code(str(chrom))) for chrom in chromosomes)
+    if panel is None or not codes & set(panel["slices"]):
+        return None
+    return {"samples": panel["samples"],
+            "slices": {code: panel["slices"][code] for code in codes if code in panel["slices"]}}
+
+
+class MakeGeneBatches(Job):
+    """
+    Annotate the daner's SNPs with gene membership, batch the genes, and fan
+    out one gene test per batch followed by the merge.
+    """
+
+    def __init__(self, config):
+        Job.__init__(self, memory=job_memory(config, "annotate_summary_stats"),
+                     cores=1, disk="4G")
+        self.config = config
+
+    def run(self, fileStore):
+        config = self.config
+        work_dir = fileStore.getLocalTempDir()
+        store = load_daner(config["daner"], cache_from_config(config))
+        gene_index = GeneIndex(config["ref_gene_loc"], float(config.get("gene_window_up") or 0),
+                               float(config.get("gene_window_down") or 0))
+
+        outputs = {}
+        snp_loc_file = os.path.join(work_dir, "snp.loc")
+        keep = None
+        if config.get("min_info") or config.get("min_maf") or config.get("gene_overlap_filter"):
+            fileStore.logToMaster("Filtering SNPs before annotation.")
+            report_file = os.path.join(work_dir, "prefilter_report.tsv")
+            prefilter(store, snp_loc_file, os.path.join(work_dir, "prefilter.keep.npy"),
+                      report_file,
+                      min_info=config.get("min_info"), min_maf=config.get("min_maf"),
+                      gene_index=gene_index if config.get("gene_overlap_filter") else None)
+            keep = np.load(os.path.join(work_dir, "prefilter.keep.npy"))
+            outputs["prefilter_report.tsv"] = fileStore.writeGlobalFile(report_file)
+
+        fileStore.logToMaster("Annotating summary statistics with gene membership.")
+        annot_file = os.path.join(work_dir, "annotate_summary_stats.genes.annot")
+        annotate(store, gene_index, annot_file, snp_loc_file=snp_loc_file, keep=keep)
+
+        n_batches = int(config.get("batches") or 22)
+        batch_dir = os.path.join(work_dir, "batches")
+        write_batches(annot_file, config["ref_gene_loc"], batch_dir, n_batches,
+                      ld_block_snps=int(config.get("ld_block_snps") or DEFAULT_LD_BLOCK_SNPS))
+        chromosomes = read_batch_chromosomes(os.path.join(batch_dir, "batches.tsv"))
+        # batches without genes have nothing to test
+        batches = [batch for batch in (batch_name(number, n_batches)
+                                       for number in range(1, n_batches + 1))
+                   if chromosomes[batch]]
+        annot_files = {batch_name(number, n_batches):
+                       batch_annot_file(batch_dir, number, n_batches)
+                       for number in range(1, n_batches + 1)}
+        shard_dir = os.path.join(work_dir, "shards")
+        write_shards(store, shard_dir, {batch: annot_files[batch] for batch in batches})
+
+        panel = self.import_reference(fileStore, set(chrom for batch in batches
+                                                     for chrom in chromosomes[batch]))
+        results = []
+        for batch in batches:
+            test = TestGeneSets(config, batch,
+                                fileStore.writeGlobalFile(annot_files[batch]),
+                                fileStore.writeGlobalFile(shard_paths(shard_dir, batch)[0]),
+                                batch_panel(panel, chromosomes[batch]))
+            self.addChild(test)
+            results.append(test.rv())
+        fileStore.logToMaster("Testing genes in {} batches.".format(len(batches)))
+
+        merge = MergeTestSets(config, results, outputs)
+        self.addFollowOn(merge)
+        return merge.rv()
+
+    def import_reference(self, fileStore, chromosomes):
+        """
+        File IDs of the split reference panel: its sample file (and
+        synonyms), and the .bed/.bim slice of each chromosome in
+        `chromosomes`. None when batches read the genome-wide panel.
+        """
+        if self.config.get("no_reference_staging"):
+            return None
+        panel_dir = split_reference_panel(self.config["ref_1000g"],
+                                          cache_from_config(self.config))
+        panel = {"samples": {}, "slices": {}}
+        for suffix in (".fam", ".synonyms"):
+            if os.path.exists(os.path.join(panel_dir, "panel" + suffix)):
+                panel["samples"][suffix] = fileStore.import_file(
+                    _file_uri(os.path.join(panel_dir, "panel" + suffix)))
+        for code in panel_chromosomes(panel_dir, chromosomes):
+            panel["slices"][code] = [
+                fileStore.import_file(_file_uri(os.path.join(panel_dir, "chr" + code + suffix)))
+                for suffix in (".bed", ".bim")]
+        return panel
+
+
+class TestGeneSets(Job):
+    """
+    Test the genes of one batch with MAGMA against the reference panel
+    slices of the batch's chromosomes.
+    """
+
+    def __init__(self, config, batch, annot_file, pval_file, panel):
+        # gene tests hold no state worth keeping, so preempted ones are rerun
+        Job.__init__(self, memory=job_memory(config, "test_gene_sets"),
+                     cores=1, disk="4G", preemptible=True)
+        self.config = config
+        self.batch = batch
+        self.annot_file = annot_file
+        self.pval_file = pval_file
+        self.panel = panel
+
+    def read_reference(self, fileStore, work_dir):
+        """
+        Local bfile prefix holding the batch's chromosomes. Slices come from
+        the worker's cache; several chromosomes are concatenated locally.
+        """
+        if self.panel is None:
+            return self.config["ref_1000g"]
+        codes = sorted(self.panel["slices"], key=int)
+
+        name = "chr" + "_".join(codes)
+        prefixes = []
+        for code in codes:
+            prefix = os.path.join(work_dir, "chr" + code if len(codes) > 1 else name)
+            for file_id, suffix in zip(self.panel["slices"][code], (".bed", ".bim")):
+                fileStore.readGlobalFile(file_id, prefix + suffix, cache=True, symlink=True)
+            prefixes.append(prefix)
+        bfile = os.path.join(work_dir, name)
+        if len(codes) > 1:
+            concatenate_chromosomes(prefixes, bfile)
+        for suffix, file_id in self.panel["samples"].items():
+            fileStore.readGlobalFile(file_id, bfile + suffix, cache=True, symlink=True)
+        return bfile
+
+    def run(self, fileStore):
+        from pkg_resources import resource_filename
+        magma_bin = resource_filename("bioinformatics.tools.magma", "resources/magma_linux/magma")
+
+        fileStore.logToMaster("Testing genes in {}".format(self.batch))
+        work_dir = fileStore.getLocalTempDir()
+        annot = fileStore.readGlobalFile(self.annot_file,
+                                         os.path.join(work_dir, self.batch + ".genes.annot"),
+                                         cache=False)
+        pval = fileStore.readGlobalFile(self.pval_file,
+                                        os.path.join(work_dir, self.batch + ".pval"), cache=False)
+        output_prefix = os.path.join(work_dir, "gene_results." + self.batch)
+        subprocess.check_call([magma_bin, "--bfile", self.read_reference(fileStore, work_dir),
+                               "--pval", pval, "N={}".format(self.config["study_sample_size"]),
+                               "--gene-annot", annot, "--out", output_prefix])
+        return {"batch": self.batch,
+                "out": fileStore.writeGlobalFile(output_prefix + ".genes.out"),
+                "raw": fileStore.writeGlobalFile(output_prefix + ".genes.raw"),
+                "log": fileStore.writeGlobalFile(output_prefix + ".log")}
+
+
+class MergeTestSets(Job):
+    """
+    Merge the batch results with the streaming merge and index them. Returns
+    the workflow's output files as {path relative to the output directory:
+    file ID}.
+    """
+
+    def __init__(self, config, batch_results, outputs):
+        Job.__init__(self, memory=job_memory(config, "merge_test_sets"), cores=1, disk="4G")
+        self.config = config
+        # TestGeneSets return values, resolved by the time this job runs
+        self.batch_results = batch_results
+        self.outputs = outputs
+
+    def run(self, fileStore):
+        fileStore.logToMaster("Merging test results.")
+        work_dir = fileStore.getLocalTempDir()
+        outputs = dict(self.outputs)
+        batch_prefixes = []
+        for result in self.batch_results:
+            prefix = os.path.join(work_dir, "gene_results." + result["batch"])
+            fileStore.readGlobalFile(result["out"], prefix + ".genes.out", cache=False)
+            fileStore.readGlobalFile(result["raw"], prefix + ".genes.raw", cache=False)
+            batch_prefixes.append(prefix)
+            outputs[os.path.join("logs", "gene_results.{}.log".format(result["batch"]))] = \
+                result["log"]
+
+        output_prefix = os.path.join(work_dir, "genomewide_test_results")
+        merge_gene_results(batch_prefixes, output_prefix)
+        write_gene_index(output_prefix + ".genes.out", output_prefix + ".genes.sqlite",
+                         self.config["ref_gene_loc"])
+        for suffix in (".genes.out", ".genes.raw", ".genes.sqlite"):
+            outputs["genomewide_test_results" + suffix] = \
+                fileStore.writeGlobalFile(output_prefix + suffix)
+        return outputs
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Clumping of GWAS results into RegionAnnotator input regions.
+
+SNPs with P below `p1` become index SNPs in order of significance. Each
+index SNP claims the SNPs within `window_kb` of it with P below `p2` that no
+earlier index SNP claimed, and, when a reference panel is given, that are in
+LD with it (r2 of at least `r2`). The region spans the positions of the
+index SNP and the SNPs it claimed, written as BP1/BP2.
+
+SNPs are sorted by position once per chromosome, so the window of every
+candidate is found with two binary searches over the whole array; each index
+SNP then only touches its own window.
+"""
+
+import os
+
+import numpy as np
+
+from bioinformatics.daner_cache import write_text
+from bioinformatics.tools.magma.reference_panel import split_reference_panel
+
+DEFAULT_P1 = 5e-8
+DEFAULT_P2 = 1e-4
+DEFAULT_WINDOW_KB = 500
+DEFAULT_R2 = 0.1
+
+# store columns copied from the index SNP after CHR, SNP, BP1, BP2 and P
+EXTRA_COLUMNS = ["N", "FRQ_A", "FRQ_U", "INFO"]
+
+# allele-2 dosage of each 2-bit PLINK genotype code, NaN for missing
+GENOTYPE_DOSAGE = np.array([0, np.nan, 1, 2])
+BYTE_DOSAGES = GENOTYPE_DOSAGE[(np.arange(256)[:, None] >> np.arange(0, 8, 2)) & 3]
+
+
+class ReferenceLD():
+    """
+    r2 between SNPs of one chromosome of a reference panel, split per
+    chromosome by `split_reference_panel`. Genotypes are read from the .bed
+    file as a memory map, only for the SNPs compared.
+    """
+
+    def __init__(self, panel_dir, code):
+        prefix = os.path.join(panel_dir, "chr{}".format(code))
+        with open(os.path.join(panel_dir, "panel.fam")) as fam_conn:
+            self.n_samples = sum(1 for _ in fam_conn)
+        with open(prefix + ".bim", "rb") as bim_conn:
+            ids = np.array([line.split(None, 2)[1] for line in bim_conn])
+        self.order = np.argsort(ids, kind="stable")
+        self.sorted_ids = ids[self.order]
+        bytes_per_snp = (self.n_samples + 3) // 4
+        self.bed = (np.memmap(prefix + ".bed", dtype=np.uint8, mode="r", offset=3,
+                              shape=(len(ids), bytes_per_snp))
+                    if len(ids) else np.empty((0, bytes_per_snp), dtype=np.uint8))
+
+    def rows(self, snps):
+        """
+        Row of each SNP ID in the panel, -1 for SNPs it lacks.
+        """
+        if not len(self.order):
+            return np.full(len(snps), -1)
+        positions = np.searchsorted(self.sorted_ids, snps).clip(0, len(self.order) - 1)
+        found = self.sorted_ids[positions] == snps
+        return np.where(found, self.order[positions], -1)
+
+    def dosages(self, rows):
+        """
+        Mean-centred dosages of the given rows, missing genotypes set to 0.
+        """
+        dosages = BYTE_DOSAGES[self.bed[rows]].reshape(len(rows), -1)[:, :self.n_samples]
+        dosages = dosages - np.nanmean(dosages, axis=1, keepdims=True)
+        return np.nan_to_num(dosages)
+
+    def r2(self, row, rows):
+        """
+        r2 of SNP `row` with each of `rows`; 0 for monomorphic SNPs.
+        """
+        index = self.dosages([row])[0]
+        others = self.dosages(rows)
+        covariance = others @ index
+        variance = (others ** 2).sum(axis=1) * (index ** 2).sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(variance > 0, covariance ** 2 / variance, 0.0)
+
+
+def clump_chromosome(bp, p, p1=DEFAULT_P1, p2=DEFAULT_P2, window_kb=DEFAULT_WINDOW_KB,
+                     ld_rows=None, ld=None, r2=DEFAULT_R2):
+    """
+    Clump the SNPs of one chromosome, given sorted by position. Only SNPs
+    with P below p2 join the clumps of other SNPs. With `ld_rows`, the row
+    of each SNP in the reference panel `ld` (-1 if absent), a SNP joins a
+    clump only if it has r2 of at least `r2` with the index SNP; index SNPs
+    missing from the panel form regions of their own.
+
+    Returns a list of (index SNP, positions of its members) in order of
+    significance.
+    """
+    window = int(window_kb * 1000)
+    starts = np.searchsorted(bp, bp - window, side="left")
+    stops = np.searchsorted(bp, bp + window, side="right")
+    # SNPs that can never be members are treated as already claimed, except
+    # by their own clump when they are index SNPs
+    claimed = p >= p2
+
+    clumps = []
+    for index in np.argsort(p, kind="stable"):
+        if p[index] >= p1:
+            break
+        if claimed[index] and p[index] < p2:
+            continue
+        members = np.arange(starts[index], stops[index])
+        members = members[~claimed[members] | (members == index)]
+        if ld_rows is not None:
+            if ld_rows[index] >= 0:
+                linked = ld_rows[members] >= 0
+                linked[linked] = ld.r2(ld_rows[index], ld_rows[members[linked]]) >= r2
+                members = members[linked | (members == index)]
+            else:
+                members = np.array([index])
+        claimed[members] = True
+        clumps.append((index, members))
+    return clumps
+
+
+def clump(store, p1=DEFAULT_P1, p2=DEFAULT_P2, window_kb=DEFAULT_WINDOW_KB,
+          r2=DEFAULT_R2, bfile=None, cache=None):
+    """
+    Clump a daner store. With the prefix of a PLINK reference panel in
+    `bfile`, clumps also require LD (the panel is split per chromosome into
+    `cache` on first use).
+
+    Returns (record indices of the index SNPs, BP1, BP2, members per clump),
+    ordered by chromosome and position.
+    """
+    panel_dir = split_reference_panel(bfile, cache) if bfile else None
+    indices, bp1, bp2, sizes = [], [], [], []
+    for code in store.chromosomes():
+        records = store.chromosome_index(code)
+        records = records[store["P"][records] < max(p1, p2)]
+        if not len(records) or store["P"][records].min() >= p1:
+            continue
+        records = records[np.argsort(store["BP"][records], kind="stable")]
+        bp = store["BP"][records]
+
+        ld, ld_rows = None, None
+        if panel_dir and os.path.exists(os.path.join(panel_dir, "chr{}.bim".format(code))):
+            ld = ReferenceLD(panel_dir, code)
+            ld_rows = ld.rows(store["SNP"][records])
+        elif panel_dir:
+            # the panel lacks the chromosome, so no SNP is in LD with another
+            ld_rows = np.full(len(records), -1)
+
+        for index, members in clump_chromosome(bp, store["P"][records], p1, p2, window_kb,
+                                               ld_rows, ld, r2):
+            indices.append(records[index])
+            bp1.append(bp[members].min())
+            bp2.append(bp[members].max())
+            sizes.append(len(members))
+
+    order = np.lexsort((np.asarray(bp1, dtype=np.int64),
+                        store["CHR"][np.asarray(indices, dtype=np.int64)]))
+    return (np.asarray(indices, dtype=np.int64)[order], np.asarray(bp1, dtype=np.int64)[order],
+            np.asarray(bp2, dtype=np.int64)[order], np.asarray(sizes, dtype=np.int64)[order])
+
+
+def write_regions(store, output_file, **options):
+    """
+    Clump a daner store and write one row per region, with the index SNP's
+    CHR, SNP, BP1, BP2, P, the other cached columns under their daner names
+    and NSNPS, the number of SNPs in the clump. Returns the number of regions.
+    """
+    indices, bp1, bp2, sizes = clump(store, **options)
+    extra = [name for name in EXTRA_COLUMNS if name in store]
+    # the daner's own names, e.g. FRQ_A_35476 for FRQ_A
+    names = [next(field for field in store.meta["header"]
+                  if field == name or field.startswith(name + "_")) for name in extra]
+    header = ["CHR", "SNP", "BP1", "BP2", "P"] + names + ["NSNPS"]
+    columns = ([store["CHR"][indices], store["SNP"][indices], bp1, bp2, store["P"][indices]]
+               + [store[name][indices] for name in extra] + [sizes])
+    write_text(output_file, columns, sep='\t', header=header)
+    return len(indices)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+"""
+In-process implementation of the RegionAnnotator operations.
+
+The gene master (`gencode.genes.txt`) and every reference set in
+`inputReference/` are loaded into per-chromosome interval indexes. User
+regions are annotated with the same overlap and gene-name joins the
+RegionAnnotator jar performs against its H2 database (see the bundled
+README), producing one sheet per output table.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from bioinformatics.bgzf import TextWriter, open_text
+from bioinformatics.cache import ContentCache, inputs_hash
+from bioinformatics.daner import DanerReader
+from bioinformatics.daner_cache import chromosome_code
+
+# bump when the stored layout of ReferenceData changes
+REFERENCE_CACHE_VERSION = 2
+
+# genes are joined to regions within this expansion, then filtered on distance
+GENE_EXPANSION = 10000000
+NEAR_GENE_DISTANCE = 100000
+
+UCSC_URL = "http://genome.ucsc.edu/cgi-bin/hgTracks?db=hg19&position={location}"
+
+
+def read_table(path):
+    """
+    Read a RegionAnnotator TSV file: "##" comment lines, a header line
+    optionally prefixed with "#", then tab-separated rows. Quotes around
+    fields are removed.
+    """
+    header = None
+    rows = []
+    with open_text(path) as table_conn:
+        for line in table_conn:
+            if line.startswith("##") or not line.strip():
+                continue
+            fields = [field.strip().strip('"') for field in line.rstrip("\n").split("\t")]
+            if header is None:
+                header = fields
+                header[0] = header[0].lstrip("#")
+            else:
+                rows.append(fields)
+    return header, rows
+
+
+def sheet_name(path):
+    """
+    Output table name of a reference file, e.g. asd.genes.txt -> ASD_GENES.
+    """
+    return os.path.splitext(os.path.basename(path))[0].replace(".", "_").upper()
+
+
+def overlaps(a0, a1, b0, b1):
+    """
+    RegionAnnotator's TwoSegmentOverlapCondition.
+    """
+    return a0 <= b1 and b0 <= a1
+
+
+class IntervalIndex():
+    """
+    Per-chromosome index over the (chr, bp1, bp2) columns of a table.
+
+    Intervals are sorted by start; `query` narrows candidates to starts
+    within the longest interval of the query window with `searchsorted` and
+    checks the ends of the remaining slice in one vectorized comparison.
+    """
+
+    def __init__(self, header, rows):
+        columns = [name.lower() for name in header]
+        chr_index = columns.index("chr")
+        bp1_index = columns.index("bp1")
+        bp2_index = columns.index("bp2")
+
+        by_chromosome = {}
+        for row_index, row in enumerate(rows):
+            code = chromosome_code(row[chr_index])
+            if code is None:
+                continue
+            by_chromosome.setdefault(code, []).append(
+                (int(float(row[bp1_index])), int(float(row[bp2_index])), row_index))
+
+        self.chromosomes = {}
+        for code, intervals in by_chromosome.items():
+            intervals.sort()
+            self._add_chromosome(code,
+                                 np.asarray([interval[0] for interval in intervals],
+                                            dtype=np.int64),
+                                 np.asarray([interval[1] for interval in intervals],
+                                            dtype=np.int64),
+                                 np.asarray([interval[2] for interval in intervals],
+                                            dtype=np.int64))
+
+    def _add_chromosome(self, code, starts, stops, index):
+        max_length = int((stops - starts).max()) if len(starts) else 0
+        self.chromosomes[code] = (starts, stops, index, max_length)
+
+    def arrays(self, prefix):
+        """
+        The index as named arrays, for `np.savez`.
+        """
+        arrays = {}
+        for code, (starts, stops, index, _) in self.chromosomes.items():
+            for name, values in (("starts", starts), ("stops", stops), ("index", index)):
+                arrays["{}/{}/{}".format(prefix, code, name)] = values
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        """
+        Rebuild an index saved with `arrays`.
+        """
+        interval_index = cls.__new__(cls)
+        interval_index.chromosomes = {}
+        for name in arrays.files:
+            parts = name.split("/")
+            if parts[0] == prefix and parts[2] == "starts":
+                code = int(parts[1])
+                interval_index._add_chromosome(
+                    code, *[arrays["{}/{}/{}".format(prefix, code, column)]
+                            for column in ("starts", "stops", "index")])
+        return interval_index
+
+    def query(self, code, start, stop):
+        """
+        Row indices of the intervals on chromosome `code` overlapping
+        [start, stop], ordered by interval start.
+        """
+        if code not in self.chromosomes:
+            return np.empty(0, dtype=np.int64)
+        starts, stops, index, max_length = self.chromosomes[code]
+        lower = np.searchsorted(starts, start - max_length, side="left")
+        upper = np.searchsorted(starts, stop, side="right")
+        hits = stops[lower:upper] >= start
+        return index[lower:upper][hits]
+
+
+class ReferenceData():
+    """
+    Gene master and reference sets loaded into interval indexes.
+    """
+
+    def __init__(self, gene_file, reference_directory):
+        tables = {sheet_name(path): read_table(path)
+                  for path in (os.path.join(reference_directory, file_name)
+                               for file_name in sorted(os.listdir(reference_directory)))
+                  if os.path.isfile(path) and path.endswith(".txt")}
+        self._index(read_table(gene_file), tables)
+
+    def _index(self, gene_table, tables, arrays=None):
+        self.gene_header, self.gene_rows = gene_table
+        self.gene_index = (IntervalIndex.from_arrays(arrays, "genes") if arrays is not None
+                           else IntervalIndex(self.gene_header, self.gene_rows))
+
+        # sheet name -> (header, rows, interval index or gene-name lookup)
+        self.references = {}
+        for name, (header, rows) in tables.items():
+            if "geneName" in header:
+                name_index = header.index("geneName")
+                by_name = {}
+                for row in rows:
+                    if row[name_index]:
+                        by_name.setdefault(row[name_index], []).append(row)
+                self.references[name] = (header, rows, by_name)
+            else:
+                self.references[name] = (header, rows,
+                                         IntervalIndex.from_arrays(arrays, name)
+                                         if arrays is not None else IntervalIndex(header, rows))
+
+    def save(self, directory):
+        """
+        Write the tables as JSON and the interval indexes as NumPy arrays.
+        Nothing is pickled, as the cache may be shared between users.
+        """
+        tables = {name: [header, rows] for name, (header, rows, _) in self.references.items()}
+        with open(os.path.join(directory, "tables.json"), "w") as tables_conn:
+            json.dump({"genes": [self.gene_header, self.gene_rows], "references": tables},
+                      tables_conn)
+        arrays = self.gene_index.arrays("genes")
+        for name, (_, _, lookup) in self.references.items():
+            if isinstance(lookup, IntervalIndex):
+                arrays.update(lookup.arrays(name))
+        np.savez(os.path.join(directory, "intervals.npz"), **arrays)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Read reference data written by `save`.
+        """
+        with open(os.path.join(directory, "tables.json")) as tables_conn:
+            tables = json.load(tables_conn)
+        reference_data = cls.__new__(cls)
+        with np.load(os.path.join(directory, "intervals.npz"), allow_pickle=False) as arrays:
+            reference_data._index(tables["genes"], tables["references"], arrays)
+        return reference_data
+
+
+def load_reference_data(gene_file, reference_directory, cache=None):
+    """
+    Load `ReferenceData` from a `ContentCache`, building and storing it only
+    once per distinct set of gene and reference files.
+    """
+    cache = cache or ContentCache()
+    key = inputs_hash([gene_file, reference_directory],
+                      extra=["native", REFERENCE_CACHE_VERSION])
+
+    def build(directory):
+        ReferenceData(gene_file, reference_directory).save(directory)
+
+    entry = cache.get_or_build("region_annotator", key, build)
+    return ReferenceData.load(entry)
+
+
+def format_regions(daner_file, output_file):
+    """
+    Convert a clumped daner into the RegionAnnotator input format: tab
+    separated, with the BP column split into BP1/BP2. Regions keep the
+    clumped order, so a ".gz" output is compressed but not indexed. Files
+    that already have BP1/BP2 columns (e.g. from `clump.write_regions`)
+    are written through unchanged.
+    """
+    reader = DanerReader(daner_file)
+    new_header = list(reader.header)
+    # regions already have both ends; single positions span one base pair
+    BP_index = None if "BP1" in new_header and "BP2" in new_header else new_header.index("BP")
+    if BP_index is not None:
+        new_header[BP_index] = "BP1"
+        new_header.insert(BP_index + 1, "BP2")
+
+    with TextWriter(output_file) as output_conn:
+        output_conn.write('\t'.join(new_header) + '\n')
+        for fields in reader.lines():
+            if BP_index is not None:
+                fields.insert(BP_index + 1, fields[BP_index])
+            output_conn.write('\t'.join(fields) + '\n')
+
+
+def read_regions(regions_file):
+    """
+    Read user regions from a TSV file with chr/bp1/bp2 columns (any case).
+    Returns the header and rows as (code, bp1, bp2, fields) tuples.
+    """
+    header, rows = read_table(regions_file)
+    columns = [name.lower() for name in header]
+    chr_index = columns.index("chr")
+    bp1_index = columns.index("bp1")
+    bp2_index = columns.index("bp2")
+
+    regions = []
+    for fields in rows:
+        code = chromosome_code(fields[chr_index])
+        regions.append((code, int(float(fields[bp1_index])),
+                        int(float(fields[bp2_index])), fields))
+    return header, regions
+
+
+def region_location(code, bp1, bp2):
+    """
+    Location string of a region, e.g. chr22:48,192,331-48,292,331.
+    """
+    return "chr{}:{:,}-{:,}".format(code, bp1, bp2)
+
+
+def annotate_regions(regions_file, reference_data):
+    """
+    Annotate user regions against loaded reference data.
+
+    Returns a list of (sheet name, header, rows) tuples.
+    """
+    header, regions = read_regions(regions_file)
+    locations = [region_location(code, bp1, bp2) for code, bp1, bp2, _ in regions]
+
+    sheets = []
+    sheets.append(("USER_INPUT", ["location", "UCSC_LINK"] + header,
+                   [[location,
+                     '=HYPERLINK("{}","UCSC")'.format(UCSC_URL.format(location=location))]
+                    + fields
+                    for location, (_, _, _, fields) in zip(locations, regions)]))
+
+    # protein coding genes within the distance threshold of each region
+    gene_header = reference_data.gene_header
+    gene_rows = reference_data.gene_rows
+    name_index = gene_header.index("geneName")
+    type_index = gene_header.index("ttype")
+    bp1_index = gene_header.index("bp1")
+    bp2_index = gene_header.index("bp2")
+    near_genes = []
+    for location, (code, bp1, bp2, _) in zip(locations, regions):
+        candidates = reference_data.gene_index.query(code, bp1 - GENE_EXPANSION,
+                                                     bp2 + GENE_EXPANSION)
+        for row_index in candidates:
+            gene = gene_rows[row_index]
+            if gene[type_index] != "protein_coding":
+                continue
+            gene_bp1 = int(gene[bp1_index])
+            gene_bp2 = int(gene[bp2_index])
+            if overlaps(bp1, bp2, gene_bp1, gene_bp2):
+                distance = 0
+            else:
+                distance = max(abs(bp1 - gene_bp2), abs(bp2 - gene_bp1))
+            if distance < NEAR_GENE_DISTANCE:
+                near_genes.append([location] + gene + [str(distance)])
+    near_header = ["location"] + gene_header + ["dist"]
+    sheets.append(("PROTEIN_CODING_GENES", near_header, near_genes))
+
+    for name, (ref_header, ref_rows, lookup) in sorted(reference_data.references.items()):
+        rows = []
+        if isinstance(lookup, IntervalIndex):
+            for location, (code, bp1, bp2, fields) in zip(locations, regions):
+                for row_index in lookup.query(code, bp1, bp2):
+                    rows.append([location] + fields + ref_rows[row_index])
+            sheets.append((name, ["location"] + header + ref_header, rows))
+        else:
+            gene_name_column = 1 + name_index
+            for near_gene in near_genes:
+                for ref_row in lookup.get(near_gene[gene_name_column], []):
+                    rows.append(near_gene + ref_row)
+            sheets.append((name, near_header + ref_header, rows))
+    return sheets
+
+
+def write_sheets(sheets, output_dir):
+    """
+    Write every sheet as `<SHEET>.tsv` in `output_dir`, plus a combined
+    `region_annotator_output.xlsx` when openpyxl is installed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for name, header, rows in sheets:
+        with open(os.path.join(output_dir, name + ".tsv"), 'w') as sheet_conn:
+            sheet_conn.write('\t'.join(header) + '\n')
+            for row in rows:
+                sheet_conn.write('\t'.join(row) + '\n')
+
+    try:
+        import openpyxl
+    except ImportError:
+        return
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, header, rows in sheets:
+        worksheet = workbook.create_sheet(title=name[:31])
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(os.path.join(output_dir, "region_annotator_output.xlsx"))
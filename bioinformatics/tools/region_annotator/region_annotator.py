@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 from bioinformatics.Tool import Tool
-from pkg_resources import resource_filename
 
 
 class RegionAnnotator(Tool):
@@ -14,9 +13,39 @@ class RegionAnnotator(Tool):
         region_annotator_parser.add_argument(
             "--daner-clump", action="store",
             dest="daner", help="The daner clump file output by ricopili common variant analysis.")
+        region_annotator_parser.add_argument(
+            "--daner", action="store", dest="gwas_daner",
+            help="The full daner file, clumped into regions before annotation "
+                 "(instead of --daner-clump).")
+        region_annotator_parser.add_argument(
+            "--clump-p1", action="store", dest="clump_p1", type=float, default=5e-8,
+            help="P-value threshold of index SNPs.")
+        region_annotator_parser.add_argument(
+            "--clump-p2", action="store", dest="clump_p2", type=float, default=1e-4,
+            help="P-value threshold of SNPs joining a region.")
+        region_annotator_parser.add_argument(
+            "--clump-kb", action="store", dest="clump_kb", type=float, default=500,
+            help="Distance in kb from an index SNP within which SNPs join its region.")
+        region_annotator_parser.add_argument(
+            "--clump-r2", action="store", dest="clump_r2", type=float, default=0.1,
+            help="Minimum r2 with the index SNP for SNPs joining its region "
+                 "(with --clump-bfile).")
+        region_annotator_parser.add_argument(
+            "--clump-bfile", action="store", dest="clump_bfile",
+            help="PLINK reference panel prefix to clump by LD as well as distance.")
+        region_annotator_parser.add_argument(
+            "--engine", action="store", dest="engine",
+            choices=["native", "jar"], default="native",
+            help="Annotate in-process or with the RegionAnnotator jar.")
 
         super().__init__(
-            snakefile=resource_filename(
-                "bioinformatics.tools.region_annotator",
-                "region_annotator.snakefile"),
+            snakefile=("bioinformatics.tools.region_annotator",
+                       "region_annotator.snakefile"),
             log_handler=None)
+
+    def prepare(self, config):
+        """
+        Annotate either a clump file or the regions clumped from a full daner.
+        """
+        if bool(config.get("daner")) == bool(config.get("gwas_daner")):
+            raise Exception("Pass either --daner-clump or --daner")
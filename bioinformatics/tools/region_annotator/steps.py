@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Bodies of the RegionAnnotator workflow rules, shared by the region_annotator
+and batch snakefiles.
+"""
+
+from bioinformatics.cache import cache_from_config
+from bioinformatics.tools.region_annotator.engine import (load_reference_data,
+                                                          annotate_regions as annotate,
+                                                          write_sheets)
+
+# modules whose code produces stored results, part of their fingerprints
+REGION_MODULES = [__name__, "bioinformatics.tools.region_annotator.engine",
+                  "bioinformatics.bgzf"]
+
+
+def annotate_regions(results, regions_file, gene_data_file, reference_directory, output_dir,
+                     config):
+    """
+    Annotate formatted regions with the native engine, or restore the
+    sheets from the result store. The reference data is loaded from the
+    shared cache, built only once.
+    """
+    key = results.fingerprint("annotate_regions:native",
+                              [regions_file, gene_data_file, reference_directory],
+                              modules=REGION_MODULES)
+    if not results.restore(key, [output_dir]):
+        reference_data = load_reference_data(gene_data_file, reference_directory,
+                                             cache_from_config(config))
+        write_sheets(annotate(regions_file, reference_data), output_dir)
+        results.save(key, [output_dir])
@@ -9,8 +9,14 @@ setup(name="ricopili_bioinformatics",
       author_email='',
       license="MIT",
       packages=find_packages(),
-      install_requires=["snakemake", "pyyaml"],
+      install_requires=["snakemake>=7.0,<8.0", "pyyaml", "numpy"],
+      extras_require={"xlsx": ["openpyxl"], "toil": ["toil"]},
       scripts=["bioinformatics/bioinformatics"],
+      entry_points={
+          "bioinformatics.tools":
+          ["magma = bioinformatics.tools.magma.magma:Magma",
+           "region_annotator = bioinformatics.tools.region_annotator.region_annotator:RegionAnnotator",
+           "batch = bioinformatics.tools.batch.batch:Batch"]},
       package_data={
           "bioinformatics.config":
           ["cluster_config.yaml"],
@@ -18,6 +24,8 @@ setup(name="ricopili_bioinformatics",
           ["magma.snakefile",
            "resources/magma_linux/magma",
            "resources/magma_linux/reference_data/NCBI37.3.gene.loc"],
+          "bioinformatics.tools.batch":
+          ["batch.snakefile"],
           "bioinformatics.tools.region_annotator":
           ["region_annotator.snakefile",
            "resources/RegionAnnotator-1.6.1/inputGene/gencode.genes.txt",
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from bioinformatics.cache import ContentCache
+from bioinformatics.daner_cache import load_daner
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+CHR22_DANER = os.path.join(RESOURCES, "pgc_scz_chr22_subset.daner")
+CHR22_GENE_LOC = os.path.join(RESOURCES, "50_chr22_genes.NCBI37.3.gene.loc")
+
+
+@pytest.fixture(scope="session")
+def cache(tmp_path_factory):
+    return ContentCache(str(tmp_path_factory.mktemp("cache")))
+
+
+@pytest.fixture(scope="session")
+def chr22_store(cache):
+    return load_daner(CHR22_DANER, cache)
+
+
+def read_daner_rows(daner_file):
+    """
+    (SNP, CHR, BP, P) of every row of a daner, parsed without the package.
+    """
+    with open(daner_file) as daner_conn:
+        header = daner_conn.readline().split()
+        columns = [header.index(name) for name in ("SNP", "CHR", "BP", "P")]
+        rows = []
+        for line in daner_conn:
+            fields = line.split()
+            snp, chrom, bp, p = (fields[column] for column in columns)
+            rows.append((snp, int(chrom), int(bp), float(p)))
+    return rows
@@ -1,8 +1,11 @@
 #!/usr/bin/env bash
+# Genome-wide SCZ MAGMA run with Toil on UGER; rerunning restarts from the job store.
 
-python ./src/toil/toil_magma.py \
-        --daner-file /psych/ripke/share/vasa/daner_PGC_SCZ49_1000G-frq.sh2_mds10.gz \
-        --sample-size 2000 \
-        --backend gridEngine \
+bioinformatics --mode toil \
+        --cluster-env broad \
         --output-dir /home/unix/vassily/projects/pgc/ricopili_extension/toil_testing/toil_output/ \
-        --file-store /psych/ripke/share/vasa/toil_testing/toil_file_store/ 
+        --job-store /psych/ripke/share/vasa/toil_testing/toil_file_store/ \
+        magma \
+                --daner /psych/ripke/share/vasa/daner_PGC_SCZ49_1000G-frq.sh2_mds10.gz \
+                --ref-1000g "${REF_1000G:?set REF_1000G to the MAGMA 1000 Genomes reference prefix}" \
+                --sample-size 2000
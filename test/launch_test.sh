@@ -1,7 +1,10 @@
 #!/usr/bin/env bash
+# MAGMA on the chr22 subset with Toil on UGER; rerunning restarts from the job store.
 
-python ./src/toil/toil_magma.py \
-	--daner-file  /home/unix/vassily/projects/pgc/ricopili_extension/ricopili_bioinformatics/test/resources/pgc_scz_chr22_subset.daner \
-	--sample-size 2000 \
-	--backend gridEngine \
-	--output-dir /home/unix/vassily/projects/pgc/ricopili_extension/toil_testing/toil_output/
+bioinformatics --mode toil \
+	--cluster-env broad \
+	--output-dir /home/unix/vassily/projects/pgc/ricopili_extension/toil_testing/toil_output/ \
+	magma \
+		--daner /home/unix/vassily/projects/pgc/ricopili_extension/ricopili_bioinformatics/test/resources/pgc_scz_chr22_subset.daner \
+		--ref-1000g "${REF_1000G:?set REF_1000G to the MAGMA 1000 Genomes reference prefix}" \
+		--sample-size 2000
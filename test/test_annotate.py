@@ -0,0 +1,114 @@
+import os
+import subprocess
+
+import pytest
+from pkg_resources import resource_filename
+
+from bioinformatics.bgzf import open_text
+from bioinformatics.daner_cache import load_daner, write_snp_loc
+from bioinformatics.tools.magma.annotate import GeneIndex, annotate
+
+from conftest import CHR22_DANER, CHR22_GENE_LOC, RESOURCES, read_daner_rows
+
+MAGMA_BIN = resource_filename("bioinformatics.tools.magma", "resources/magma_linux/magma")
+# small snp.loc and gene.loc, and the annotation magma --annotate window=2,1
+# writes for them, covering window edges on both strands, overlapping genes
+# and a gene without SNPs
+FIXTURE_DIR = os.path.join(RESOURCES, "magma_annotate")
+
+
+def read_annot(annot_file):
+    with open_text(annot_file) as annot_conn:
+        return {fields[0]: (fields[1], fields[2:])
+                for fields in (line.split() for line in annot_conn if not line.startswith("#"))}
+
+
+def window_scan(gene_loc_file, rows, window_up, window_down):
+    """
+    Genes and their SNPs in position order, by testing every SNP against
+    every gene window.
+    """
+    genes = {}
+    with open(gene_loc_file) as gene_loc_conn:
+        for line in gene_loc_conn:
+            gene, chrom, start, stop, strand = line.split()[:5]
+            start, stop = int(start), int(stop)
+            up, down = int(window_up * 1000), int(window_down * 1000)
+            if strand == "-":
+                up, down = down, up
+            members = sorted((bp, order) for order, (_, snp_chrom, bp, _) in enumerate(rows)
+                             if snp_chrom == int(chrom) and bp > 0
+                             and max(start - up, 0) <= bp <= stop + down)
+            if members:
+                genes[gene] = ("{}:{}:{}".format(chrom, start, stop),
+                               [rows[order][0] for _, order in members])
+    return genes
+
+
+@pytest.mark.parametrize("window_up, window_down", [(0, 0), (35, 10)])
+def test_annotate_matches_window_scan(chr22_store, tmp_path, window_up, window_down):
+    annot_file = str(tmp_path / "chr22.genes.annot.gz")
+    gene_index = GeneIndex(CHR22_GENE_LOC, window_up, window_down)
+    n_genes = annotate(chr22_store, gene_index, annot_file)
+
+    expected = window_scan(CHR22_GENE_LOC, read_daner_rows(CHR22_DANER), window_up, window_down)
+    assert read_annot(annot_file) == expected
+    assert n_genes == len(expected)
+
+
+def test_annotate_keep_mask(chr22_store, tmp_path):
+    keep = chr22_store["P"][:] < 0.5
+    annot_file = str(tmp_path / "kept.genes.annot")
+    annotate(chr22_store, GeneIndex(CHR22_GENE_LOC), annot_file, keep=keep)
+
+    kept = set(snp.decode() for snp in chr22_store["SNP"][keep])
+    for _, snps in read_annot(annot_file).values():
+        assert set(snps) <= kept
+
+
+def fixture_store(cache, tmp_path):
+    """
+    Store of the parity fixture's SNPs, from a daner written next to it.
+    """
+    daner_file = str(tmp_path / "fixture.daner")
+    with open(os.path.join(FIXTURE_DIR, "snp.loc")) as snp_loc_conn, \
+            open(daner_file, "w") as daner_conn:
+        daner_conn.write("CHR\tSNP\tBP\tA1\tA2\tP\n")
+        for line in snp_loc_conn:
+            snp, chrom, bp = line.split()
+            daner_conn.write("\t".join([chrom, snp, bp, "A", "G", "0.5"]) + "\n")
+    return load_daner(daner_file, cache)
+
+
+def read_lines(path):
+    with open_text(path) as text_conn:
+        return text_conn.read().splitlines()
+
+
+def test_annotate_matches_fixture(cache, tmp_path, monkeypatch):
+    # the inputs are named as on the magma command line that wrote the fixture
+    store = fixture_store(cache, tmp_path)
+    monkeypatch.chdir(FIXTURE_DIR)
+    native_file = str(tmp_path / "native.genes.annot")
+    annotate(store, GeneIndex("genes.loc", 2, 1), native_file, snp_loc_file="snp.loc")
+    assert read_lines(native_file) == read_lines("expected.genes.annot")
+
+
+@pytest.mark.skipif(not os.access(MAGMA_BIN, os.X_OK), reason="MAGMA binary not installed")
+def test_fixture_matches_magma(tmp_path, monkeypatch):
+    monkeypatch.chdir(FIXTURE_DIR)
+    subprocess.check_call([MAGMA_BIN, "--annotate", "window=2,1", "--snp-loc", "snp.loc",
+                           "--gene-loc", "genes.loc", "--out", str(tmp_path / "magma")])
+    assert read_lines(str(tmp_path / "magma.genes.annot")) == \
+        read_lines("expected.genes.annot")
+
+
+@pytest.mark.skipif(not os.access(MAGMA_BIN, os.X_OK), reason="MAGMA binary not installed")
+def test_annotate_matches_magma(chr22_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    write_snp_loc(chr22_store, "snp.loc")
+    subprocess.check_call([MAGMA_BIN, "--annotate", "window=35,10", "--snp-loc", "snp.loc",
+                           "--gene-loc", CHR22_GENE_LOC, "--out", "magma"])
+    annotate(chr22_store, GeneIndex(CHR22_GENE_LOC, 35, 10), "native.genes.annot",
+             snp_loc_file="snp.loc")
+    assert read_lines("native.genes.annot") == read_lines("magma.genes.annot")
@@ -0,0 +1,150 @@
+import os
+import random
+
+from bioinformatics.bgzf import INDEX_SUFFIX
+from bioinformatics.daner_cache import load_daner
+from bioinformatics.tools.magma.annotate import GeneIndex, annotate
+from bioinformatics.tools.magma.batching import (batch_annot_file, batch_name, partition,
+                                                 read_annotation_sizes, read_batch_chromosomes,
+                                                 read_gene_order, write_batches)
+from bioinformatics.tools.magma.shard import (annotation_chromosomes, shard_groups, shard_paths,
+                                              write_shards)
+
+from conftest import CHR22_GENE_LOC
+
+
+def batch_costs(costs, assignment):
+    totals = {}
+    for cost, batch in zip(costs, assignment):
+        totals[batch] = totals.get(batch, 0) + cost
+    return totals
+
+
+def test_partition_is_contiguous_and_balanced():
+    rng = random.Random(0)
+    costs = [rng.randint(1, 1000) for _ in range(2000)]
+    assignment = partition(costs, 22)
+
+    assert assignment == sorted(assignment)
+    assert set(assignment) == set(range(1, 23))
+    average = sum(costs) / 22.0
+    for total in batch_costs(costs, assignment).values():
+        assert abs(total - average) < 0.05 * average
+
+
+def test_partition_equal_costs():
+    assignment = partition([1] * 100, 10)
+    assert list(batch_costs([1] * 100, assignment).values()) == [10] * 10
+
+
+def test_partition_isolates_expensive_gene():
+    assert partition([1, 1, 1, 100, 1, 1, 1, 1], 3) == [1, 1, 1, 2, 3, 3, 3, 3]
+
+
+def test_partition_fewer_genes_than_batches():
+    assert partition([5, 1, 3], 10) == [1, 2, 3]
+    assert partition([], 4) == []
+
+
+def test_write_batches(chr22_store, tmp_path):
+    annot_file = str(tmp_path / "chr22.genes.annot")
+    annotate(chr22_store, GeneIndex(CHR22_GENE_LOC), annot_file)
+    batch_dir = str(tmp_path / "batches")
+    n_batches = 60
+    write_batches(annot_file, CHR22_GENE_LOC, batch_dir, n_batches)
+
+    genes = []
+    for batch in range(1, n_batches + 1):
+        genes.extend(gene for gene, _, _ in
+                     read_annotation_sizes(batch_annot_file(batch_dir, batch, n_batches)))
+    assert genes == [gene for gene, _, _ in read_annotation_sizes(annot_file)]
+
+    chromosomes = read_batch_chromosomes(os.path.join(batch_dir, "batches.tsv"))
+    empty = [name for name, batch_chromosomes in chromosomes.items() if not batch_chromosomes]
+    assert len(empty) == n_batches - len(genes)
+    for name in empty:
+        with open(os.path.join(batch_dir, name + ".genes.annot")) as batch_conn:
+            assert all(line.startswith("#") for line in batch_conn)
+
+
+def test_shard_groups():
+    groups = shard_groups({"a": {"1"}, "b": {"1", "2"}, "c": {"3"}, "d": {"2"}, "e": set()})
+    assert sorted(sorted(group) for group in groups) == [["a", "b", "d"], ["c"], ["e"]]
+
+
+def test_write_shards(chr22_store, tmp_path):
+    annot_file = str(tmp_path / "chr22.genes.annot")
+    annotate(chr22_store, GeneIndex(CHR22_GENE_LOC), annot_file)
+    batch_dir = str(tmp_path / "batches")
+    write_batches(annot_file, CHR22_GENE_LOC, batch_dir, 6)
+    annot_files = {batch_name(batch, 6): batch_annot_file(batch_dir, batch, 6)
+                   for batch in range(1, 7)}
+    shard_dir = str(tmp_path / "shards")
+    counts = write_shards(chr22_store, shard_dir, annot_files)
+
+    p_values = dict(zip(chr22_store["SNP"][:].astype(str), chr22_store["P"][:]))
+    for name, annot_file in annot_files.items():
+        annotated = set()
+        with open(annot_file) as annot_conn:
+            for line in annot_conn:
+                if not line.startswith("#"):
+                    annotated.update(line.split()[2:])
+        with open(shard_paths(shard_dir, name)[0]) as pval_conn:
+            assert pval_conn.readline().split() == ["SNP", "P"]
+            rows = [line.split() for line in pval_conn]
+        assert set(snp for snp, _ in rows) == annotated
+        assert len(rows) == counts[name]
+        assert all(float(p) == p_values[snp] for snp, p in rows)
+
+
+def test_write_shards_non_autosomal(cache, tmp_path):
+    # daners code X as 23, gene locations and annotations label it X
+    daner_file = str(tmp_path / "x.daner")
+    with open(daner_file, "w") as daner_conn:
+        daner_conn.write("CHR\tSNP\tBP\tA1\tA2\tP\n")
+        for i in range(10):
+            daner_conn.write("22\trs22_{0}\t{1}\tA\tG\t0.{0}1\n".format(i, 1000 + i * 100))
+        for i in range(10):
+            daner_conn.write("23\trsX_{0}\t{1}\tA\tG\t0.{0}2\n".format(i, 5000 + i * 100))
+    gene_loc_file = str(tmp_path / "x.gene.loc")
+    with open(gene_loc_file, "w") as gene_loc_conn:
+        gene_loc_conn.write("1\t22\t1000\t2000\t+\tG22\n")
+        gene_loc_conn.write("2\tX\t5000\t6000\t+\tGX\n")
+    store = load_daner(daner_file, cache)
+
+    annot_file = str(tmp_path / "x.genes.annot")
+    annotate(store, GeneIndex(gene_loc_file), annot_file)
+    batch_dir = str(tmp_path / "batches")
+    write_batches(annot_file, gene_loc_file, batch_dir, 2)
+    annot_files = {batch_name(batch, 2): batch_annot_file(batch_dir, batch, 2)
+                   for batch in (1, 2)}
+    assert annotation_chromosomes(annot_files["batch2_2"]) == {"23"}
+    counts = write_shards(store, str(tmp_path / "shards"), annot_files)
+    assert counts == {"batch1_2": 10, "batch2_2": 10}
+
+
+def test_read_gene_order(tmp_path):
+    # the merge's order: X (23) before Y (24), 2 before 10
+    gene_loc_file = str(tmp_path / "order.gene.loc")
+    with open(gene_loc_file, "w") as gene_loc_conn:
+        for gene, chrom, start in [("y1", "Y", 100), ("x1", "X", 200), ("x2", "X", 50),
+                                   ("a10", "10", 10), ("a2", "2", 500), ("y2", "Y", 10)]:
+            gene_loc_conn.write("{}\t{}\t{}\t{}\t+\t{}\n".format(gene, chrom, start,
+                                                                 start + 10, gene))
+    order = read_gene_order(gene_loc_file)
+    assert sorted(order, key=order.get) == ["a2", "a10", "x2", "x1", "y2", "y1"]
+
+
+def test_write_batches_from_index(chr22_store, tmp_path):
+    # batches read their slices of an indexed annotation, with the same result
+    plain_file = str(tmp_path / "chr22.genes.annot")
+    indexed_file = plain_file + ".gz"
+    for annot_file in (plain_file, indexed_file):
+        annotate(chr22_store, GeneIndex(CHR22_GENE_LOC, 35, 10), annot_file)
+    assert os.path.exists(indexed_file + INDEX_SUFFIX)
+    write_batches(plain_file, CHR22_GENE_LOC, str(tmp_path / "plain"), 7)
+    write_batches(indexed_file, CHR22_GENE_LOC, str(tmp_path / "indexed"), 7)
+    for name in sorted(os.listdir(str(tmp_path / "plain"))):
+        with open(str(tmp_path / "plain" / name)) as plain_conn, \
+                open(str(tmp_path / "indexed" / name)) as indexed_conn:
+            assert indexed_conn.read() == plain_conn.read()
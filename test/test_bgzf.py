@@ -0,0 +1,90 @@
+import gzip
+import os
+
+from bioinformatics.bgzf import BLOCK_SIZE, INDEX_SUFFIX, IndexedReader, TextWriter, open_text
+
+HEADER = "# CHR START STOP NAME\n"
+
+
+def make_rows():
+    """
+    Rows on three chromosomes, long enough to span several BGZF blocks,
+    with overlapping intervals of varying length.
+    """
+    rows = []
+    for chrom in ("22", "3", "X"):
+        for i in range(3000):
+            start = i * 150
+            rows.append((chrom, start, start + (i % 7) * 500, "row{}_{}".format(chrom, i)))
+    return rows
+
+
+def write_rows(path, rows, columns=(0, 1, 2)):
+    with TextWriter(path, columns=columns) as writer:
+        writer.write(HEADER)
+        # several calls per chromosome, as the annotator writes its chunks
+        for first in range(0, len(rows), 1000):
+            chunk = rows[first:first + 1000]
+            writer.write_records("".join("{} {} {} {}\n".format(*row) for row in chunk),
+                                 [row[0] for row in chunk], [row[1] for row in chunk],
+                                 [row[2] for row in chunk])
+
+
+def lines(rows):
+    return ["{} {} {} {}\n".format(*row) for row in rows]
+
+
+def test_round_trip(tmp_path):
+    rows = make_rows()
+    path = str(tmp_path / "rows.txt.gz")
+    write_rows(path, rows)
+    text = HEADER + "".join(lines(rows))
+    assert len(text) > 3 * BLOCK_SIZE
+    with gzip.open(path, "rt") as gzip_conn:
+        assert gzip_conn.read() == text
+    with open_text(path) as text_conn:
+        assert text_conn.read() == text
+    with IndexedReader(path) as reader:
+        assert reader.header() == [HEADER]
+        assert reader.chromosomes() == ["22", "3", "X"]
+
+
+def test_plain_text_is_not_indexed(tmp_path):
+    rows = make_rows()[:10]
+    path = str(tmp_path / "rows.txt")
+    write_rows(path, rows)
+    with open_text(path) as text_conn:
+        assert text_conn.read() == HEADER + "".join(lines(rows))
+    assert not os.path.exists(path + INDEX_SUFFIX)
+
+
+def test_fetch_annotation_column(tmp_path):
+    # MAGMA annotation style: one "chromosome:start:stop" column
+    rows = make_rows()
+    path = str(tmp_path / "annot.txt.gz")
+    text = ["{0[3]} {0[0]}:{0[1]}:{0[2]}\n".format(row) for row in rows]
+    with TextWriter(path, columns=1) as writer:
+        writer.write_records("".join(text), [row[0] for row in rows],
+                             [row[1] for row in rows], [row[2] for row in rows])
+    with IndexedReader(path) as reader:
+        assert reader.header() == []
+        expected = [line for line, row in zip(text, rows)
+                    if row[0] == "X" and row[1] <= 30000 and row[2] >= 20000]
+        assert list(reader.fetch("X", 20000, 30000)) == expected
+
+
+def test_fetch_regions(tmp_path):
+    rows = make_rows()
+    path = str(tmp_path / "rows.txt.gz")
+    write_rows(path, rows)
+    with IndexedReader(path) as reader:
+        for chrom in ("22", "3", "X"):
+            assert list(reader.fetch(chrom)) == lines([row for row in rows if row[0] == chrom])
+        # regions inside the first window, across block and window boundaries,
+        # and past the last row
+        for start, stop in [(0, 100), (16000, 17000), (97000, 260000), (449000, 460000),
+                            (500000, 600000)]:
+            expected = [row for row in rows
+                        if row[0] == "3" and row[1] <= stop and row[2] >= start]
+            assert list(reader.fetch("3", start, stop)) == lines(expected)
+        assert list(reader.fetch("7")) == []
@@ -0,0 +1,67 @@
+import os
+import time
+
+from bioinformatics.cache import ContentCache, file_lock, LOCK_SUFFIX
+
+
+def build_file(size):
+    def build(directory):
+        with open(os.path.join(directory, "data"), "w") as data_conn:
+            data_conn.write("x" * size)
+    return build
+
+
+def age(entry, days):
+    then = time.time() - days * 86400
+    os.utime(entry + ".access", (then, then))
+
+
+def test_get_or_build_builds_once(tmp_path):
+    cache = ContentCache(str(tmp_path))
+    calls = []
+
+    def build(directory):
+        calls.append(directory)
+        build_file(10)(directory)
+
+    entry = cache.get_or_build("test/v1", "key", build)
+    assert cache.get_or_build("test/v1", "key", build) == entry
+    assert len(calls) == 1
+    assert cache.get("test/v1", "key") == entry
+    assert cache.get("test/v1", "other") is None
+    # access times are kept outside the published entry
+    assert sorted(os.listdir(entry)) == ["data"]
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ContentCache(str(tmp_path), max_bytes=150)
+    old = cache.get_or_build("test/v1", "old", build_file(100))
+    age(old, 3)
+    new = cache.get_or_build("test/v1", "new", build_file(100))
+
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+    assert [entry for _, _, entry in cache.entries()] == [new]
+
+
+def test_evict_keeps_entries_in_use(tmp_path):
+    cache = ContentCache(str(tmp_path), max_bytes=150)
+    recent = cache.get_or_build("test/v1", "recent", build_file(100))
+    age(recent, 1)
+    cache.get_or_build("test/v1", "new", build_file(100))
+    # over the size limit, but used within min_idle_days
+    assert os.path.exists(recent)
+
+    age(recent, 3)
+    with file_lock(recent + LOCK_SUFFIX, shared=True):
+        assert cache.evict() == []
+    assert cache.evict() == [recent]
+
+
+def test_evict_by_age(tmp_path):
+    cache = ContentCache(str(tmp_path), max_age_days=1, min_idle_days=0)
+    entry = cache.get_or_build("test/v1", "entry", build_file(10))
+    assert cache.evict() == []
+    age(entry, 2)
+    assert cache.evict() == [entry]
+    assert not os.path.exists(entry + ".access")
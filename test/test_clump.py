@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+
+from bioinformatics.tools.magma.reference_panel import BED_MAGIC
+from bioinformatics.tools.region_annotator.clump import ReferenceLD, clump_chromosome
+
+# PLINK 2-bit code of each allele-2 dosage
+DOSAGE_CODE = {0: 0, 1: 2, 2: 3}
+MISSING_CODE = 1
+
+
+def write_panel(panel_dir, code, snps, genotypes):
+    """
+    A split reference panel holding one chromosome; `genotypes` has a row
+    of allele-2 dosages per SNP, NaN for missing.
+    """
+    n_samples = genotypes.shape[1]
+    with open(os.path.join(panel_dir, "panel.fam"), "w") as fam_conn:
+        for sample in range(n_samples):
+            fam_conn.write("f{0} i{0} 0 0 1 -9\n".format(sample))
+    with open(os.path.join(panel_dir, "chr{}.bim".format(code)), "w") as bim_conn:
+        for position, snp in enumerate(snps, start=1):
+            bim_conn.write("{} {} 0 {} A G\n".format(code, snp, position * 100))
+    with open(os.path.join(panel_dir, "chr{}.bed".format(code)), "wb") as bed_conn:
+        bed_conn.write(BED_MAGIC)
+        for row in genotypes:
+            codes = [MISSING_CODE if np.isnan(dosage) else DOSAGE_CODE[int(dosage)]
+                     for dosage in row]
+            codes += [0] * (-len(codes) % 4)
+            bed_conn.write(bytes(sum(code << (2 * shift) for shift, code in
+                                     enumerate(codes[start:start + 4]))
+                                 for start in range(0, len(codes), 4)))
+
+
+def brute_force_r2(x, y):
+    # missing genotypes imputed with the SNP's mean dosage
+    x = np.where(np.isnan(x), np.nanmean(x), x)
+    y = np.where(np.isnan(y), np.nanmean(y), y)
+    if x.std() == 0 or y.std() == 0:
+        return 0.0
+    return np.corrcoef(x, y)[0, 1] ** 2
+
+
+def test_r2(tmp_path):
+    rng = np.random.RandomState(3)
+    n_samples = 37
+    base = rng.randint(0, 3, n_samples).astype(float)
+    genotypes = np.array([base,
+                          np.where(rng.rand(n_samples) < 0.2, rng.randint(0, 3, n_samples),
+                                   base),
+                          rng.randint(0, 3, n_samples),
+                          np.ones(n_samples)])
+    genotypes[1, [4, 9]] = np.nan
+    snps = ["rs4", "rs1", "rs3", "rs2"]
+    write_panel(str(tmp_path), 22, snps, genotypes)
+
+    ld = ReferenceLD(str(tmp_path), 22)
+    assert ld.n_samples == n_samples
+    assert list(ld.rows(np.array([b"rs2", b"rs9", b"rs4"]))) == [3, -1, 0]
+    r2 = ld.r2(0, [0, 1, 2, 3])
+    expected = [brute_force_r2(genotypes[0], genotypes[row]) for row in range(4)]
+    assert np.allclose(r2, expected)
+    # the last SNP is monomorphic
+    assert r2[3] == 0
+
+
+def test_clump_chromosome_window():
+    bp = np.array([1000, 50000, 120000, 700000, 720000])
+    p = np.array([1e-3, 1e-9, 1e-5, 1e-8, 0.5])
+    clumps = clump_chromosome(bp, p, p1=5e-8, p2=1e-2, window_kb=100)
+    assert [(index, list(members)) for index, members in clumps] == \
+        [(1, [0, 1, 2]), (3, [3])]
+
+
+def test_clump_chromosome_p2_below_p1():
+    # SNPs with p2 <= P < p1 lead clumps of their own but join no other
+    bp = np.array([1000, 2000, 3000, 4000])
+    p = np.array([1e-9, 1e-5, 1e-7, 1e-3])
+    clumps = clump_chromosome(bp, p, p1=1e-4, p2=1e-6, window_kb=100)
+    assert [(index, list(members)) for index, members in clumps] == \
+        [(0, [0, 2]), (1, [1])]
+
+
+def test_clump_chromosome_ld(tmp_path):
+    rng = np.random.RandomState(5)
+    base = rng.randint(0, 3, 50).astype(float)
+    genotypes = np.array([base, base, rng.randint(0, 3, 50), base])
+    write_panel(str(tmp_path), 1, ["rs1", "rs2", "rs3", "rs4"], genotypes)
+    ld = ReferenceLD(str(tmp_path), 1)
+
+    bp = np.array([100, 200, 300, 400, 500])
+    p = np.array([1e-9, 1e-6, 1e-8, 1e-5, 1e-6])
+    ld_rows = ld.rows(np.array([b"rs1", b"rs2", b"rs3", b"rs4", b"rs5"]))
+    clumps = clump_chromosome(bp, p, p1=5e-8, p2=1e-4, window_kb=10,
+                              ld_rows=ld_rows, ld=ld, r2=0.5)
+    # rs3 is not in LD with rs1 and leads its own clump; rs5 is not in the
+    # panel, so it joins neither
+    assert [(index, list(members)) for index, members in clumps] == \
+        [(0, [0, 1, 3]), (2, [2])]
@@ -0,0 +1,95 @@
+import json
+import os
+
+import yaml
+from snakemake import snakemake
+
+from bioinformatics.job_array import (ArrayRunner, format_walltime_seconds, planned_jobs,
+                                      task_arguments)
+from bioinformatics.resources import parse_walltime_seconds
+
+# a workflow shaped like the MAGMA one: packed stages, an array phase of
+# three batches and a merge on the submit host
+SNAKEFILE = """
+OUT = config["output_dir"]
+BATCHES = ["batch1", "batch2", "batch3"]
+
+rule all:
+    input: OUT + "merged.txt"
+
+rule split:
+    output: OUT + "chunk{chunk}.txt"
+    run:
+        open(output[0], "w").close()
+
+rule prepare:
+    input: expand(OUT + "chunk{chunk}.txt", chunk=[1, 2])
+    output: OUT + "prepared.txt"
+    run:
+        open(output[0], "w").close()
+
+rule test_gene_sets:
+    input: OUT + "prepared.txt"
+    output: OUT + "gene_results.{batch}.txt"
+    run:
+        open(output[0], "w").close()
+
+rule merge_test_sets:
+    input: expand(OUT + "gene_results.{batch}.txt", batch=BATCHES)
+    output: OUT + "merged.txt"
+    run:
+        open(output[0], "w").close()
+"""
+
+
+def write_workflow(tmp_path):
+    output_dir = str(tmp_path / "out") + "/"
+    os.makedirs(output_dir + ".config")
+    snakefile = str(tmp_path / "Snakefile")
+    with open(snakefile, "w") as snakefile_conn:
+        snakefile_conn.write(SNAKEFILE)
+    config = {"output_dir": output_dir, "cluster_config": None}
+    config_file = output_dir + ".config/config.yaml"
+    with open(config_file, "w") as config_conn:
+        yaml.dump(config, config_conn)
+    return snakefile, config, config_file
+
+
+def test_planned_jobs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    snakefile, _, config_file = write_workflow(tmp_path)
+    assert planned_jobs(snakefile, config_file) == \
+        {"all": 1, "split": 2, "prepare": 1, "test_gene_sets": 3, "merge_test_sets": 1}
+    assert planned_jobs(snakefile, config_file, omit_from=["test_gene_sets"]) == \
+        {"split": 2, "prepare": 1}
+
+
+def test_array_spec(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    snakefile, config, config_file = write_workflow(tmp_path)
+    output_dir = config["output_dir"]
+    batches = [[output_dir + "gene_results.batch{}.txt".format(batch)] for batch in (1, 2, 3)]
+    runner = ArrayRunner(snakefile, config, config_file, "broad",
+                         [("test_gene_sets", batches)])
+    os.makedirs(runner.array_dir)
+    for submission in runner.submissions:
+        runner.write_spec(submission)
+    with open(os.path.join(runner.array_dir, "prepare.json")) as spec_conn:
+        prepare = json.load(spec_conn)
+    with open(os.path.join(runner.array_dir, "test_gene_sets.json")) as spec_conn:
+        array = json.load(spec_conn)
+
+    # the packed job runs the three stages before the array, one after another
+    assert prepare["tasks"] == [None] and prepare["omit_from"] == ["test_gene_sets"]
+    assert runner.resources(runner.submissions[0]) == \
+        ("1024m", format_walltime_seconds(3 * parse_walltime_seconds("5:00")))
+    assert snakemake(dryrun=True, quiet=True, **task_arguments(prepare, 1))
+
+    # array tasks each run one batch, and only once the packed job is done
+    assert array["tasks"] == batches and array["rules"] == ["test_gene_sets"]
+    assert runner.resources(runner.submissions[1]) == \
+        ("5120m", format_walltime_seconds(parse_walltime_seconds("10:00")))
+    assert not snakemake(dryrun=True, quiet=True, **task_arguments(array, 2))
+    assert snakemake(**task_arguments(prepare, 1))
+    assert planned_jobs(snakefile, config_file, array["tasks"][1]) == {"test_gene_sets": 1}
+    assert snakemake(dryrun=True, quiet=True, **task_arguments(array, 2))
@@ -0,0 +1,27 @@
+import pytest
+
+from bioinformatics.tools.batch.manifest import read_manifest
+
+from conftest import CHR22_DANER
+
+
+def write_manifest(tmp_path, names):
+    manifest_file = str(tmp_path / "manifest.tsv")
+    with open(manifest_file, "w") as manifest_conn:
+        manifest_conn.write("name\tdaner\tsample_size\n")
+        for name in names:
+            manifest_conn.write("{}\t{}\t1000\n".format(name, CHR22_DANER))
+    return manifest_file
+
+
+def test_read_manifest(tmp_path):
+    analyses = read_manifest(write_manifest(tmp_path, ["scz", "scz_loo.1"]))
+    assert list(analyses) == ["scz", "scz_loo.1"]
+    assert analyses["scz"] == {"daner": CHR22_DANER, "sample_size": "1000",
+                               "daner_clump": None}
+
+
+@pytest.mark.parametrize("name", ["shared", "logs", "benchmarks", ".config", "..", "a/b"])
+def test_rejected_names(tmp_path, name):
+    with pytest.raises(ValueError, match="Line 2"):
+        read_manifest(write_manifest(tmp_path, [name]))
@@ -0,0 +1,89 @@
+import os
+import random
+
+from bioinformatics.bgzf import IndexedReader, open_text
+from bioinformatics.tools.magma.merge import (EMPTY_RESULTS, GeneResultIndex, merge_gene_results,
+                                              merge_groups, write_empty_results,
+                                              write_gene_index)
+
+GENES_OUT_HEADER = EMPTY_RESULTS[".genes.out"]
+
+
+def make_genes(n_genes=300):
+    """
+    Genes in genomic order: numeric chromosome order puts 2 before 10 and X
+    (23) last, unlike string order.
+    """
+    genes = []
+    for chrom in ("2", "10", "X"):
+        for i in range(n_genes // 3):
+            start = 1000 + i * 5000
+            genes.append(("{}{:04d}".format(chrom, i), chrom, start, start + 3000 + i))
+    return genes
+
+
+def write_batch(prefix, genes):
+    with open(prefix + ".genes.out", "w") as out_conn:
+        out_conn.write(GENES_OUT_HEADER)
+        for gene, chrom, start, stop in genes:
+            out_conn.write("{} {} {} {} 10 2 1000 1.5 0.06\n".format(gene, chrom, start, stop))
+    with open(prefix + ".genes.raw", "w") as raw_conn:
+        raw_conn.write(EMPTY_RESULTS[".genes.raw"])
+        for gene, chrom, start, stop in genes:
+            raw_conn.write("{} {} {} {} 10 2 1000 0.5\n".format(gene, chrom, start, stop))
+
+
+def gene_ids(path):
+    with open_text(path) as result_conn:
+        return [line.split()[0] for line in result_conn
+                if not line.startswith("#") and not line.startswith("GENE")]
+
+
+def test_merge_gene_results(tmp_path):
+    genes = make_genes()
+    # batches take interleaved genes, each batch staying in genomic order
+    random.seed(1)
+    assignment = [random.randrange(5) for _ in genes]
+    prefixes = [str(tmp_path / "batch{}".format(batch)) for batch in range(6)]
+    for batch, prefix in enumerate(prefixes[:5]):
+        write_batch(prefix, [gene for gene, other in zip(genes, assignment) if other == batch])
+    write_empty_results(prefixes[5])
+
+    # directly, and in two levels as the workflow does with merge groups
+    output = str(tmp_path / "merged")
+    merge_gene_results(prefixes, output, output_suffix=".gz")
+    groups = merge_groups(prefixes, fan_in=4)
+    for name, group in groups.items():
+        merge_gene_results(group, str(tmp_path / name), output_suffix=".gz")
+    two_level = str(tmp_path / "two_level")
+    merge_gene_results([str(tmp_path / name) for name in sorted(groups)], two_level,
+                       input_suffix=".gz")
+
+    expected = [gene for gene, _, _, _ in genes]
+    for suffix in (".genes.out.gz", ".genes.raw.gz"):
+        assert gene_ids(output + suffix) == expected
+    for suffix in (".genes.out", ".genes.raw"):
+        assert gene_ids(two_level + suffix) == expected
+    with IndexedReader(output + ".genes.out.gz") as reader:
+        assert reader.header() == [GENES_OUT_HEADER]
+        assert reader.chromosomes() == ["2", "10", "23"]
+        assert [line.split()[0] for line in reader.fetch(10, 6000, 12000)] == \
+            ["100001", "100002"]
+
+    index_file = str(tmp_path / "merged.sqlite")
+    assert write_gene_index(output + ".genes.out.gz", index_file) == len(genes)
+    index = GeneResultIndex(index_file)
+    assert index.gene("X0000")["chr"] == 23
+    assert [row["gene"] for row in index.region("10", 6000, 12000)] == ["100001", "100002"]
+    index.close()
+
+
+def test_merge_empty_batches(tmp_path):
+    prefixes = [str(tmp_path / "batch{}".format(batch)) for batch in range(2)]
+    for prefix in prefixes:
+        write_empty_results(prefix)
+    output = str(tmp_path / "merged")
+    merge_gene_results(prefixes, output)
+    with open(output + ".genes.out") as out_conn:
+        assert out_conn.read() == GENES_OUT_HEADER
+    assert os.path.getsize(output + ".genes.raw") > 0
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from bioinformatics.daner_cache import load_daner
+from bioinformatics.tools.magma.prefilter import prefilter
+
+from conftest import CHR22_DANER
+
+
+def test_prefilter_min_info(tmp_path, chr22_store):
+    keep = prefilter(chr22_store, str(tmp_path / "snp.loc"), str(tmp_path / "keep.npy"),
+                     str(tmp_path / "report.tsv"), min_info=0.9)
+    with open(CHR22_DANER) as daner_conn:
+        header = daner_conn.readline().split()
+        info = np.array([float(line.split()[header.index("INFO")]) for line in daner_conn])
+    assert (keep == (info >= 0.9)).all()
+    with open(str(tmp_path / "snp.loc")) as snp_loc_conn:
+        assert len(snp_loc_conn.readlines()) == keep.sum()
+    with open(str(tmp_path / "report.tsv")) as report_conn:
+        total = report_conn.readlines()[-1].split()
+    assert total == ["ALL", str(len(keep)), str((~keep).sum()), "0", "0", str(keep.sum())]
+
+
+def test_prefilter_missing_info(tmp_path, cache):
+    daner_file = str(tmp_path / "no_info.daner")
+    with open(CHR22_DANER) as daner_conn, open(daner_file, "w") as output_conn:
+        for line in daner_conn:
+            fields = line.split("\t")
+            output_conn.write("\t".join(fields[:7] + fields[8:]))
+    store = load_daner(daner_file, cache)
+    with pytest.raises(ValueError, match="INFO"):
+        prefilter(store, str(tmp_path / "snp.loc"), str(tmp_path / "keep.npy"),
+                  str(tmp_path / "report.tsv"), min_info=0.9)
+    assert not (tmp_path / "snp.loc").exists()
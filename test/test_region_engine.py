@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+
+from bioinformatics.tools.region_annotator.engine import (IntervalIndex, ReferenceData,
+                                                          annotate_regions, read_table,
+                                                          write_sheets)
+
+GENE_HEADER = ["chr", "bp1", "bp2", "geneName", "entrez", "ensembl", "ttype", "strand",
+               "product"]
+GENES = [["chr1", "1000000", "1010000", "GENEA", "1", "E1", "protein_coding", "+", "a"],
+         ["chr1", "1050000", "1060000", "GENEB", "2", "E2", "antisense", "+", "b"],
+         ["chr1", "1080000", "1090000", "GENEC", "3", "E3", "protein_coding", "-", "c"],
+         ["chr1", "5000000", "5100000", "GENED", "4", "E4", "protein_coding", "+", "d"],
+         ["chr2", "1000000", "1010000", "GENEE", "5", "E5", "protein_coding", "+", "e"],
+         ["chrX", "200000", "300000", "GENEX", "6", "E6", "protein_coding", "+", "x"]]
+CNV_HEADER = ["chr", "bp1", "bp2", "disease", "type", "note"]
+CNVS = [["chr1", "900000", "1005000", "dev.delay", "del", "ends at R1"],
+        ["chr1", "1005001", "1100000", "dev.delay", "dup", "starts after R1"],
+        ["chrX", "100000", "250000", "scz", "del", "ends at R2"],
+        ["chr2", "1300000", "1400000", "scz", "dup", "starts at R3's end"]]
+ASD_HEADER = ["chr", "bp1", "bp2", "geneName", "type"]
+ASD = [["chr1", "1000000", "1010000", "GENEA", "t1"],
+       ["chr1", "1080000", "1090000", "GENEC", "t2"],
+       ["chr2", "1000000", "1010000", "GENEE", "t3"],
+       ["chr3", "1", "2", "", "no gene name"]]
+REGION_HEADER = ["CHR", "SNP", "BP1", "BP2", "P"]
+REGIONS = [["1", "rs1", "1005000", "1005000", "1e-9"],
+           ["23", "rsX", "250000", "260000", "2e-8"],
+           ["2", "rs2", "1200000", "1300000", "3e-8"]]
+
+
+def write_table(path, header, rows):
+    with open(path, "w") as table_conn:
+        table_conn.write("## test table\n")
+        table_conn.write("#" + "\t".join(header) + "\n")
+        for row in rows:
+            table_conn.write("\t".join('"{}"'.format(field) if " " in field else field
+                                       for field in row) + "\n")
+
+
+def write_reference(tmp_path):
+    gene_file = str(tmp_path / "genes.txt")
+    write_table(gene_file, GENE_HEADER, GENES)
+    reference_dir = tmp_path / "reference"
+    reference_dir.mkdir()
+    write_table(str(reference_dir / "psychiatric.cnvs.txt"), CNV_HEADER, CNVS)
+    write_table(str(reference_dir / "asd.genes.txt"), ASD_HEADER, ASD)
+    regions_file = str(tmp_path / "regions.tsv")
+    with open(regions_file, "w") as regions_conn:
+        for row in [REGION_HEADER] + REGIONS:
+            regions_conn.write("\t".join(row) + "\n")
+    return gene_file, str(reference_dir), regions_file
+
+
+def two_segment_overlap(a0, a1, b0, b1):
+    # the jar's TwoSegmentOverlapCondition, as written in its README
+    return ((a0 <= b0 and b0 <= a1) or (a0 <= b1 and b1 <= a1)
+            or (b0 <= a0 and a0 <= b1) or (b0 <= a1 and a1 <= b1))
+
+
+def test_interval_index():
+    rng = np.random.RandomState(7)
+    starts = rng.randint(0, 100000, 300)
+    rows = [["chr{}".format(rng.choice(["1", "2", "X"])), str(start),
+             str(start + rng.randint(0, 5000))] for start in starts]
+    index = IntervalIndex(["chr", "bp1", "bp2"], rows)
+    for _ in range(50):
+        chrom = rng.choice(["1", "2", "X"])
+        code = 23 if chrom == "X" else int(chrom)
+        start = rng.randint(0, 100000)
+        stop = start + rng.randint(0, 3000)
+        expected = [row_index for row_index, row in enumerate(rows)
+                    if row[0] == "chr" + chrom
+                    and two_segment_overlap(start, stop, int(row[1]), int(row[2]))]
+        hits = index.query(code, start, stop)
+        assert sorted(hits) == expected
+        assert [int(rows[hit][1]) for hit in hits] == sorted(int(rows[hit][1]) for hit in hits)
+
+
+def test_annotate_regions(tmp_path):
+    gene_file, reference_dir, regions_file = write_reference(tmp_path)
+    sheets = annotate_regions(regions_file, ReferenceData(gene_file, reference_dir))
+    assert [name for name, _, _ in sheets] == \
+        ["USER_INPUT", "PROTEIN_CODING_GENES", "ASD_GENES", "PSYCHIATRIC_CNVS"]
+    sheets = {name: (header, rows) for name, header, rows in sheets}
+
+    r1, r2, r3 = "chr1:1,005,000-1,005,000", "chr23:250,000-260,000", "chr2:1,200,000-1,300,000"
+    assert sheets["USER_INPUT"] == (
+        ["location", "UCSC_LINK"] + REGION_HEADER,
+        [[location, '=HYPERLINK("http://genome.ucsc.edu/cgi-bin/hgTracks?db=hg19&position={}",'
+                    '"UCSC")'.format(location)] + region
+         for location, region in zip([r1, r2, r3], REGIONS)])
+
+    # protein coding genes within 100 kb, by the jar's distance: the larger of
+    # the two region-to-gene end distances, 0 on overlap. GENEB is not
+    # protein coding, GENED is too far, and GENEE is 190 kb from R3's start
+    # but 300 kb by that distance
+    near_header = ["location"] + GENE_HEADER + ["dist"]
+    near = [[r1] + GENES[0] + ["0"], [r1] + GENES[2] + ["85000"], [r2] + GENES[5] + ["0"]]
+    assert sheets["PROTEIN_CODING_GENES"] == (near_header, near)
+    # gene-name sheets join the near genes, interval sheets the regions
+    assert sheets["ASD_GENES"] == (near_header + ASD_HEADER,
+                                   [near[0] + ASD[0], near[1] + ASD[1]])
+    assert sheets["PSYCHIATRIC_CNVS"] == (
+        ["location"] + REGION_HEADER + CNV_HEADER,
+        [[r1] + REGIONS[0] + CNVS[0], [r2] + REGIONS[1] + CNVS[2],
+         [r3] + REGIONS[2] + CNVS[3]])
+
+
+def test_reference_data_round_trip(tmp_path):
+    gene_file, reference_dir, regions_file = write_reference(tmp_path)
+    reference_data = ReferenceData(gene_file, reference_dir)
+    saved_dir = str(tmp_path / "saved")
+    os.makedirs(saved_dir)
+    reference_data.save(saved_dir)
+    assert sorted(os.listdir(saved_dir)) == ["intervals.npz", "tables.json"]
+    assert annotate_regions(regions_file, ReferenceData.load(saved_dir)) == \
+        annotate_regions(regions_file, reference_data)
+
+
+def test_write_sheets(tmp_path):
+    gene_file, reference_dir, regions_file = write_reference(tmp_path)
+    sheets = annotate_regions(regions_file, ReferenceData(gene_file, reference_dir))
+    output_dir = str(tmp_path / "output")
+    write_sheets(sheets, output_dir)
+    for name, header, rows in sheets:
+        assert read_table(os.path.join(output_dir, name + ".tsv")) == (header, rows)
@@ -0,0 +1,44 @@
+from bioinformatics.daner_cache import load_daner
+from bioinformatics.tools.magma.resource_model import estimate_resources
+
+
+def write_inputs(tmp_path, n_samples=10000):
+    """
+    10000 SNPs every 10 bp on chromosome 1, one gene spanning them all and
+    a reference panel of `n_samples` samples.
+    """
+    daner_file = str(tmp_path / "dense.daner")
+    with open(daner_file, "w") as daner_conn:
+        daner_conn.write("CHR\tSNP\tBP\tA1\tA2\tP\n")
+        for i in range(1, 10001):
+            daner_conn.write("1\trs{0}\t{1}\tA\tG\t0.5\n".format(i, i * 10))
+    gene_loc_file = str(tmp_path / "dense.gene.loc")
+    with open(gene_loc_file, "w") as gene_loc_conn:
+        gene_loc_conn.write("1\t1\t1\t100000\t+\tG1\n")
+    ref_prefix = str(tmp_path / "ref")
+    with open(ref_prefix + ".fam", "w") as fam_conn:
+        fam_conn.writelines("f{0} i{0} 0 0 1 -9\n".format(i) for i in range(n_samples))
+    with open(ref_prefix + ".bim", "w") as bim_conn:
+        bim_conn.write("1 rs1 0 10 A G\n")
+    return daner_file, gene_loc_file, ref_prefix
+
+
+def test_estimate_resources(cache, tmp_path):
+    daner_file, gene_loc_file, ref_prefix = write_inputs(tmp_path)
+    store = load_daner(daner_file, cache)
+
+    # the gene holds 10001 SNPs at most: 10000 samples x 10001 SNPs of
+    # doubles, a 1000 x 1000 LD block and the batch's SNPs, plus 256 MB
+    # overhead, is 1028 MB; with 1.5x headroom, rounded up to 256 MB, 1792 MB.
+    # The batch costs 1e7 for its average gene plus 10001 x 1000 for the
+    # largest, at 2e-6 s per unit scaled by 10000 / 500 samples: 13.3
+    # minutes, 20 with headroom, rounded up
+    plan = estimate_resources(store, gene_loc_file, ref_prefix, 1)
+    assert plan["test_gene_sets"] == {"h_vmem": "1792m", "walltime": "00:21:00"}
+    # the streaming merge and the store stages fit the minimum
+    for rule in ("merge_test_sets", "shard_pvalues", "annotate_summary_stats"):
+        assert plan[rule] == {"h_vmem": "1g", "walltime": "00:10:00"}
+
+    # more batches share the average cost, and each still fits the largest gene
+    plan = estimate_resources(store, gene_loc_file, ref_prefix, 4)
+    assert plan["test_gene_sets"] == {"h_vmem": "1792m", "walltime": "00:13:00"}
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from bioinformatics.Tool import Tool
+from bioinformatics.toil_runner import JOB_STORE, check_restart, config_fingerprint, run_toil
+
+from conftest import CHR22_DANER
+
+
+def test_restart_fingerprint(tmp_path):
+    config = {"daner": CHR22_DANER, "batches": 4, "output_dir": str(tmp_path), "cores": 2}
+    fingerprint_file = str(tmp_path / "toil_jobstore.config_fingerprint")
+    with open(fingerprint_file, "w") as fingerprint_conn:
+        fingerprint_conn.write(config_fingerprint(config) + "\n")
+
+    # resources may change on a restart, the work may not
+    check_restart(fingerprint_file, config_fingerprint(dict(config, cores=8)))
+    with pytest.raises(Exception, match="other options"):
+        check_restart(fingerprint_file, config_fingerprint(dict(config, batches=5)))
+    with pytest.raises(Exception, match="other options"):
+        check_restart(str(tmp_path / "missing"), config_fingerprint(config))
+
+
+def write_output(job, text):
+    path = job.fileStore.getLocalTempFile()
+    with open(path, "w") as output_conn:
+        output_conn.write(text)
+    return {"out.txt": job.fileStore.writeGlobalFile(path)}
+
+
+class WriteOutput(Tool):
+    """
+    A tool whose Toil workflow is one job sized like the MAGMA merge.
+    """
+
+    def toil_root(self, config):
+        from toil.job import Job
+        from bioinformatics.tools.magma.toil_jobs import job_memory
+
+        return Job.wrapJobFn(write_output, "done\n", memory=job_memory(config, "merge_test_sets"),
+                             cores=1, disk="10M")
+
+
+def test_single_machine_run(tmp_path, capsys, monkeypatch):
+    pytest.importorskip("toil")
+    from toil.job import Job
+
+    # workers import this module, and the package, in a fresh interpreter
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(
+        [package_dir] + [path for path in [os.environ.get("PYTHONPATH")] if path]))
+
+    # the bundled 10g merge request is capped at --max-mem
+    output_dir = str(tmp_path / "out") + "/"
+    config = {"output_dir": output_dir, "max_mem": "1g", "cores": 1}
+    WriteOutput(None, None).execute("toil", None, config)
+    with open(output_dir + "out.txt") as output_conn:
+        assert output_conn.read() == "done\n"
+    assert not os.path.exists(output_dir + JOB_STORE)
+
+    # a request beyond the machine is reported, not raised
+    config = {"output_dir": str(tmp_path), "max_mem_mb": 1024, "cores": 1}
+    tool = WriteOutput(None, None)
+    tool.toil_root = lambda config: Job.wrapJobFn(write_output, "", memory="100G", cores=1,
+                                                  disk="10M")
+    assert run_toil(tool, None, config) is None
+    assert "rerun with a --max-mem" in capsys.readouterr().out